@@ -0,0 +1,273 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+
+# Admission control for upstream generations (per worker process).
+# ADMISSION_MAX_INFLIGHT generations run at once; up to ADMISSION_MAX_QUEUE more
+# wait at most ADMISSION_QUEUE_TIMEOUT seconds for a slot, then are shed with 429.
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+
+# Per-client token bucket on /api/query: RATE_LIMIT_PER_MINUTE sustained, bursts of
+# RATE_LIMIT_BURST. Set RATE_LIMIT_PER_MINUTE=0 to disable.
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+# Idle client buckets kept in memory
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+# Proxies in front of the app that append the caller's address to X-Forwarded-For
+# (1 on Render). 0 uses the peer address and ignores the header.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+# Comma-separated API tokens that get a bucket of their own; any other token is ignored
+API_TOKENS = frozenset(token.strip() for token in os.getenv("API_TOKENS", "").split(",") if token.strip())
+
+
+class Rejected(Exception):
+    """Raised when a request is not admitted; `retry_after` is a hint in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class _AdmissionState:
+    """Slot accounting shared by the thread and asyncio controllers. Caller holds the lock."""
+
+    def __init__(self, max_inflight, max_queue, queue_timeout):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.inflight = 0
+        self.waiters = deque()
+        # Moving average of how long a slot is held, for Retry-After estimates
+        self.avg_hold = 5.0
+
+    def enabled(self):
+        return self.max_inflight > 0
+
+    def retry_after(self):
+        return self.avg_hold * (len(self.waiters) + 1) / max(1, self.max_inflight)
+
+    def record_hold(self, seconds):
+        self.avg_hold = 0.9 * self.avg_hold + 0.1 * seconds
+
+    def publish(self):
+        metrics.ADMISSION_INFLIGHT.set(self.inflight)
+        metrics.ADMISSION_QUEUED.set(len(self.waiters))
+
+    def stats(self):
+        return {
+            'inflight': self.inflight,
+            'queued': len(self.waiters),
+            'max_inflight': self.max_inflight,
+            'max_queue': self.max_queue,
+            'queue_timeout': self.queue_timeout,
+        }
+
+
+class Slot:
+    """An admitted generation; release() exactly once when it ends."""
+    __slots__ = ('_controller', '_acquired_at', '_released')
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._acquired_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(time.monotonic() - self._acquired_at)
+
+
+class AdmissionController:
+    """Caps concurrent upstream generations with a bounded FIFO wait queue (threads)."""
+
+    def __init__(self, max_inflight=ADMISSION_MAX_INFLIGHT, max_queue=ADMISSION_MAX_QUEUE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self._state = _AdmissionState(max_inflight, max_queue, queue_timeout)
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a slot only if one is free right now and nobody is queued; else return None."""
+        with self._lock:
+            state = self._state
+            if state.enabled() and (state.inflight >= state.max_inflight or state.waiters):
+                return None
+            state.inflight += 1
+            state.publish()
+        return Slot(self)
+
+    def acquire(self):
+        """Take a slot, waiting in line up to queue_timeout; raise Rejected when shed."""
+        start = time.monotonic()
+        with self._lock:
+            state = self._state
+            if not state.enabled() or (state.inflight < state.max_inflight and not state.waiters):
+                state.inflight += 1
+                state.publish()
+                return Slot(self)
+            if len(state.waiters) >= state.max_queue:
+                metrics.ADMISSION_REJECTIONS.inc(label_value='queue_full')
+                raise Rejected('queue_full', state.retry_after())
+            waiter = [threading.Event(), False]
+            state.waiters.append(waiter)
+            state.publish()
+        waiter[0].wait(state.queue_timeout)
+        with self._lock:
+            if not waiter[1]:
+                # Timed out before a slot was handed over
+                state.waiters.remove(waiter)
+                state.publish()
+                metrics.ADMISSION_REJECTIONS.inc(label_value='queue_timeout')
+                raise Rejected('queue_timeout', state.retry_after())
+        metrics.ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start)
+        return Slot(self)
+
+    def _release(self, held):
+        with self._lock:
+            state = self._state
+            state.record_hold(held)
+            if state.waiters:
+                # Hand the slot straight to the oldest waiter
+                waiter = state.waiters.popleft()
+                waiter[1] = True
+                waiter[0].set()
+            else:
+                state.inflight -= 1
+            state.publish()
+
+    def stats(self):
+        with self._lock:
+            return self._state.stats()
+
+
+class AsyncAdmissionController:
+    """asyncio counterpart of AdmissionController for use on a single event loop."""
+
+    def __init__(self, max_inflight=ADMISSION_MAX_INFLIGHT, max_queue=ADMISSION_MAX_QUEUE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self._state = _AdmissionState(max_inflight, max_queue, queue_timeout)
+
+    def try_acquire(self):
+        state = self._state
+        if state.enabled() and (state.inflight >= state.max_inflight or state.waiters):
+            return None
+        state.inflight += 1
+        state.publish()
+        return Slot(self)
+
+    async def acquire(self):
+        # asyncio is imported where used, so the threaded server never loads it
+        import asyncio
+        start = time.monotonic()
+        state = self._state
+        if not state.enabled() or (state.inflight < state.max_inflight and not state.waiters):
+            state.inflight += 1
+            state.publish()
+            return Slot(self)
+        if len(state.waiters) >= state.max_queue:
+            metrics.ADMISSION_REJECTIONS.inc(label_value='queue_full')
+            raise Rejected('queue_full', state.retry_after())
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        state.publish()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), state.queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                state.waiters.remove(waiter)
+                waiter.cancel()
+                state.publish()
+                metrics.ADMISSION_REJECTIONS.inc(label_value='queue_timeout')
+                raise Rejected('queue_timeout', state.retry_after())
+        except asyncio.CancelledError:
+            # The client went away while queued: give back a slot handed to us, or leave the line
+            if waiter.done() and not waiter.cancelled():
+                self._release(0.0)
+            else:
+                state.waiters.remove(waiter)
+                waiter.cancel()
+                state.publish()
+            raise
+        metrics.ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start)
+        return Slot(self)
+
+    def _release(self, held):
+        state = self._state
+        state.record_hold(held)
+        while state.waiters:
+            waiter = state.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                state.publish()
+                return
+        state.inflight -= 1
+        state.publish()
+
+    def stats(self):
+        return self._state.stats()
+
+
+class RateLimiter:
+    """Per-client token buckets, keyed by API token or client IP."""
+
+    def __init__(self, per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.rate = per_minute / 60.0
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def check(self, client):
+        """Spend one token for `client`; raise Rejected with the wait until the next token."""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = [self.burst, now]
+                self._buckets[client] = bucket
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                return
+            wait = (1.0 - bucket[0]) / self.rate
+        metrics.ADMISSION_REJECTIONS.inc(label_value='rate_limited')
+        raise Rejected('rate_limited', wait)
+
+
+def client_ip(headers, remote_addr, trusted_hops=TRUSTED_PROXY_HOPS):
+    """The caller's address: the X-Forwarded-For entry added by the outermost trusted proxy, else the peer.
+
+    Entries left of that one are supplied by the client and are never trusted.
+    """
+    if trusted_hops > 0:
+        hops = [hop.strip() for hop in headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+        if len(hops) >= trusted_hops:
+            return hops[-trusted_hops]
+    return remote_addr or 'unknown'
+
+
+def client_key(headers, remote_addr, tokens=API_TOKENS):
+    """Identify the caller: a known API token if one is sent, else the client IP (see client_ip())."""
+    token = headers.get('X-API-Token')
+    if not token:
+        auth = headers.get('Authorization', '')
+        if auth.lower().startswith('bearer '):
+            token = auth[7:].strip()
+    if token and token in tokens:
+        return 'token:' + hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+    return 'ip:' + client_ip(headers, remote_addr)
@@ -0,0 +1,203 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# Cache limits, configurable per deployment
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 60 * 60)))
+
+# Signs, comparisons and percents change what is asked ("HER2+" / "HER2-",
+# "HbA1c >9%" / "<9%"), so they stay in the key as tokens of their own; other
+# punctuation is dropped. A hyphen between two word characters ("non-small")
+# joins words rather than marking a sign.
+_WORD_HYPHEN_RE = re.compile(r"(?<=\w)-(?=\w)")
+_SYMBOL_RE = re.compile(r"[-+<>=%±≤≥]")
+_PUNCTUATION_RE = re.compile(r"[^\w\s\-+<>=%±≤≥]+")
+
+
+def normalize_query(text):
+    """Normalize a question so trivially different spellings share a cache key.
+
+    Applies unicode NFKC folding, case folding, strips sentence punctuation and
+    collapses whitespace: "What is TAVR?" and "what is  tavr ?" both become
+    "what is tavr", while "HER2+" and "HER2-" become "her2 +" and "her2 -".
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _WORD_HYPHEN_RE.sub(" ", text)
+    text = _PUNCTUATION_RE.sub(" ", text)
+    text = _SYMBOL_RE.sub(r" \g<0> ", text)
+    return " ".join(text.split())
+
+
+def estimate_size(value):
+    """Approximate the number of bytes a cached value occupies."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, dict):
+        return sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    return 64
+
+
+class AnswerCache:
+    """Thread-safe LRU cache of answers bounded by total byte size, with per-entry TTL.
+
+    Keys are normalized with normalize_query(), so callers pass the raw question.
+    An optional `backend` (e.g. disk_cache.DiskCache) acts as a shared second tier:
+    memory misses are looked up there and every write goes through to it.
+    An optional `index` (e.g. similarity_index.SimilarityIndex) is told about
+    every key that enters or leaves the memory tier.
+    """
+
+    def __init__(self, max_bytes=ANSWER_CACHE_MAX_BYTES, default_ttl=ANSWER_CACHE_TTL, backend=None, index=None):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.backend = backend
+        self.index = index
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, question):
+        """Return the cached value for `question`, or None if it is missing or stale."""
+        key = normalize_query(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at is None or expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+                self.expirations += 1
+        if self.backend is not None:
+            found = self.backend.get(key)
+            if found is not None:
+                value, expires_at = found
+                self._store(key, value, expires_at)
+                with self._lock:
+                    self.backend_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, question, value, ttl=None):
+        """Store `value` for `question`, evicting least recently used entries to stay under max_bytes."""
+        key = normalize_query(question)
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl and ttl > 0 else None
+        if self.backend is not None:
+            self.backend.set(key, value, expires_at)
+        return self._store(key, value, expires_at)
+
+    def _store(self, key, value, expires_at):
+        size = estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return False
+        # Signatures are computed before taking the lock; the index itself is updated
+        # under it, so it never holds a key the memory tier has already evicted
+        indexed = self.index.prepare(key) if self.index is not None else None
+        with self._lock:
+            if key in self._entries:
+                # A replaced entry keeps its index entry
+                self._remove(key, unindex=False)
+            self._entries[key] = (value, size, expires_at)
+            self.total_bytes += size
+            if indexed is not None:
+                self.index.add(key, indexed)
+            while self.total_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return True
+
+    def load_from_backend(self):
+        """Fill the memory tier with the most recently stored backend entries.
+
+        Stops once the memory tier is full; returns the number of entries loaded.
+        """
+        if self.backend is None:
+            return 0
+        loaded = []
+        budget = self.max_bytes - self.total_bytes
+        for key, value, expires_at in self.backend.recent():
+            size = estimate_size(key) + estimate_size(value)
+            if size > budget:
+                break
+            budget -= size
+            loaded.append((key, value, expires_at))
+        # Oldest first, so the newest entries end up most recently used
+        for key, value, expires_at in reversed(loaded):
+            self._store(key, value, expires_at)
+        return len(loaded)
+
+    def delete(self, question):
+        key = normalize_query(question)
+        if self.backend is not None:
+            self.backend.delete(key)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+        return False
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+            if self.index is not None:
+                self.index.clear()
+
+    def __contains__(self, question):
+        key = normalize_query(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[2] is None or entry[2] > time.time()):
+                return True
+        return self.backend is not None and self.backend.get(key) is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key, unindex=True):
+        # Caller must hold self._lock
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+        if unindex and self.index is not None:
+            self.index.discard(key)
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current occupancy."""
+        with self._lock:
+            lookups = self.hits + self.backend_hits + self.misses
+            stats = {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'backend_hits': self.backend_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.backend_hits) / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+        if self.backend is not None:
+            stats['backend'] = self.backend.stats()
+        if self.index is not None:
+            stats['index'] = self.index.stats()
+        return stats
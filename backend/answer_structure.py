@@ -0,0 +1,149 @@
+import json
+import re
+
+# Incremental parse of the markdown layout the system prompt asks for: bold
+# "**Heading:**" sections, tables, a references block and a trailing "Related:"
+# list. Elements are reported once their line is complete, so clients can append
+# them instead of re-parsing the whole answer on every chunk.
+
+RELATED_HEADING_RE = re.compile(r"^\W*related(?: questions)?\W*$", re.IGNORECASE)
+REFERENCES_HEADING_RE = re.compile(r"^\W*(?:references|citations|sources)\W*$", re.IGNORECASE)
+BULLET_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+(.+?)\s*$")
+_HEADING_RES = (
+    (re.compile(r"^\*\*([^*]+?):?\*\*:?$"), 1),   # **Heading:**
+    (re.compile(r"^\*([^*]+?):\*$|^\*([^*]+?)\*:$"), 2),  # *Subheading:*
+)
+_MARKDOWN_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*$")
+_TABLE_SEPARATOR_RE = re.compile(r"^\|?\s*:?-{3,}:?\s*(?:\|\s*:?-{3,}:?\s*)*\|?$")
+
+BODY, TABLE, REFERENCES, RELATED = 'body', 'table', 'references', 'related'
+
+
+def _heading(line):
+    """Return (title, level) if `line` is a section heading, else None."""
+    match = _MARKDOWN_HEADING_RE.match(line)
+    if match:
+        return match.group(2).strip('*_: '), len(match.group(1))
+    for pattern, level in _HEADING_RES:
+        match = pattern.match(line)
+        if match:
+            title = next(group for group in match.groups() if group)
+            # A bold line must end in a colon to count as a heading, not an emphasized sentence
+            if level == 1 and not line.rstrip('*').endswith(':'):
+                return None
+            return title.strip(), level
+    return None
+
+
+def _cells(line):
+    return [cell.strip() for cell in line.strip().strip('|').split('|')]
+
+
+class AnswerStructure:
+    """Turns a streamed answer into structural events as its lines complete.
+
+    feed() takes text deltas in any split and returns the events completed by
+    that delta; close() flushes the last line. Every event is also kept in
+    `events`, which is what the answer cache stores. Events are dicts with a
+    'type' of 'section' (title, level), 'table' (columns), 'table_row' (cells),
+    'reference' (text) or 'related' (question).
+    """
+
+    def __init__(self):
+        self.events = []
+        self.mode = BODY
+        self._buffer = ''
+        self._table_header = None
+        self._mode_before_table = BODY
+
+    def feed(self, text):
+        if '\n' not in text:
+            self._buffer += text
+            return []
+        lines = (self._buffer + text).split('\n')
+        self._buffer = lines.pop()
+        found = []
+        for line in lines:
+            self._line(line.strip(), found)
+        return found
+
+    def close(self):
+        found = []
+        if self._buffer:
+            self._line(self._buffer.strip(), found)
+            self._buffer = ''
+        self._end_table(found)
+        return found
+
+    def _emit(self, found, event):
+        found.append(event)
+        self.events.append(event)
+
+    def _line(self, line, found):
+        if self._table_header is not None:
+            # The line after a table's first row decides whether that row was a header
+            header, self._table_header = self._table_header, None
+            self._emit(found, {'type': 'table', 'columns': header})
+            self.mode = TABLE
+            if _TABLE_SEPARATOR_RE.match(line):
+                return
+        if line.startswith('|'):
+            if self.mode == TABLE:
+                self._emit(found, {'type': 'table_row', 'cells': _cells(line)})
+            else:
+                self._mode_before_table = self.mode
+                self._table_header = _cells(line)
+            return
+        if self.mode == TABLE:
+            self.mode = self._mode_before_table
+        if not line:
+            return
+
+        if RELATED_HEADING_RE.match(line):
+            self._emit(found, {'type': 'section', 'title': 'Related', 'level': 1})
+            self.mode = RELATED
+            return
+        if REFERENCES_HEADING_RE.match(line):
+            self._emit(found, {'type': 'section', 'title': line.strip('#*_: '), 'level': 1})
+            self.mode = REFERENCES
+            return
+        heading = _heading(line)
+        if heading is not None:
+            title, level = heading
+            self._emit(found, {'type': 'section', 'title': title, 'level': level})
+            self.mode = BODY
+            return
+
+        if self.mode == REFERENCES:
+            match = BULLET_RE.match(line)
+            self._emit(found, {'type': 'reference', 'text': match.group(1) if match else line})
+        elif self.mode == RELATED:
+            match = BULLET_RE.match(line)
+            if match:
+                self._emit(found, {'type': 'related', 'question': match.group(1).strip('*_ ')})
+            else:
+                self.mode = BODY
+
+    def _end_table(self, found):
+        if self._table_header is not None:
+            self._emit(found, {'type': 'table', 'columns': self._table_header})
+            self._table_header = None
+
+
+def parse_structure(answer):
+    """Return the structural events of a complete answer."""
+    structure = AnswerStructure()
+    structure.feed(answer)
+    structure.close()
+    return structure.events
+
+
+def encode_event(event):
+    """Encode a structural event as a named SSE event ("event: section" etc.)."""
+    data = {k: v for k, v in event.items() if k != 'type'}
+    return f"event: {event['type']}\ndata: {json.dumps(data)}\n\n"
+
+
+def is_event_frame(frame):
+    """True for a structural event frame (str or bytes), as opposed to a content frame."""
+    return frame[:6] in ('event:', b'event:')
@@ -0,0 +1,169 @@
+"""Benchmark: exact-key vs. near-duplicate (MinHash/LSH) answer cache lookups.
+
+Builds a paraphrase corpus from question templates, caches one wording of half
+of the base questions and asks the others' paraphrases, reporting the hit rate
+with exact keys only and with the similarity index, and how many similarity
+hits returned the answer of a different question. Word-order pairs with the
+same words but swapped signs, comparisons or negations ("Rh+ mother with Rh-
+baby" / "Rh- mother with Rh+ baby") must never hit. Then fills the index to
+--index-size questions and times find().
+
+Usage: python bench_similarity.py [--bases 2000] [--index-size 100000] [--threshold 0.8]
+"""
+import argparse
+import itertools
+import random
+import time
+
+from answer_cache import AnswerCache, normalize_query
+from similarity_index import SimilarityIndex
+
+DRUGS = ["aspirin", "metformin", "apixaban", "warfarin", "atorvastatin", "empagliflozin", "semaglutide",
+         "lisinopril", "amlodipine", "clopidogrel", "ticagrelor", "rivaroxaban", "dapagliflozin", "insulin glargine",
+         "levothyroxine", "methotrexate", "adalimumab", "prednisone", "amoxicillin", "azithromycin", "sertraline",
+         "escitalopram", "gabapentin", "pregabalin", "tramadol", "ibuprofen", "naproxen", "colchicine", "allopurinol",
+         "febuxostat", "spironolactone", "furosemide", "sacubitril valsartan", "ivabradine", "digoxin", "amiodarone",
+         "dronedarone", "edoxaban", "dabigatran", "tirzepatide", "liraglutide", "pioglitazone", "sitagliptin",
+         "glipizide", "hydrochlorothiazide", "chlorthalidone", "losartan", "valsartan", "carvedilol", "metoprolol",
+         "bisoprolol", "rosuvastatin", "ezetimibe", "evolocumab", "inclisiran", "icosapent ethyl", "finerenone",
+         "tenecteplase", "alteplase", "heparin"]
+CONDITIONS = ["atrial fibrillation", "heart failure", "type 2 diabetes", "hypertension", "chronic kidney disease",
+              "stroke prevention", "coronary artery disease", "obesity", "gout", "rheumatoid arthritis",
+              "depression", "neuropathic pain", "osteoarthritis", "hypothyroidism", "pneumonia", "sinusitis",
+              "peripheral artery disease", "venous thromboembolism", "pulmonary embolism", "migraine",
+              "asthma", "copd", "psoriasis", "lupus", "anxiety", "insomnia", "fatty liver disease",
+              "hyperlipidemia", "acute coronary syndrome", "aortic stenosis", "cirrhosis", "pancreatitis",
+              "sepsis", "urinary tract infection", "cellulitis", "osteoporosis", "anemia", "sickle cell disease",
+              "multiple sclerosis", "parkinson disease", "alzheimer disease", "epilepsy", "bipolar disorder",
+              "schizophrenia", "crohn disease", "ulcerative colitis", "celiac disease", "endometriosis",
+              "polycystic ovary syndrome", "preeclampsia"]
+POPULATIONS = ["elderly patients", "pregnancy", "children", "dialysis patients", "liver impairment",
+               "older adults over 80", "athletes", "smokers", "breastfeeding", "frail patients"]
+
+# Each intent has several wordings of the same question
+INTENTS = {
+    'efficacy': ["How effective is {drug} for {condition} in {population}?",
+                 "Effectiveness of {drug} for {condition} in {population}",
+                 "What is the effectiveness of {drug} in {population} with {condition}?",
+                 "{drug} effectiveness {condition} {population}"],
+    'safety': ["Is {drug} safe for {condition} in {population}?",
+               "{drug} safety in {population} with {condition}",
+               "How safe is {drug} for {population} with {condition}?",
+               "Safety of {drug} for {condition} in {population}"],
+    'dose': ["What is the recommended dose of {drug} for {condition} in {population}?",
+             "{drug} dose for {condition} in {population}",
+             "Recommended {drug} dosing for {population} with {condition}",
+             "How much {drug} for {condition} in {population}?"],
+    'evidence': ["What is the evidence for {drug} in {condition} among {population}?",
+                 "Evidence for {drug} in {population} with {condition}",
+                 "Summarize the evidence on {drug} for {condition} in {population}",
+                 "{drug} {condition} {population} evidence"],
+}
+
+# Same words, opposite scenarios: none of these may be answered from the other
+SWAPPED = [("{a}+ mother with {a}- baby", "{a}- mother with {a}+ baby"),
+           ("{drug} for HbA1c >{n}% and eGFR <30", "{drug} for HbA1c <{n}% and eGFR >30"),
+           ("{drug} in {condition} without bleeding but with stroke",
+            "{drug} in {condition} with bleeding but without stroke"),
+           ("ER positive PR negative {condition} on {drug}", "ER negative PR positive {condition} on {drug}"),
+           ("{drug} dose higher than {other} in {condition}", "{other} dose higher than {drug} in {condition}")]
+
+
+def base_questions():
+    for drug, condition, population, intent in itertools.product(DRUGS, CONDITIONS, POPULATIONS, INTENTS):
+        yield (intent, drug, condition, population)
+
+
+def wording(base, variant):
+    intent, drug, condition, population = base
+    template = INTENTS[intent][variant % len(INTENTS[intent])]
+    text = template.format(drug=drug, condition=condition, population=population)
+    return text[0].upper() + text[1:]
+
+
+def hit_rates(args, rng):
+    bases = rng.sample(list(base_questions()), args.bases)
+    cached_bases = bases[:len(bases) // 2]
+    index = SimilarityIndex(threshold=args.threshold)
+    cache = AnswerCache(max_bytes=1 << 30, default_ttl=0, index=index)
+    owner = {}
+    for base in cached_bases:
+        question = wording(base, 0)
+        cache.set(question, {'content': '...'})
+        owner[normalize_query(question)] = base
+
+    exact = similar = wrong = asked = 0
+    for base in bases:
+        for variant in range(1, len(INTENTS[base[0]])):
+            question = wording(base, variant)
+            asked += 1
+            if cache.get(question) is not None:
+                exact += 1
+                continue
+            key = index.find(question)
+            if key is not None:
+                if owner[key] == base:
+                    similar += 1
+                else:
+                    wrong += 1
+    answerable = sum(len(INTENTS[base[0]]) - 1 for base in cached_bases)
+    print(f"Paraphrase corpus: {asked} questions, {answerable} with a cached paraphrase")
+    print(f"  exact keys only:        {exact / asked:7.2%} hit rate")
+    print(f"  + similarity index:     {(exact + similar) / asked:7.2%} hit rate "
+          f"({(exact + similar) / answerable:.2%} of answerable)")
+    print(f"  wrong-answer hits:      {wrong} ({wrong / asked:.3%})")
+
+
+def swapped_hits(args, rng):
+    index = SimilarityIndex(threshold=args.threshold)
+    pairs = []
+    for cached, asked in SWAPPED:
+        for _ in range(200):
+            fields = {'a': rng.choice(['Rh', 'Kell', 'HER2']), 'n': rng.randrange(6, 12), 'drug': rng.choice(DRUGS),
+                      'other': rng.choice(DRUGS), 'condition': rng.choice(CONDITIONS)}
+            pairs.append((cached.format(**fields), asked.format(**fields)))
+    for cached, _ in pairs:
+        index.add(normalize_query(cached))
+    wrong = 0
+    for _, asked in pairs:
+        # A hit on the asked question itself (drug and other drawn alike) is not wrong
+        key = index.find(asked)
+        if key is not None and key != normalize_query(asked):
+            wrong += 1
+    print(f"Swapped-polarity pairs: {len(pairs)}, wrong-answer hits: {wrong}")
+
+
+def lookup_latency(args, rng):
+    index = SimilarityIndex(threshold=args.threshold)
+    questions = [wording(base, rng.randrange(4)) for base in itertools.islice(base_questions(), args.index_size)]
+    start = time.perf_counter()
+    for question in questions:
+        index.add(normalize_query(question))
+    build = time.perf_counter() - start
+    probes = [wording(base, rng.randrange(4)) for base in rng.sample(list(base_questions()), 2000)]
+    timings = []
+    for probe in probes:
+        start = time.perf_counter()
+        index.find(probe)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f"Index of {len(index)} questions built in {build:.1f}s")
+    print(f"  find(): p50 {timings[len(timings) // 2] * 1e6:.0f}us, "
+          f"p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f}us, max {timings[-1] * 1e6:.0f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bases', type=int, default=2000, help='Distinct base questions in the paraphrase corpus')
+    parser.add_argument('--index-size', type=int, default=100000, help='Questions indexed for the latency run')
+    parser.add_argument('--threshold', type=float, default=0.8, help='Similarity threshold')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    hit_rates(args, rng)
+    swapped_hits(args, rng)
+    lookup_latency(args, rng)
+
+
+if __name__ == '__main__':
+    main()
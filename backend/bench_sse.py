@@ -0,0 +1,114 @@
+"""Micro-benchmark: incremental SSE parser vs. the original iter_lines/json.loads loop.
+
+Usage: python bench_sse.py [--tokens 2000] [--chunk-size 1024] [--repeat 20]
+"""
+import argparse
+import json
+import time
+
+from sse_parser import SSEParser, ChunkCoalescer, iter_content
+
+
+def build_stream(tokens):
+    """Build a DeepSeek-style SSE body of `tokens` content deltas."""
+    frames = []
+    words = ["**Protected", " TAVR", "** trial", " showed", " no", " significant", " reduction", " in",
+             " stroke", " (2.3%", " vs", " 2.9%)", "\n\n", "| Outcome | CEP |", " Smith J,", " et al.", " (2022)."]
+    for i in range(tokens):
+        chunk = {
+            "id": "chatcmpl-0123456789",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "deepseek-chat",
+            "choices": [{"index": 0, "delta": {"content": words[i % len(words)]}, "logprobs": None,
+                         "finish_reason": None}],
+        }
+        frames.append(b"data: " + json.dumps(chunk).encode() + b"\n\n")
+    frames.append(b"data: [DONE]\n\n")
+    return b"".join(frames)
+
+
+def split(body, chunk_size):
+    return [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+
+def iter_lines(chunks):
+    """Line splitting equivalent to requests.Response.iter_lines()."""
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+            pending = lines.pop()
+        else:
+            pending = None
+        yield from lines
+    if pending is not None:
+        yield pending
+
+
+def legacy_loop(chunks):
+    """The loop previously used by generate_streaming_answer and query.generate."""
+    full_answer = ""
+    for line in iter_lines(chunks):
+        if line:
+            line_text = line.decode('utf-8')
+            if line_text.startswith("data: "):
+                json_str = line_text[6:]
+                if json_str.strip() == "[DONE]":
+                    break
+                response_json = json.loads(json_str)
+                content = response_json.get("choices", [{}])[0].get("delta", {}).get("content", "")
+                if content:
+                    full_answer += content
+    return full_answer
+
+
+def parser_loop(chunks):
+    parser = SSEParser()
+    for _ in iter_content(chunks, parser):
+        pass
+    return parser.answer()
+
+
+def coalesced_loop(chunks):
+    parser = SSEParser()
+    events = sum(1 for _ in iter_content(chunks, parser, ChunkCoalescer(max_delay_ms=0, max_bytes=256)))
+    return parser.answer(), events
+
+
+def timeit(fn, chunks, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(chunks)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark upstream SSE parsing")
+    parser.add_argument("--tokens", type=int, default=2000, help="Content deltas per answer")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="Network chunk size in bytes")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per implementation (best is reported)")
+    args = parser.parse_args()
+
+    body = build_stream(args.tokens)
+    chunks = split(body, args.chunk_size)
+    expected = legacy_loop(chunks)
+    assert parser_loop(chunks) == expected, "parser output differs from legacy loop"
+    answer, events = coalesced_loop(chunks)
+    assert answer == expected
+
+    legacy = timeit(legacy_loop, chunks, args.repeat)
+    fast = timeit(parser_loop, chunks, args.repeat)
+    print(f"Stream: {args.tokens} tokens, {len(body)} bytes in {len(chunks)} chunks of {args.chunk_size}")
+    print(f"legacy iter_lines + json.loads: {legacy * 1000:8.2f} ms  ({legacy / args.tokens * 1e6:.2f} us/token)")
+    print(f"SSEParser:                      {fast * 1000:8.2f} ms  ({fast / args.tokens * 1e6:.2f} us/token)")
+    print(f"speedup: {legacy / fast:.2f}x")
+    print(f"downstream events: {args.tokens} per-token vs {events} coalesced at 256 bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Benchmark: import time of the web app and gunicorn time-to-ready, with and without preload.
+
+The import run checks `import medinquire_web` against an import-time budget
+(exit status 1 when over it) and lists the heaviest imports. The startup run
+launches gunicorn from this directory (so gunicorn.conf.py applies) and polls
+/api/ready until every worker has answered 200.
+
+Usage: python bench_startup.py [--budget-ms 200] [--workers 4] [--repeat 3] [--upstream URL --prewarm 4]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(module, env):
+    """Return (cumulative microseconds, [(microseconds, name)] of its direct imports) for importing `module`.
+
+    Parsed from `python -X importtime`, which lists each module after the ones it
+    imported, indented two spaces per nesting level.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=HERE, env=env,
+                            capture_output=True, text=True, check=True)
+    children = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        depth = (len(parts[2]) - len(parts[2].lstrip()) - 1) // 2
+        if depth == 0:
+            if name == module:
+                return int(parts[1]), children
+            children = []
+        elif depth == 1:
+            children.append((int(parts[1]), name))
+    raise RuntimeError(f"{module} not found in -X importtime output")
+
+
+def check_import_budget(args, env):
+    total, children = min((import_times('medinquire_web', env) for _ in range(args.repeat)), key=lambda run: run[0])
+    total_ms = total / 1000
+    print(f"import medinquire_web: {total_ms:.1f}ms (best of {args.repeat}, budget {args.budget_ms:.0f}ms)")
+    for us, name in sorted(children, reverse=True)[:args.top]:
+        print(f"  {us / 1000:7.1f}ms  {name}")
+    return total_ms <= args.budget_ms
+
+
+def ready_pid(port):
+    """Return the pid of the worker that answered /api/ready with 200, or None."""
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/api/ready', headers={'Connection': 'close'})
+    try:
+        with urllib.request.urlopen(request, timeout=1) as response:
+            return json.loads(response.read())['pid']
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return None
+
+
+def time_to_ready(args, env, preload, port):
+    """Start gunicorn and return (seconds to the first ready worker, seconds until all were ready)."""
+    env = dict(env, GUNICORN_PRELOAD='1' if preload else '0')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'medinquire_web:app', '-b', f'127.0.0.1:{port}',
+                               '-w', str(args.workers)], cwd=HERE, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    start = time.monotonic()
+    first, pids = None, set()
+    try:
+        while time.monotonic() - start < args.timeout:
+            pid = ready_pid(port)
+            if pid is not None:
+                first = first or time.monotonic() - start
+                pids.add(pid)
+                if len(pids) >= args.workers:
+                    return first, time.monotonic() - start
+            else:
+                time.sleep(0.005)
+        return first, None
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=200.0, help='Import-time budget for medinquire_web')
+    parser.add_argument('--top', type=int, default=8, help='Heaviest direct imports to list')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8097)
+    parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for all workers to be ready')
+    parser.add_argument('--upstream', help='DEEPSEEK_API_URL for the server (e.g. fake_deepseek.py)')
+    parser.add_argument('--prewarm', type=int, default=0, help='DEEPSEEK_PREWARM_CONNECTIONS per worker')
+    parser.add_argument('--skip-startup', action='store_true', help='Only check the import budget')
+    args = parser.parse_args()
+
+    env = dict(os.environ, DEEPSEEK_PREWARM_CONNECTIONS=str(args.prewarm))
+    if args.upstream:
+        env['DEEPSEEK_API_URL'] = args.upstream
+    within_budget = check_import_budget(args, env)
+
+    if not args.skip_startup:
+        for preload in (True, False):
+            results = [time_to_ready(args, env, preload, args.port + i) for i in range(args.repeat)]
+            firsts = sorted(first for first, _ in results if first is not None)
+            alls = sorted(all_ready for _, all_ready in results if all_ready is not None)
+            label = 'preload' if preload else 'no preload'
+            if not alls:
+                print(f"{label}: workers not all ready within {args.timeout:.0f}s")
+                continue
+            print(f"{label:>10}: first worker ready {firsts[len(firsts) // 2]:.2f}s, "
+                  f"all {args.workers} ready {alls[len(alls) // 2]:.2f}s (median of {len(alls)})")
+    sys.exit(0 if within_budget else 1)
+
+
+if __name__ == '__main__':
+    main()
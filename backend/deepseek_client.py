@@ -0,0 +1,431 @@
+import os
+import ssl
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import certifi
+import requests
+from urllib3.util import ssl_
+from requests.adapters import HTTPAdapter
+from urllib3.poolmanager import PoolManager
+
+import metrics
+import resilience
+from resilience import CircuitOpenError, RETRYABLE_STATUS
+
+# Upstream endpoint and connection pool configuration
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+POOL_SIZE = int(os.getenv("DEEPSEEK_POOL_SIZE", "32"))
+PREWARM_CONNECTIONS = int(os.getenv("DEEPSEEK_PREWARM_CONNECTIONS", "0"))
+# Chat prefix completion (continue a partial assistant message) is served from the beta path
+_api_url = urlsplit(DEEPSEEK_API_URL)
+DEEPSEEK_PREFIX_API_URL = os.getenv("DEEPSEEK_PREFIX_API_URL", f"{_api_url.scheme}://{_api_url.netloc}/beta/chat/completions")
+# Connection limit for the asyncio client (0 means unlimited)
+ASYNC_POOL_SIZE = int(os.getenv("DEEPSEEK_ASYNC_POOL_SIZE", "1000"))
+
+# Process-wide session state. Reset in forked children so that a gunicorn worker
+# never shares sockets (or TLS state) with the master it was forked from.
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_async_session = None
+_hedge_executor = None
+_hedge_lock = threading.Lock()
+# Verifying TLS context with the CA bundle loaded. Kept across forks: it holds no
+# connections, so workers forked from a preloaded master reuse the parsed bundle.
+_tls_context = None
+
+# Upstream health shared by the threaded and asyncio clients of this process
+breaker = resilience.CircuitBreaker()
+ttfb = resilience.LatencyTracker()
+
+
+def create_tls_context():
+    """Create an SSL context that only allows TLS 1.2+ and verifies certificates."""
+    ctx = ssl_.create_urllib3_context(
+        ssl_version=ssl.PROTOCOL_TLS,
+        cert_reqs=ssl.CERT_REQUIRED,
+        options=ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3 | ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
+    )
+    return ctx
+
+
+def shared_tls_context():
+    """Return the process-wide TLS context trusting certifi's CA bundle, loading the bundle once.
+
+    Parsing the bundle takes ~20ms, which would otherwise be paid on every new
+    upstream connection.
+    """
+    global _tls_context
+    if _tls_context is None:
+        ctx = create_tls_context()
+        ctx.load_verify_locations(certifi.where())
+        _tls_context = ctx
+    return _tls_context
+
+
+# Custom HTTPS adapter with modern SSL configuration
+class TlsAdapter(HTTPAdapter):
+    def init_poolmanager(self, connections, maxsize, block=False):
+        """Create and initialize the urllib3 PoolManager with enhanced TLS settings."""
+        # The shared context already trusts certifi's CA certificates
+        self.poolmanager = PoolManager(
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            ssl_context=shared_tls_context(),
+            cert_reqs=ssl.CERT_REQUIRED
+        )
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if verify is True:
+            # requests points every pool at the CA bundle file, which urllib3 would
+            # re-read on each connect; the shared context has it loaded already
+            conn.ca_certs = None
+
+
+def create_secure_session(pool_size=POOL_SIZE):
+    """Create a session with appropriate TLS settings and a keep-alive pool of `pool_size` connections per host."""
+    session = requests.Session()
+    session.mount('https://', TlsAdapter(pool_connections=4, pool_maxsize=pool_size))
+    # Plain HTTP is only used for local stand-in servers
+    session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+    return session
+
+
+def get_session():
+    """Return the shared upstream session for this process, creating it on first use.
+
+    The session is shared by all threads of a worker so connections opened by one
+    request are reused by the next. After a fork the child builds a fresh pool.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            _session = create_secure_session()
+            _session_pid = pid
+        return _session
+
+
+def _reset_after_fork():
+    """Drop the inherited session in a forked child without closing the parent's sockets."""
+    global _session, _session_pid, _session_lock, _async_session, _hedge_executor, _hedge_lock, breaker, ttfb
+    _session = None
+    _session_pid = None
+    _session_lock = threading.Lock()
+    _async_session = None
+    _hedge_executor = None
+    _hedge_lock = threading.Lock()
+    breaker = resilience.CircuitBreaker()
+    ttfb = resilience.LatencyTracker()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _body(payload):
+    """Request keyword for a payload: pre-serialized JSON bytes (prompts.py) go out as-is."""
+    return {'data': payload} if isinstance(payload, bytes) else {'json': payload}
+
+
+def _send(headers, payload, stream, timeout, url=DEEPSEEK_API_URL):
+    return get_session().post(url, headers=headers, stream=stream,
+                              timeout=(resilience.UPSTREAM_CONNECT_TIMEOUT, timeout), **_body(payload))
+
+
+def _extend_read_timeout(response):
+    """Let the reads after a streaming response's headers wait UPSTREAM_STREAM_READ_TIMEOUT.
+
+    The socket was given the first-byte timeout for the request; urllib3 sets it
+    again before the connection's next request.
+    """
+    sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+    if sock is not None:
+        sock.settimeout(resilience.UPSTREAM_STREAM_READ_TIMEOUT)
+
+
+def _get_hedge_executor():
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=2 * POOL_SIZE, thread_name_prefix='deepseek-hedge')
+    return _hedge_executor
+
+
+def _close_response(future):
+    try:
+        future.result().close()
+    except Exception:
+        pass
+
+
+def _send_hedged(headers, payload, timeout, delay, url=DEEPSEEK_API_URL):
+    """Send a streaming request, and a second one if no headers arrive within `delay`.
+
+    Returns the first response that is not a retryable error; the other request is
+    closed whenever it completes.
+    """
+    executor = _get_hedge_executor()
+    primary = executor.submit(_send, headers, payload, True, timeout, url)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    hedge = executor.submit(_send, headers, payload, True, timeout, url)
+    pending = {primary, hedge}
+    last_error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                response = future.result()
+            except requests.exceptions.RequestException as e:
+                last_error = e
+                continue
+            if response.status_code in RETRYABLE_STATUS and pending:
+                response.close()
+                continue
+            metrics.UPSTREAM_HEDGES.inc(label_value='primary' if future is primary else 'hedge')
+            for other in (done | pending) - {future}:
+                other.add_done_callback(_close_response)
+            return response
+    raise last_error
+
+
+def post(headers, payload, stream=False, timeout=None, url=DEEPSEEK_API_URL):
+    """POST a chat completion request to DeepSeek over the shared pooled session.
+
+    `payload` is a dict or an already serialized JSON body (bytes, see prompts.py).
+    Goes through the circuit breaker (raises CircuitOpenError while it is open) and
+    retries connection errors, timeouts and 429/5xx responses with jittered backoff,
+    but only before the first byte: once headers arrive the response is returned.
+    `timeout` bounds the wait for the headers; by default it adapts to the observed
+    TTFB. Reads of a streaming body then wait up to UPSTREAM_STREAM_READ_TIMEOUT.
+    Streaming requests may be hedged (UPSTREAM_HEDGE).
+    """
+    breaker.check()
+    adaptive = timeout is None
+    deadline = time.monotonic() + resilience.UPSTREAM_TIMEOUT_MAX
+    attempt = 0
+    while True:
+        read_timeout = ttfb.first_byte_timeout() if adaptive else timeout
+        hedge_delay = ttfb.hedge_delay() if stream else None
+        start = time.monotonic()
+        response, error = None, None
+        try:
+            if hedge_delay is not None and hedge_delay < read_timeout:
+                response = _send_hedged(headers, payload, read_timeout, hedge_delay, url)
+            else:
+                response = _send(headers, payload, stream, read_timeout, url)
+        except requests.exceptions.RequestException as e:
+            error = e
+        if response is not None and response.status_code not in RETRYABLE_STATUS:
+            if stream and response.status_code == 200:
+                ttfb.observe(time.monotonic() - start)
+            if stream:
+                _extend_read_timeout(response)
+            breaker.record_success()
+            return response
+        breaker.record_failure()
+        delay = resilience.retry_delay(attempt, response.headers.get('Retry-After') if response is not None else None)
+        if attempt >= resilience.UPSTREAM_RETRIES or time.monotonic() + delay >= deadline or not breaker.allow():
+            if error is not None:
+                raise error
+            return response
+        if response is not None:
+            response.close()
+        print(f"Retrying DeepSeek request after {error or f'HTTP {response.status_code}'}")
+        metrics.UPSTREAM_RETRIES.inc()
+        time.sleep(delay)
+        attempt += 1
+
+
+def upstream_stats():
+    """Circuit breaker state and adaptive timeout figures for this worker."""
+    return {'circuit': breaker.stats(), **ttfb.stats()}
+
+
+def get_async_session():
+    """Return the shared aiohttp session for the running event loop, creating it on first use.
+
+    aiohttp and asyncio are only needed by the asyncio server, so they are imported lazily.
+    """
+    global _async_session
+    import aiohttp
+    if _async_session is None or _async_session.closed:
+        connector = aiohttp.TCPConnector(limit=ASYNC_POOL_SIZE, ssl=shared_tls_context(), keepalive_timeout=60)
+        _async_session = aiohttp.ClientSession(connector=connector)
+    return _async_session
+
+
+async def _async_send(headers, payload, timeout, url=DEEPSEEK_API_URL):
+    """POST and wait up to `timeout` after connecting for the headers.
+
+    aiohttp's sock_read applies to the headers and every body read alike, so it is
+    set to UPSTREAM_STREAM_READ_TIMEOUT and the headers get their own deadline.
+    """
+    import asyncio
+    import aiohttp
+    client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=resilience.UPSTREAM_CONNECT_TIMEOUT,
+                                           sock_read=resilience.UPSTREAM_STREAM_READ_TIMEOUT)
+    request = get_async_session().post(url, headers=headers, timeout=client_timeout, **_body(payload))
+    return await asyncio.wait_for(request, resilience.UPSTREAM_CONNECT_TIMEOUT + timeout)
+
+
+def _release_task_result(task):
+    if not task.cancelled() and task.exception() is None:
+        task.result().release()
+
+
+async def _async_send_hedged(headers, payload, timeout, delay, url=DEEPSEEK_API_URL):
+    """asyncio counterpart of _send_hedged()."""
+    import asyncio
+    primary = asyncio.ensure_future(_async_send(headers, payload, timeout, url))
+    done, _ = await asyncio.wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    hedge = asyncio.ensure_future(_async_send(headers, payload, timeout, url))
+    pending = {primary, hedge}
+    last_error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    continue
+                response = task.result()
+                if response.status in RETRYABLE_STATUS and pending:
+                    response.release()
+                    continue
+                metrics.UPSTREAM_HEDGES.inc(label_value='primary' if task is primary else 'hedge')
+                for other in done - {task}:
+                    _release_task_result(other)
+                return response
+        raise last_error
+    finally:
+        for task in pending:
+            task.add_done_callback(_release_task_result)
+            task.cancel()
+
+
+async def async_post(headers, payload, timeout=None, url=DEEPSEEK_API_URL):
+    """POST a streaming chat completion request from the event loop.
+
+    Same circuit breaker, pre-first-byte retries, adaptive timeout and hedging as
+    post(). The caller must release() the returned aiohttp response.
+    """
+    import asyncio
+    import aiohttp
+    breaker.check()
+    adaptive = timeout is None
+    deadline = time.monotonic() + resilience.UPSTREAM_TIMEOUT_MAX
+    attempt = 0
+    while True:
+        read_timeout = ttfb.first_byte_timeout() if adaptive else timeout
+        hedge_delay = ttfb.hedge_delay()
+        start = time.monotonic()
+        response, error = None, None
+        try:
+            if hedge_delay is not None and hedge_delay < read_timeout:
+                response = await _async_send_hedged(headers, payload, read_timeout, hedge_delay, url)
+            else:
+                response = await _async_send(headers, payload, read_timeout, url)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+        if response is not None and response.status not in RETRYABLE_STATUS:
+            if response.status == 200:
+                ttfb.observe(time.monotonic() - start)
+            breaker.record_success()
+            return response
+        breaker.record_failure()
+        delay = resilience.retry_delay(attempt, response.headers.get('Retry-After') if response is not None else None)
+        if attempt >= resilience.UPSTREAM_RETRIES or time.monotonic() + delay >= deadline or not breaker.allow():
+            if error is not None:
+                raise error
+            return response
+        if response is not None:
+            response.release()
+        print(f"Retrying DeepSeek request after {error or f'HTTP {response.status}'}")
+        metrics.UPSTREAM_RETRIES.inc()
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def close_async_session():
+    global _async_session
+    if _async_session is not None:
+        await _async_session.close()
+        _async_session = None
+
+
+def prewarm(connections=PREWARM_CONNECTIONS, timeout=5):
+    """Open up to `connections` keep-alive connections to the upstream host in parallel.
+
+    Each connection completes its TCP+TLS handshake with a lightweight HEAD request
+    and is returned to the pool, so the first real questions skip the handshake.
+    Failures are ignored; the pool simply fills on demand instead.
+    """
+    connections = min(connections, POOL_SIZE)
+    if connections <= 0:
+        return 0
+    parts = urlsplit(DEEPSEEK_API_URL)
+    origin = f"{parts.scheme}://{parts.netloc}/"
+    session = get_session()
+    opened = []
+
+    def open_one():
+        try:
+            session.head(origin, timeout=timeout).close()
+            opened.append(True)
+        except requests.exceptions.RequestException as e:
+            print(f"Upstream pre-warm failed: {e}")
+
+    threads = [threading.Thread(target=open_one, daemon=True) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"Pre-warmed {len(opened)}/{connections} upstream connections")
+    return len(opened)
+
+
+def prewarm_in_background(connections=PREWARM_CONNECTIONS):
+    """Run prewarm() on a daemon thread so startup is not blocked by the handshakes."""
+    if connections <= 0:
+        return None
+    thread = threading.Thread(target=prewarm, args=(connections,), daemon=True, name='deepseek-prewarm')
+    thread.start()
+    return thread
+
+
+async def async_prewarm(connections=PREWARM_CONNECTIONS, timeout=5):
+    """asyncio counterpart of prewarm(), filling the aiohttp pool of the running event loop."""
+    import asyncio
+    import aiohttp
+    if ASYNC_POOL_SIZE:
+        connections = min(connections, ASYNC_POOL_SIZE)
+    if connections <= 0:
+        return 0
+    parts = urlsplit(DEEPSEEK_API_URL)
+    origin = f"{parts.scheme}://{parts.netloc}/"
+    session = get_async_session()
+
+    async def open_one():
+        try:
+            async with session.head(origin, timeout=aiohttp.ClientTimeout(total=timeout)):
+                return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Upstream pre-warm failed: {e}")
+            return False
+
+    opened = sum(await asyncio.gather(*(open_one() for _ in range(connections))))
+    print(f"Pre-warmed {opened}/{connections} upstream connections")
+    return opened
@@ -0,0 +1,180 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Shared on-disk answer store. Every gunicorn worker on the host opens the same
+# SQLite file in WAL mode, so readers never block each other or the writer.
+ANSWER_CACHE_PATH = os.getenv(
+    "ANSWER_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "answer_cache.sqlite3")
+)
+ANSWER_DISK_CACHE_MAX_BYTES = int(os.getenv("ANSWER_DISK_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Prune the table after this many writes from a single process
+_PRUNE_EVERY = 200
+
+# Connections inherited from the process this one was forked from (a preloading
+# gunicorn master). Kept referenced so the child never closes the parent's handle.
+_inherited = []
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL
+)
+"""
+
+
+# Suffix marking a dict field whose bytes value is stored as a latin-1 string
+_BYTES_SUFFIX = ':b'
+
+
+def encode_value(value):
+    """Serialize and compress a cache value for storage.
+
+    Bytes fields of a dict value (e.g. pre-encoded SSE frames) round-trip as bytes.
+    """
+    if isinstance(value, dict):
+        value = {(k + _BYTES_SUFFIX if isinstance(v, bytes) else k): (v.decode('latin-1') if isinstance(v, bytes) else v)
+                 for k, v in value.items()}
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'), 6)
+
+
+def decode_value(blob):
+    value = json.loads(zlib.decompress(blob))
+    if isinstance(value, dict):
+        value = {(k[:-len(_BYTES_SUFFIX)] if k.endswith(_BYTES_SUFFIX) else k): (v.encode('latin-1') if k.endswith(_BYTES_SUFFIX) else v)
+                 for k, v in value.items()}
+    return value
+
+
+class DiskCache:
+    """Compressed answer store in a SQLite database shared by all processes on the host.
+
+    WAL journaling gives concurrent readers alongside a single writer, and each
+    write is an atomic transaction, so a crash mid-write never leaves a torn entry.
+    Connections are per thread and reopened after a fork.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, max_bytes=ANSWER_DISK_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self._connect()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        if conn is not None:
+            _inherited.append(conn)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is crash-safe in WAL mode; only the last commits may roll back on power loss
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        conn.execute(_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        """Return (value, expires_at) for a normalized key, or None if absent or expired."""
+        try:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Disk cache read failed: {e}")
+            return None
+        if row is None:
+            return None
+        blob, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        try:
+            return decode_value(blob), expires_at
+        except (zlib.error, ValueError) as e:
+            print(f"Disk cache entry for '{key[:50]}' is unreadable: {e}")
+            return None
+
+    def set(self, key, value, expires_at=None):
+        blob = encode_value(value)
+        try:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO answers (key, value, size, stored_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob) + len(key), time.time(), expires_at)
+            )
+        except sqlite3.Error as e:
+            print(f"Disk cache write failed: {e}")
+            return False
+        self._writes += 1
+        if self._writes % _PRUNE_EVERY == 0:
+            self.prune()
+        return True
+
+    def recent(self):
+        """Yield (key, value, expires_at) for unexpired entries, most recently stored first."""
+        try:
+            rows = self._connect().execute(
+                "SELECT key, value, expires_at FROM answers WHERE expires_at IS NULL OR expires_at > ? "
+                "ORDER BY stored_at DESC", (time.time(),)
+            )
+            for key, blob, expires_at in rows:
+                try:
+                    yield key, decode_value(blob), expires_at
+                except (zlib.error, ValueError) as e:
+                    print(f"Disk cache entry for '{key[:50]}' is unreadable: {e}")
+        except sqlite3.Error as e:
+            print(f"Disk cache scan failed: {e}")
+
+    def delete(self, key):
+        try:
+            self._connect().execute("DELETE FROM answers WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            print(f"Disk cache delete failed: {e}")
+
+    def clear(self):
+        try:
+            self._connect().execute("DELETE FROM answers")
+        except sqlite3.Error as e:
+            print(f"Disk cache clear failed: {e}")
+
+    def prune(self):
+        """Drop expired entries, then the oldest ones until the store fits in max_bytes."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM answers WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                rows = conn.execute("SELECT key, size FROM answers ORDER BY stored_at").fetchall()
+                doomed = []
+                for key, size in rows:
+                    if excess <= 0:
+                        break
+                    doomed.append((key,))
+                    excess -= size
+                conn.executemany("DELETE FROM answers WHERE key = ?", doomed)
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            print(f"Disk cache prune failed: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+    def stats(self):
+        try:
+            count, total = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers"
+            ).fetchone()
+        except sqlite3.Error:
+            count, total = 0, 0
+        return {'entries': count, 'bytes': total, 'max_bytes': self.max_bytes, 'path': self.path}
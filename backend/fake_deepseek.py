@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from aiohttp import web
+
+# Local stand-in for the DeepSeek chat completions API, for load tests and
+# latency benchmarks without spending API credits. Point the backend at it with
+#   DEEPSEEK_API_URL=http://127.0.0.1:8099/v1/chat/completions
+
+SAMPLE_ANSWER = """**Overview:**
+The ***PROTECTED TAVR trial*** randomized **3,000 patients** undergoing transcatheter aortic valve replacement to cerebral embolic protection (CEP) or no CEP.
+
+**Key Findings:**
+- Stroke within 72 hours or discharge: **2.3% vs 2.9%** (difference -0.6 points; 95% CI -1.7 to 0.5)
+- Disabling stroke: **0.5% vs 1.3%**, a secondary finding
+- No difference in mortality or acute kidney injury
+
+**Comparison:**
+| Outcome | CEP | No CEP |
+|---------|-----|--------|
+| Any stroke | 2.3% | 2.9% |
+| Disabling stroke | 0.5% | 1.3% |
+| Death | 0.5% | 0.3% |
+
+*Interpretation:*
+Routine CEP did not significantly reduce periprocedural stroke, although the lower rate of **disabling stroke** is hypothesis-generating.
+
+**References:**
+Kapadia SR, et al. (2022). Cerebral Embolic Protection during Transcatheter Aortic-Valve Replacement.
+Kharbanda RK, et al. (2023). Routine cerebral embolic protection during TAVI: the BHF PROTECT-TAVI trial design.
+
+Related:
+- Which patients benefit most from cerebral embolic protection during TAVR?
+- How does the BHF PROTECT-TAVI trial differ from PROTECTED TAVR?
+- What are the risks of stroke after TAVR compared with surgical valve replacement?
+"""
+
+
+def tokenize(text):
+    """Split text into token-sized pieces (about one word each, whitespace attached)."""
+    tokens = []
+    current = ""
+    for ch in text:
+        current += ch
+        if ch in " \n" and len(current) > 1:
+            tokens.append(current)
+            current = ""
+    if current:
+        tokens.append(current)
+    return tokens
+
+
+SAMPLE_TOKENS = tokenize(SAMPLE_ANSWER)
+
+
+class FakeUpstream:
+    """Behaviour knobs for the stand-in server."""
+
+    def __init__(self, ttft=0.4, ttft_jitter=0.2, token_rate=40.0, max_tokens=None, error_rate=0.0,
+                 error_status=500, stall_rate=0.0, stall_seconds=30.0, slow_rate=0.0, slow_seconds=10.0, seed=None):
+        self.ttft = ttft
+        self.ttft_jitter = ttft_jitter
+        self.token_rate = token_rate
+        self.max_tokens = max_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.active = 0
+
+    def tokens_for(self, payload):
+        messages = payload.get('messages', [])
+        question = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+        tokens = tokenize(f"**Question:** {question}\n\n") + SAMPLE_TOKENS
+        limit = payload.get('max_tokens') or self.max_tokens
+        tokens = tokens[:limit] if limit else tokens
+        if messages and messages[-1].get('role') == 'assistant' and messages[-1].get('prefix'):
+            # Chat prefix completion: continue after the text the client already has
+            return tokenize(''.join(tokens)[len(messages[-1].get('content', '')):])
+        return tokens
+
+    async def chat_completions(self, request):
+        self.requests += 1
+        payload = await request.json()
+        if self.random.random() < self.error_rate:
+            await asyncio.sleep(self.ttft)
+            return web.json_response({'error': {'message': 'Injected upstream failure', 'type': 'server_error'}},
+                                     status=self.error_status)
+        ttft = max(0.0, self.ttft + self.random.uniform(-self.ttft_jitter, self.ttft_jitter))
+        if self.random.random() < self.slow_rate:
+            # Tail latency before the first byte, for timeout and hedging tests
+            ttft += self.slow_seconds
+        await asyncio.sleep(ttft)
+        tokens = self.tokens_for(payload)
+        if not payload.get('stream'):
+            return web.json_response(self.completion(''.join(tokens)))
+
+        self.active += 1
+        try:
+            response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+            await response.prepare(request)
+            stall_at = self.random.randrange(len(tokens)) if self.random.random() < self.stall_rate else -1
+            interval = 1.0 / self.token_rate if self.token_rate > 0 else 0.0
+            started = time.monotonic()
+            for i, token in enumerate(tokens):
+                if i == stall_at:
+                    await asyncio.sleep(self.stall_seconds)
+                await response.write(self.chunk_frame(token))
+                # Pace against the start time so scheduling delays do not accumulate
+                delay = started + (i + 1) * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await response.write(self.chunk_frame(None, finish_reason='stop'))
+            await response.write(b'data: [DONE]\n\n')
+            await response.write_eof()
+            return response
+        finally:
+            self.active -= 1
+
+    @staticmethod
+    def chunk_frame(content, finish_reason=None):
+        delta = {} if content is None else {'content': content}
+        chunk = {
+            'id': 'chatcmpl-local',
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': 'deepseek-chat',
+            'choices': [{'index': 0, 'delta': delta, 'logprobs': None, 'finish_reason': finish_reason}],
+        }
+        return b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n'
+
+    @staticmethod
+    def completion(content):
+        return {
+            'id': 'chatcmpl-local',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': 'deepseek-chat',
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        }
+
+    async def root(self, request):
+        # Answers the HEAD requests used to pre-warm connections
+        return web.json_response({'requests': self.requests, 'active_streams': self.active})
+
+
+def create_app(upstream):
+    app = web.Application()
+    app.router.add_post('/v1/chat/completions', upstream.chat_completions)
+    app.router.add_post('/chat/completions', upstream.chat_completions)
+    app.router.add_post('/beta/chat/completions', upstream.chat_completions)
+    app.router.add_get('/', upstream.root)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local DeepSeek-compatible stand-in server')
+    parser.add_argument('--port', type=int, default=8099, help='Port to run the server on')
+    parser.add_argument('--ttft', type=float, default=0.4, help='Seconds before the first token')
+    parser.add_argument('--ttft-jitter', type=float, default=0.2, help='Uniform +/- jitter on --ttft')
+    parser.add_argument('--token-rate', type=float, default=40.0, help='Tokens per second per stream (0 = unthrottled)')
+    parser.add_argument('--max-tokens', type=int, default=None, help='Cap tokens per answer when the request has no max_tokens')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=500, help='HTTP status for injected failures (e.g. 429, 503)')
+    parser.add_argument('--stall-rate', type=float, default=0.0, help='Fraction of streams that stall mid-answer')
+    parser.add_argument('--stall-seconds', type=float, default=30.0, help='Length of an injected stall')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='Fraction of requests with a delayed first byte')
+    parser.add_argument('--slow-seconds', type=float, default=10.0, help='Extra first-byte delay of a slow request')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible runs')
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(ttft=args.ttft, ttft_jitter=args.ttft_jitter, token_rate=args.token_rate,
+                            max_tokens=args.max_tokens, error_rate=args.error_rate, error_status=args.error_status,
+                            stall_rate=args.stall_rate, stall_seconds=args.stall_seconds,
+                            slow_rate=args.slow_rate, slow_seconds=args.slow_seconds, seed=args.seed)
+    print(f"Fake DeepSeek API on http://127.0.0.1:{args.port}/v1/chat/completions")
+    web.run_app(create_app(upstream), host='0.0.0.0', port=args.port, print=None)
@@ -0,0 +1,27 @@
+import os
+import shutil
+import tempfile
+
+# Gunicorn settings, loaded automatically when gunicorn is started from backend/
+
+# Workers write their metrics to per-process files here so /api/metrics can
+# aggregate them; cleared when the master starts so counters begin at zero.
+metrics_dir = os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'askmedicine-metrics'))
+
+# Import the app once in the master, so workers fork with Flask, requests, the TLS
+# context and the answer cache's memory tier already loaded (GUNICORN_PRELOAD=0 to
+# import it in every worker instead). Per-worker warm-up then starts in post_fork.
+preload_app = os.getenv('GUNICORN_PRELOAD', '1').lower() in ('1', 'true', 'yes')
+if preload_app:
+    os.environ['WARMUP_AFTER_FORK'] = '1'
+
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import startup
+        startup.start_worker()
@@ -0,0 +1,294 @@
+import hashlib
+import itertools
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+# Question history per session (the random id in the server-issued session cookie).
+# Appends go into a bounded per-session ring in memory and onto a queue; one
+# writer thread per worker batches them into a SQLite file shared by all
+# workers, with an FTS5 index over questions and answers for search. Nothing is
+# written on the request thread.
+HISTORY_PATH = os.getenv(
+    "HISTORY_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.sqlite3")
+)
+HISTORY_SESSION_SIZE = int(os.getenv("HISTORY_SESSION_SIZE", "200"))
+HISTORY_MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "10000"))
+HISTORY_MAX_ENTRIES = int(os.getenv("HISTORY_MAX_ENTRIES", "200000"))
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+# Rows written per transaction, and writes between prunes of the oldest rows
+_BATCH = 256
+_PRUNE_EVERY = 1000
+# Seconds a read waits for this worker's queued writes to land
+_FLUSH_TIMEOUT = 1.0
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session TEXT NOT NULL,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        cached INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS history_session ON history (session, id)",
+    # The session is indexed too, so a search only walks that session's rows
+    """CREATE VIRTUAL TABLE IF NOT EXISTS history_search USING fts5(
+        session, question, answer, content='history', content_rowid='id'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS history_search_ai AFTER INSERT ON history BEGIN
+        INSERT INTO history_search (rowid, session, question, answer)
+        VALUES (new.id, new.session, new.question, new.answer);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS history_search_ad AFTER DELETE ON history BEGIN
+        INSERT INTO history_search (history_search, rowid, session, question, answer)
+        VALUES ('delete', old.id, old.session, old.question, old.answer);
+    END""",
+    # Replaced by history_search, which also indexes the session
+    "DROP TRIGGER IF EXISTS history_ai",
+    "DROP TRIGGER IF EXISTS history_ad",
+    "DROP TABLE IF EXISTS history_fts",
+)
+
+
+def session_id(raw):
+    """Hash a session identifier so API tokens are never stored."""
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def fts_query(text, session=None):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix.
+
+    With a (hashed) `session` the words are matched in the question and answer
+    only, among that session's rows.
+    """
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    if session is None:
+        return ' '.join(terms)
+    return f'session : "{session}" AND {{question answer}} : ({" ".join(terms)})'
+
+
+def _timestamp(created_at):
+    return datetime.fromtimestamp(created_at, timezone.utc).isoformat()
+
+
+class HistoryStore:
+    """Per-session question history with cursor pagination and full-text search.
+
+    add() is O(1) on the calling thread; the answer may be a callable (e.g. one
+    that joins a finished flight's frames), which the writer thread resolves.
+    With `path` empty the history lives only in the per-worker rings.
+    """
+
+    def __init__(self, path=HISTORY_PATH, session_size=HISTORY_SESSION_SIZE,
+                 max_sessions=HISTORY_MAX_SESSIONS, max_entries=HISTORY_MAX_ENTRIES):
+        self.path = path
+        self.session_size = session_size
+        self.max_sessions = max_sessions
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()  # session -> deque of entries, least recently used first
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._local = threading.local()
+        self._writer_pid = None
+        self._writes = 0
+
+    def add(self, session, question, answer, cached=False):
+        session = session_id(session)
+        entry = {'id': next(self._ids), 'question': question, 'answer': answer, 'cached': cached,
+                 'created_at': time.time()}
+        with self._lock:
+            ring = self._sessions.get(session)
+            if ring is None:
+                ring = self._sessions[session] = deque(maxlen=self.session_size)
+                if len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session)
+            ring.append(entry)
+        if self.path:
+            self._queue.put(('add', session, entry))
+            self._ensure_writer()
+
+    def clear(self, session):
+        session = session_id(session)
+        with self._lock:
+            self._sessions.pop(session, None)
+        if self.path:
+            self._queue.put(('clear', session, None))
+            self._ensure_writer()
+
+    def _ensure_writer(self):
+        pid = os.getpid()
+        if self._writer_pid == pid:
+            return
+        with self._lock:
+            if self._writer_pid == pid:
+                return
+            threading.Thread(target=self._write_loop, daemon=True, name='history-writer').start()
+            self._writer_pid = pid
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < _BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except sqlite3.Error as e:
+                print(f"History write failed: {e}")
+            finally:
+                for op, _, marker in batch:
+                    if op == 'flush':
+                        marker.set()
+
+    def _write(self, batch):
+        conn = self._connect()
+        rows = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for op, session, entry in batch:
+                if op == 'add':
+                    answer = entry['answer']
+                    if callable(answer):
+                        try:
+                            answer = entry['answer'] = answer()
+                        except Exception as e:
+                            print(f"History entry for '{entry['question'][:50]}' dropped: {e}")
+                            continue
+                    conn.execute(
+                        "INSERT INTO history (session, question, answer, cached, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (session, entry['question'], answer or '', int(bool(entry['cached'])), entry['created_at'])
+                    )
+                    rows += 1
+                elif op == 'clear':
+                    conn.execute("DELETE FROM history WHERE session = ?", (session,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._writes += rows
+        if rows and self._writes % _PRUNE_EVERY < rows:
+            self._prune(conn)
+
+    def _prune(self, conn):
+        """Drop the oldest rows beyond max_entries."""
+        newest = conn.execute("SELECT COALESCE(MAX(id), 0) FROM history").fetchone()[0]
+        conn.execute("DELETE FROM history WHERE id <= ?", (newest - self.max_entries,))
+
+    def flush(self, timeout=_FLUSH_TIMEOUT):
+        """Wait until the writes queued so far by this worker are committed."""
+        if not self.path or self._writer_pid != os.getpid():
+            return
+        done = threading.Event()
+        self._queue.put(('flush', None, done))
+        done.wait(timeout)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            indexed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'history_search'").fetchone()
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            if not indexed:
+                # New search index over a store written before it existed
+                conn.execute("INSERT INTO history_search (history_search) VALUES ('rebuild')")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def page(self, session, cursor=None, limit=HISTORY_PAGE_SIZE, search=None):
+        """Return (entries, next_cursor): newest first, older than `cursor`, optionally matching `search`.
+
+        Each entry has id, question, answer, timestamp and cached; pass the
+        returned next_cursor to get the following page (None on the last page).
+        """
+        limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+        cursor = int(cursor) if cursor else None
+        session = session_id(session)
+        if self.path:
+            self.flush()
+            try:
+                return self._page_from_store(session, cursor, limit, search)
+            except sqlite3.Error as e:
+                print(f"History read failed, serving this worker's recent entries: {e}")
+        return self._page_from_ring(session, cursor, limit, search)
+
+    def _page_from_store(self, session, cursor, limit, search):
+        conn = self._connect()
+        before = cursor if cursor is not None else -1
+        match = fts_query(search, session) if search else None
+        if search and match is None:
+            return [], None
+        if match:
+            rows = conn.execute(
+                # Walk the index newest first (rowid order) so a page stops after `limit` hits
+                "SELECT h.id, h.question, h.answer, h.cached, h.created_at FROM history_search "
+                "JOIN history h ON h.id = history_search.rowid "
+                "WHERE history_search MATCH ? AND (? < 0 OR history_search.rowid < ?) "
+                "ORDER BY history_search.rowid DESC LIMIT ?",
+                (match, before, before, limit + 1)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, question, answer, cached, created_at FROM history "
+                "WHERE session = ? AND (? < 0 OR id < ?) ORDER BY id DESC LIMIT ?",
+                (session, before, before, limit + 1)
+            ).fetchall()
+        entries = [{'id': row[0], 'question': row[1], 'answer': row[2], 'cached': bool(row[3]),
+                    'timestamp': _timestamp(row[4])} for row in rows[:limit]]
+        return entries, (str(entries[-1]['id']) if len(rows) > limit else None)
+
+    def _page_from_ring(self, session, cursor, limit, search):
+        with self._lock:
+            ring = list(self._sessions.get(session, ()))
+        words = search.casefold().split() if search else []
+        entries = []
+        more = False
+        for entry in reversed(ring):
+            if cursor is not None and entry['id'] >= cursor:
+                continue
+            answer = entry['answer']
+            if callable(answer):
+                answer = entry['answer'] = answer()
+            if words:
+                text = (entry['question'] + ' ' + (answer or '')).casefold()
+                if not all(word in text for word in words):
+                    continue
+            if len(entries) == limit:
+                more = True
+                break
+            entries.append({'id': entry['id'], 'question': entry['question'], 'answer': answer or '',
+                            'cached': entry['cached'], 'timestamp': _timestamp(entry['created_at'])})
+        return entries, (str(entries[-1]['id']) if more else None)
+
+    def stats(self):
+        with self._lock:
+            sessions = len(self._sessions)
+        return {'sessions_in_memory': sessions, 'pending_writes': self._queue.qsize(), 'path': self.path}
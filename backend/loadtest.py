@@ -0,0 +1,335 @@
+"""Load-test /api/query and report latency, throughput, errors, bytes on the wire, server CPU and memory.
+
+Replays a question corpus at a fixed concurrency. Pair it with fake_deepseek.py
+to measure the server without spending API credits:
+
+    python fake_deepseek.py --port 8099 &
+    DEEPSEEK_API_URL=http://127.0.0.1:8099/v1/chat/completions gunicorn medinquire_web:app -p /tmp/gunicorn.pid &
+    python loadtest.py --concurrency 50 --requests 500 --bust-cache --server-pid $(cat /tmp/gunicorn.pid)
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+import uuid
+import zlib
+
+import aiohttp
+
+try:
+    import brotli
+except ImportError:  # only needed to decode br responses
+    brotli = None
+
+# Default corpus, the same questions medinquire.main() demonstrates
+DEFAULT_QUESTIONS = [
+    "What were the findings of the Protected TAVR trial for cerebral embolic protection?",
+    "Can you tell me about the Protected TAVR clinical trial?",
+    "What's the relationship between diabetes and cardiovascular disease?",
+    "Recent advances in CRISPR gene therapy for sickle cell disease"
+]
+
+# Rule of thumb for turning streamed characters into model tokens
+CHARS_PER_TOKEN = 4
+
+
+def load_questions(path):
+    """Read questions from a JSONL ({"question": ...} or {"query": ...}), CSV or plain text file."""
+    if not path:
+        return list(DEFAULT_QUESTIONS)
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                text = row.get('question') or row.get('query')
+                if text:
+                    questions.append(text)
+            return questions
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                item = json.loads(line)
+                text = item.get('question') or item.get('query')
+            else:
+                text = line
+            if text:
+                questions.append(text)
+    return questions
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def server_pids(server_pid):
+    """Return the server pid and the pids of its direct children (Linux /proc)."""
+    pids = [server_pid]
+    try:
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # Field 4 is the parent pid; the command name may contain spaces
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == server_pid:
+                pids.append(int(entry))
+    except OSError:
+        return []
+    return pids
+
+
+def cpu_seconds(server_pid):
+    """Total user+system CPU seconds used so far by the server and its workers."""
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0.0
+    for pid in server_pids(server_pid):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            # utime and stime are fields 14 and 15
+            total += (int(fields[11]) + int(fields[12])) / ticks
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+def worker_memory(server_pid):
+    """Return {pid: RSS in MiB} for the server process and its children (Linux /proc)."""
+    memory = {}
+    for pid in server_pids(server_pid):
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        memory[pid] = int(line.split()[1]) / 1024.0
+                        break
+        except OSError:
+            continue
+    return memory
+
+
+class Result:
+    __slots__ = ('ok', 'status', 'ttfb', 'total', 'chars', 'events', 'wire_bytes', 'body_bytes', 'error')
+
+    def __init__(self):
+        self.ok = False
+        self.status = None
+        self.ttfb = None
+        self.total = None
+        self.chars = 0
+        self.events = 0
+        self.wire_bytes = 0
+        self.body_bytes = 0
+        self.error = None
+
+
+def count_sse(body, result):
+    """Count content characters and events in a chunk of SSE frames (JSON or ?format=text)."""
+    for event in body.split(b'\n\n'):
+        lines = [line[6:] for line in event.split(b'\n') if line.startswith(b'data: ')]
+        if not lines:
+            continue
+        result.events += 1
+        if len(lines) == 1 and lines[0].startswith(b'{'):
+            try:
+                result.chars += len(json.loads(lines[0]).get('content', ''))
+                continue
+            except (ValueError, AttributeError):
+                pass
+        result.chars += len(b'\n'.join(lines).decode('utf-8', 'replace'))
+
+
+def decompressor(encoding):
+    """Return a function that incrementally decodes a response body with `encoding`."""
+    if encoding in ('gzip', 'deflate'):
+        return zlib.decompressobj(31 if encoding == 'gzip' else 15).decompress
+    if encoding == 'br':
+        if brotli is None:
+            raise RuntimeError('Server sent brotli but the brotli package is not installed')
+        return brotli.Decompressor().process
+    return lambda data: data
+
+
+async def run_one(session, url, question, timeout, accept_encoding=None):
+    result = Result()
+    start = time.perf_counter()
+    headers = {'Accept-Encoding': accept_encoding or 'identity'}
+    try:
+        async with session.post(url, json={'query': question}, headers=headers,
+                                timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            result.status = response.status
+            is_sse = response.headers.get('Content-Type', '').startswith('text/event-stream')
+            decode = decompressor(response.headers.get('Content-Encoding'))
+            pending = b''
+            body = []
+            async for raw in response.content.iter_any():
+                if result.ttfb is None:
+                    result.ttfb = time.perf_counter() - start
+                result.wire_bytes += len(raw)
+                chunk = decode(raw)
+                result.body_bytes += len(chunk)
+                if is_sse:
+                    pending += chunk
+                    complete, sep, pending = pending.rpartition(b'\n\n')
+                    if sep:
+                        count_sse(complete, result)
+                else:
+                    body.append(chunk)
+            if is_sse and pending:
+                count_sse(pending, result)
+            elif body:
+                try:
+                    data = json.loads(b''.join(body))
+                    result.chars = len(data.get('content', '') or '')
+                    result.events = 1
+                except (ValueError, AttributeError):
+                    # Not our JSON, e.g. a proxy's HTML error page
+                    result.error = f'HTTP {response.status} (non-JSON body)'
+            result.ok = response.status == 200 and result.chars > 0
+            if not result.ok and result.error is None:
+                result.error = f'HTTP {response.status}'
+    except asyncio.TimeoutError:
+        result.error = 'timeout'
+    except aiohttp.ClientError as e:
+        result.error = type(e).__name__
+    result.total = time.perf_counter() - start
+    return result
+
+
+async def run_load(args, questions):
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    results = []
+    memory_peaks = {}
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        question = questions[i % len(questions)]
+        if args.bust_cache:
+            question = f"{question} [{uuid.uuid4().hex[:8]}]"
+        queue.put_nowait(question)
+
+    async def worker(session):
+        while True:
+            try:
+                question = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results.append(await run_one(session, args.url, question, args.timeout, args.accept_encoding))
+
+    async def sample_memory(stop):
+        while not stop.is_set():
+            for pid, rss in worker_memory(args.server_pid).items():
+                memory_peaks[pid] = max(memory_peaks.get(pid, 0.0), rss)
+            try:
+                await asyncio.wait_for(stop.wait(), 0.5)
+            except asyncio.TimeoutError:
+                pass
+
+    stop = asyncio.Event()
+    sampler = asyncio.ensure_future(sample_memory(stop)) if args.server_pid else None
+    cpu_start = cpu_seconds(args.server_pid) if args.server_pid else None
+    start = time.perf_counter()
+    # Bodies are decoded by run_one so the compressed size on the wire can be counted
+    async with aiohttp.ClientSession(connector=connector, auto_decompress=False) as session:
+        await asyncio.gather(*(worker(session) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    server_cpu = cpu_seconds(args.server_pid) - cpu_start if args.server_pid else None
+    stop.set()
+    if sampler is not None:
+        await sampler
+    return results, elapsed, memory_peaks, server_cpu
+
+
+def summarize(results, elapsed, memory_peaks, args, server_cpu=None):
+    ok = [r for r in results if r.ok]
+    ttfb = [r.ttfb * 1000 for r in ok if r.ttfb is not None]
+    total = [r.total * 1000 for r in ok]
+    tokens = sum(r.chars for r in ok) / CHARS_PER_TOKEN
+    stream_rates = [r.chars / CHARS_PER_TOKEN / (r.total - r.ttfb) for r in ok if r.ttfb is not None and r.total > r.ttfb]
+    errors = {}
+    for r in results:
+        if not r.ok:
+            errors[r.error or 'empty answer'] = errors.get(r.error or 'empty answer', 0) + 1
+    summary = {
+        'requests': len(results),
+        'concurrency': args.concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(len(results) / elapsed, 2) if elapsed else 0.0,
+        'error_rate': round(1 - len(ok) / len(results), 4) if results else 0.0,
+        'errors': errors,
+        'ttfb_ms': {p: round(percentile(ttfb, p), 1) for p in (50, 95, 99)},
+        'total_ms': {p: round(percentile(total, p), 1) for p in (50, 95, 99)},
+        'tokens_per_s': round(tokens / elapsed, 1) if elapsed else 0.0,
+        'tokens_per_s_per_stream_p50': round(percentile(stream_rates, 50), 1),
+        'events_per_answer_p50': percentile([r.events for r in ok], 50),
+        'wire_bytes_per_answer_p50': percentile([r.wire_bytes for r in ok], 50),
+        'body_bytes_per_answer_p50': percentile([r.body_bytes for r in ok], 50),
+        'compression_ratio': round(sum(r.body_bytes for r in ok) / max(1, sum(r.wire_bytes for r in ok)), 2),
+    }
+    if server_cpu is not None and results:
+        summary['server_cpu_ms_per_stream'] = round(server_cpu * 1000 / len(results), 2)
+    if memory_peaks:
+        summary['peak_rss_mib'] = {str(pid): round(rss, 1) for pid, rss in sorted(memory_peaks.items())}
+    return summary
+
+
+def print_summary(summary):
+    print(f"Requests: {summary['requests']} at concurrency {summary['concurrency']} "
+          f"in {summary['elapsed_s']}s ({summary['requests_per_s']} req/s)")
+    print(f"Error rate: {summary['error_rate'] * 100:.2f}% {summary['errors'] or ''}")
+    t = summary['ttfb_ms']
+    print(f"TTFB ms:    p50 {t[50]:8.1f}  p95 {t[95]:8.1f}  p99 {t[99]:8.1f}")
+    t = summary['total_ms']
+    print(f"Total ms:   p50 {t[50]:8.1f}  p95 {t[95]:8.1f}  p99 {t[99]:8.1f}")
+    print(f"Throughput: {summary['tokens_per_s']} tokens/s overall, "
+          f"{summary['tokens_per_s_per_stream_p50']} tokens/s per stream (p50, ~{CHARS_PER_TOKEN} chars/token)")
+    print(f"Events per answer (p50): {summary['events_per_answer_p50']}")
+    print(f"Bytes per answer (p50): {summary['wire_bytes_per_answer_p50']} on the wire, "
+          f"{summary['body_bytes_per_answer_p50']} decoded (ratio {summary['compression_ratio']})")
+    if 'server_cpu_ms_per_stream' in summary:
+        print(f"Server CPU per stream: {summary['server_cpu_ms_per_stream']} ms")
+    for pid, rss in summary.get('peak_rss_mib', {}).items():
+        print(f"Peak RSS pid {pid}: {rss} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the AskMedicine /api/query endpoint')
+    parser.add_argument('--url', default='http://127.0.0.1:8086/api/query', help='Query endpoint URL')
+    parser.add_argument('--questions', help='Question corpus (JSONL, CSV or one question per line)')
+    parser.add_argument('--concurrency', type=int, default=10, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=100, help='Total requests to send')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Per-request timeout in seconds')
+    parser.add_argument('--bust-cache', action='store_true', help='Make every question unique so the answer cache misses')
+    parser.add_argument('--server-pid', type=int, help='Sample RSS and CPU time of this pid and its worker children')
+    parser.add_argument('--accept-encoding', help='Accept-Encoding to send, e.g. "gzip" or "br" (default identity)')
+    parser.add_argument('--format', choices=('json', 'text'), default='json',
+                        help='SSE frame format to request (text = compact ?format=text frames)')
+    parser.add_argument('--json', dest='json_out', help='Also write the summary as JSON to this file')
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    if not questions:
+        sys.exit('No questions to replay')
+    if args.format == 'text':
+        args.url += ('&' if '?' in args.url else '?') + 'format=text'
+    results, elapsed, memory_peaks, server_cpu = asyncio.run(run_load(args, questions))
+    summary = summarize(results, elapsed, memory_peaks, args, server_cpu)
+    print_summary(summary)
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,47 +1,24 @@
 import os
+import sys
+import argparse
+import csv
 import json
 import textwrap
-import re
+import threading
 import requests
 import time
-import ssl
-import certifi
-from urllib3.util import ssl_
-from requests.adapters import HTTPAdapter
-from urllib3.poolmanager import PoolManager
-from urllib3.exceptions import InsecureRequestWarning
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from dotenv import load_dotenv
+from deepseek_client import CircuitOpenError
+import deepseek_client
+from answer_cache import normalize_query
+from prompts import build_payload
+from sse_parser import SSEParser, iter_content, iter_raw_chunks
+import metrics
 
 # Load environment variables
 load_dotenv()
 
-# Custom HTTPS adapter with modern SSL configuration
-class TlsAdapter(HTTPAdapter):
-    def init_poolmanager(self, connections, maxsize, block=False):
-        """Create and initialize the urllib3 PoolManager with enhanced TLS settings."""
-        ctx = ssl_.create_urllib3_context(
-            ssl_version=ssl.PROTOCOL_TLS,
-            cert_reqs=ssl.CERT_REQUIRED,
-            options=ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3 | ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
-        )
-        
-        # Use the system's trusted CA certificates
-        self.poolmanager = PoolManager(
-            num_pools=connections,
-            maxsize=maxsize,
-            block=block,
-            ssl_context=ctx,
-            cert_reqs=ssl.CERT_REQUIRED,
-            ca_certs=certifi.where()
-        )
-
-# Create a session with appropriate TLS settings
-def create_secure_session():
-    session = requests.Session()
-    adapter = TlsAdapter()
-    session.mount('https://', adapter)
-    return session
-
 # Initialize DeepSeek API client
 def get_deepseek_api_key():
     api_key = os.getenv("DEEPSEEK_API_KEY")
@@ -49,6 +26,10 @@ def get_deepseek_api_key():
         raise ValueError("Missing required DeepSeek API key in .env file")
     return api_key
 
+def direct_answer_payload(question):
+    """Non-streaming chat completion request body used by generate_direct_answer() and bulk mode"""
+    return build_payload(question, stream=False)
+
 def generate_direct_answer(question):
     """Generate an answer directly using DeepSeek v3 API"""
     api_key = get_deepseek_api_key()
@@ -57,68 +38,11 @@ def generate_direct_answer(question):
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
-    
-    system_message = """You are AskMedicine, a specialized medical research assistant that provides evidence-based answers to medical questions. 
-    
-Your goal is to:
-1. Provide accurate, up-to-date medical information based on the latest research
-2. Explain medical concepts clearly and comprehensively 
-3. Be honest about limitations in medical knowledge where appropriate
-4. Cite specific research when possible
-5. Explain the strength of evidence behind medical claims
-
-Follow these specific formatting guidelines:
-1. Always use proper Markdown formatting:
-   - Make **headings bold** using the syntax "**Heading:**"
-   - Format *subheadings in italics* using "*Subheading:*"
-   - **Bold important medical terms, statistics, and key findings**
-   - ***Bold and italicize clinical trial names and guideline recommendations***
-   - Properly format tables with headers for comparisons
-   
-2. When citing research:
-   - Include author names and year: "Smith J, et al. (2023)"
-   - Keep citation style consistent throughout
-   - DO NOT include PubMed IDs or hyperlinks
-   
-3. For step-by-step procedures, guidelines, or recommendations:
-   - Present them as numbered or bulleted lists with proper indentation
-   - Maintain clear headings for different sections
-   - Use line breaks between sections for clarity
-   - Ensure proper spacing after bullet point markers (-, *, •)
-   
-4. When comparing treatments, drugs, or approaches:
-   - Use properly formatted markdown tables with clear headers for direct comparisons
-   - Include column headers that clearly indicate what is being compared
-   - Use consistent metrics across rows to facilitate comparison
-   - Highlight significant differences with bold text
-   - Always include a brief textual summary of the key differences before or after the table
-   
-5. References should be included at the end in this format: "Author Name, et al. (YEAR). Title of paper."
-   
-6. End each answer with "Related" followed by 3-4 specific follow-up questions that would be logical next questions. Use bullet points instead of numbers for these questions.
-
-Format example for Related questions:
-Related:
-- Question one?
-- Question two?
-- Question three?"""
-    
-    url = "https://api.deepseek.com/v1/chat/completions"
-    
-    payload = {
-        "model": "deepseek-chat", 
-        "messages": [
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": question}
-        ],
-        "temperature": 0.4,
-        "max_tokens": 1200
-    }
+    payload = direct_answer_payload(question)
     
     try:
-        # Use a secured session for the request
-        session = create_secure_session()
-        response = session.post(url, headers=headers, json=payload, timeout=45)
+        # Reuse the shared keep-alive session for the request
+        response = deepseek_client.post(headers, payload, timeout=45)
         print(f"Status code: {response.status_code}")
         print(f"Response: {response.text}")
         
@@ -126,6 +50,9 @@ Related:
         
         result = response.json()
         return result["choices"][0]["message"]["content"]
+    except CircuitOpenError as circuit_err:
+        print(f"Skipping DeepSeek API call: {str(circuit_err)}")
+        return f"The medical knowledge database is temporarily unavailable after repeated errors. Please try again in about {circuit_err.retry_after} seconds."
     except requests.exceptions.SSLError as ssl_err:
         print(f"SSL Error connecting to DeepSeek API: {str(ssl_err)}")
         return "I apologize, but there's a secure connection issue when trying to reach the medical knowledge database. This is likely a temporary network security issue. Please try again in a few moments."
@@ -145,7 +72,7 @@ Related:
 
 def generate_streaming_answer(question):
     """Generate a streaming answer using DeepSeek v3 API"""
-    start_time = time.time()
+    start_time = time.perf_counter()
     api_key = get_deepseek_api_key()
     
     headers = {
@@ -153,145 +80,259 @@ def generate_streaming_answer(question):
         "Content-Type": "application/json"
     }
     
-    system_message = """You are AskMedicine, a specialized medical research assistant that provides evidence-based answers to medical questions. 
-    
-Your goal is to:
-1. Provide accurate, up-to-date medical information based on the latest research
-2. Explain medical concepts clearly and comprehensively 
-3. Be honest about limitations in medical knowledge where appropriate
-4. Cite specific research when possible
-5. Explain the strength of evidence behind medical claims
-
-Follow these specific formatting guidelines:
-1. Always use proper Markdown formatting:
-   - Make **headings bold** using the syntax "**Heading:**"
-   - Format *subheadings in italics* using "*Subheading:*"
-   - **Bold important medical terms, statistics, and key findings**
-   - ***Bold and italicize clinical trial names and guideline recommendations***
-   - Properly format tables with headers for comparisons
-   
-2. When citing research:
-   - Include author names and year: "Smith J, et al. (2023)"
-   - Keep citation style consistent throughout
-   - DO NOT include PubMed IDs or hyperlinks
-   
-3. For step-by-step procedures, guidelines, or recommendations:
-   - Present them as numbered or bulleted lists with proper indentation
-   - Maintain clear headings for different sections
-   - Use line breaks between sections for clarity
-   - Ensure proper spacing after bullet point markers (-, *, •)
-   
-4. When comparing treatments, drugs, or approaches:
-   - Use properly formatted markdown tables with clear headers for direct comparisons
-   - Include column headers that clearly indicate what is being compared
-   - Use consistent metrics across rows to facilitate comparison
-   - Highlight significant differences with bold text
-   - Always include a brief textual summary of the key differences before or after the table
-   
-5. References should be included at the end in this format: "Author Name, et al. (YEAR). Title of paper."
-   
-6. End each answer with "Related" followed by 3-4 specific follow-up questions that would be logical next questions. Use bullet points instead of numbers for these questions.
-
-Format example for Related questions:
-Related:
-- Question one?
-- Question two?
-- Question three?"""
-    
-    url = "https://api.deepseek.com/v1/chat/completions"
-    
-    payload = {
-        "model": "deepseek-chat", 
-        "messages": [
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": question}
-        ],
-        "temperature": 0.3,  # Prioritizing accuracy with lower temperature
-        "max_tokens": 2000,  # Keeping higher token count for more comprehensive answers
-        "stream": True  # Enable streaming
-    }
+    # Prompt profile and token budget follow the question (see prompts.py)
+    payload = build_payload(question)
     
     try:
-        print(f"Requesting streaming response for: '{question[:50]}...'")
-        request_start = time.time()
+        request_start = time.perf_counter()
         
-        # Use a secured session for the streaming request
-        session = create_secure_session()
-        
-        # Use stream=True in requests to get the response incrementally
-        response = session.post(url, headers=headers, json=payload, stream=True, timeout=60)
-        first_byte_time = time.time()
-        print(f"Time to first byte: {first_byte_time - request_start:.2f} seconds")
+        # Use stream=True over the shared keep-alive session to get the response incrementally.
+        # The read timeout adapts to the observed time to first byte.
+        response = deepseek_client.post(headers, payload, stream=True)
+        metrics.UPSTREAM_TTFB.observe(time.perf_counter() - request_start)
         
         response.raise_for_status()
         
-        # For collecting the complete answer
-        full_answer = ""
-        chunk_count = 0
-        last_yield_time = time.time()
-        buffer = ""  # Buffer to accumulate smaller chunks
-        
-        # Iterate through the streaming response
-        for line in response.iter_lines():
-            if line:
-                # Format is "data: {json}" for SSE
-                line_text = line.decode('utf-8')
-                if line_text.startswith("data: "):
-                    json_str = line_text[6:]  # Remove "data: " prefix
-                    
-                    # Skip the [DONE] message
-                    if json_str.strip() == "[DONE]":
-                        break
-                    
-                    try:
-                        response_json = json.loads(json_str)
-                        delta = response_json.get("choices", [{}])[0].get("delta", {})
-                        content = delta.get("content", "")
-                        if content:
-                            chunk_count += 1
-                            full_answer += content
-                            
-                            # Yield each piece immediately for maximum streaming speed
-                            yield content
-                    except json.JSONDecodeError:
-                        print(f"Error decoding JSON: {json_str}")
-                        continue
+        # Parse the SSE byte stream incrementally; the parser collects the full answer
+        parser = SSEParser()
+        try:
+            for content in iter_content(iter_raw_chunks(response), parser):
+                # Yield each piece immediately for maximum streaming speed
+                yield content
+        finally:
+            # Free the connection right away if the caller stops reading early
+            response.close()
+        full_answer = parser.answer()
         
-        # Yield any remaining content in the buffer
-        if buffer:
-            yield buffer
-        
-        end_time = time.time()
-        total_time = end_time - start_time
-        print(f"Total streaming response time: {total_time:.2f} seconds")
-        print(f"Received {chunk_count} content chunks")
+        metrics.GENERATION_SECONDS.observe(time.perf_counter() - start_time)
+        metrics.ANSWER_CHUNKS.observe(len(parser.parts))
         
         # At the end, return the full answer for reference (though not used in streaming mode)
         return full_answer
         
+    except CircuitOpenError as circuit_err:
+        error_msg = f"The medical knowledge database is temporarily unavailable after repeated errors. Please try again in about {circuit_err.retry_after} seconds."
+        print(f"Skipping DeepSeek API call: {str(circuit_err)}")
+        yield error_msg
+        return error_msg
     except requests.exceptions.SSLError as ssl_err:
+        metrics.UPSTREAM_ERRORS.inc()
         error_msg = "I apologize, but there's a secure connection issue when trying to reach the medical knowledge database. This is likely a temporary network security issue. Please try again in a few moments."
         print(f"SSL Error connecting to DeepSeek API: {str(ssl_err)}")
         yield error_msg
         return error_msg
     except requests.exceptions.ConnectionError as conn_err:
+        metrics.UPSTREAM_ERRORS.inc()
         error_msg = "I'm having trouble connecting to the medical knowledge database. This might be due to network issues or the service may be temporarily unavailable. Please check your internet connection and try again."
         print(f"Connection Error with DeepSeek API: {str(conn_err)}")
         yield error_msg
         return error_msg
     except requests.exceptions.Timeout as timeout_err:
+        metrics.UPSTREAM_TIMEOUTS.inc()
         error_msg = "The request to the medical knowledge database timed out. The service might be experiencing high load. Please try again in a few moments."
         print(f"Timeout Error with DeepSeek API: {str(timeout_err)}")
         yield error_msg
         return error_msg
     except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc()
         error_msg = f"I apologize, but I'm unable to generate an answer at this time due to an error: {str(e)}"
         print(f"Error generating streaming answer with DeepSeek: {str(e)}")
         yield error_msg
         return error_msg
 
+def parse_line(line):
+    """Decode a JSONL item; a line that only looks like JSON ('"Doctor" approval of...') is a plain question."""
+    if line.startswith('{') or line.startswith('"'):
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            pass
+    return line
+
+def read_questions(f, fmt=None):
+    """Yield (id, question) pairs from a JSONL, CSV or one-question-per-line stream.
+
+    JSONL items may be plain strings or objects with "question" (or "query") and an
+    optional "id"; CSV needs a "question" (or "query") column and may have "id".
+    Items without an id are identified by their normalized question.
+    """
+    if fmt == 'csv':
+        rows = csv.DictReader(f)
+    else:
+        rows = (parse_line(line) for line in (raw.strip() for raw in f) if line)
+    for row in rows:
+        if isinstance(row, dict):
+            question = (row.get('question') or row.get('query') or '').strip()
+            item_id = row.get('id') or None
+        else:
+            question, item_id = str(row).strip(), None
+        if question:
+            yield str(item_id) if item_id is not None else normalize_query(question), question
+
+def read_checkpoint(path):
+    """Return {id: record} for the answered items of a bulk output file.
+
+    Failed items are left out so they are retried, and a line cut short by an
+    interrupted run is skipped.
+    """
+    done = {}
+    if not path or not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('answer') and not record.get('error'):
+                done[record['id']] = record
+    return done
+
+class RequestPacer:
+    """Spaces requests from all workers to at most `per_minute` (0 = no limit)."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def fetch_direct_answer(question, headers, pacer, attempts=3):
+    """Return the answer text for `question`, raising on failure (no apology text).
+
+    Waits out an open circuit breaker up to `attempts` times instead of failing
+    every remaining item of the run.
+    """
+    for attempt in range(attempts):
+        pacer.wait()
+        try:
+            response = deepseek_client.post(headers, direct_answer_payload(question), timeout=45)
+        except CircuitOpenError as circuit_err:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(circuit_err.retry_after)
+            continue
+        try:
+            response.raise_for_status()
+            return response.json()["choices"][0]["message"]["content"]
+        finally:
+            response.close()
+
+def run_bulk(items, output_path, workers=4, per_minute=60):
+    """Answer (id, question) items concurrently, appending one JSON line per item to `output_path`.
+
+    Items already answered in `output_path` are skipped, so rerunning an
+    interrupted job only pays for what is left. Returns (answered, failed, skipped).
+    """
+    done = read_checkpoint(output_path)
+    headers = {
+        "Authorization": f"Bearer {get_deepseek_api_key()}",
+        "Content-Type": "application/json"
+    }
+    pacer = RequestPacer(per_minute)
+    answered = failed = skipped = 0
+    seen = set(done)
+    # Keep a torn last line from an interrupted run on its own line
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b'\n'
+    else:
+        torn = False
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk')
+    pending = {}
+    try:
+        with open(output_path, 'a', encoding='utf-8') as out:
+            if torn:
+                out.write('\n')
+
+            def write(future):
+                nonlocal answered, failed
+                item_id, question, start = pending.pop(future)
+                record = {'id': item_id, 'question': question}
+                try:
+                    record['answer'] = future.result()
+                    answered += 1
+                except Exception as e:
+                    record['error'] = str(e)
+                    failed += 1
+                    print(f"Failed to answer '{question[:50]}': {e}", file=sys.stderr)
+                record['seconds'] = round(time.perf_counter() - start, 2)
+                record['time'] = int(time.time())
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+
+            for item_id, question in items:
+                if item_id in seen:
+                    skipped += 1
+                    continue
+                seen.add(item_id)
+                # Bounded window so a huge input file is not read into memory up front
+                while len(pending) >= workers * 2:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        write(future)
+                future = executor.submit(fetch_direct_answer, question, headers, pacer)
+                pending[future] = (item_id, question, time.perf_counter())
+            for future in as_completed(list(pending)):
+                write(future)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return answered, failed, skipped
+
+def print_answer(answer):
+    # Print the answer with nice wrapping
+    for line in answer.split('\n'):
+        if line.strip():
+            wrapped = textwrap.fill(line, width=100)
+            print(wrapped)
+        else:
+            print()
+
 def main():
-    """Main demo function"""
+    """Answer questions in bulk (--input/--output), warm the answer cache (--load-cache), or run the demo"""
+    parser = argparse.ArgumentParser(description='MedInquire direct answers, one-off or in bulk')
+    parser.add_argument('--input', help='Questions to answer: JSONL, CSV or one per line; "-" for stdin')
+    parser.add_argument('--input-format', choices=('jsonl', 'csv'), default=None,
+                        help='Input format (default: csv for *.csv, otherwise jsonl/plain lines)')
+    parser.add_argument('--output', default='answers.jsonl',
+                        help='Append-only JSONL of answers; rerunning resumes from it')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent DeepSeek requests')
+    parser.add_argument('--rate', type=float, default=60, help='Max requests per minute across workers (0 = no limit)')
+    parser.add_argument('--load-cache', metavar='ANSWERS_JSONL',
+                        help='Load a bulk output file into the answer cache (ANSWER_CACHE_PATH) and exit')
+    args = parser.parse_args()
+
+    if args.load_cache:
+        from query_service import warm_cache
+        print(f"Loaded {warm_cache(args.load_cache)} answers into the answer cache")
+        return
+
+    if args.input:
+        fmt = args.input_format or ('csv' if args.input.endswith('.csv') else 'jsonl')
+        f = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8', newline='')
+        try:
+            start = time.perf_counter()
+            answered, failed, skipped = run_bulk(read_questions(f, fmt), args.output,
+                                                 workers=max(1, args.workers), per_minute=args.rate)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        print(f"Answered {answered}, failed {failed}, already done {skipped} "
+              f"in {time.perf_counter() - start:.1f}s -> {args.output}")
+        if failed:
+            print("Rerun the same command to retry the failed items")
+        return
+
     print("=== MedInquire Direct Answer Medical Assistant ===\n")
     
     # Test with questions
@@ -309,13 +350,7 @@ def main():
     answer = generate_direct_answer(question)
     
     print("\n=== ANSWER ===\n")
-    # Print the answer with nice wrapping
-    for line in answer.split('\n'):
-        if line.strip():
-            wrapped = textwrap.fill(line, width=100)
-            print(wrapped)
-        else:
-            print()
+    print_answer(answer)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
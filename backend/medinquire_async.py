@@ -0,0 +1,493 @@
+import asyncio
+import json
+import os
+import time
+from aiohttp import web
+import deepseek_client
+from query_service import (
+    API_INFO, HEALTH_INFO, history, history_session, record_flight, UpstreamError, build_payload, encode_frame,
+    lookup_cached, mock_answer_chunks, rate_limiter, rejection_body, response_cache, session_cookie,
+    allows_credentials, cache_entry, encode_text_frame, replay_frames, save_partial, take_partial, upstream_error_status,
+    upstream_headers, wants_json, answer_from_frames, batch_error_lines, batch_line, batch_summary,
+    parse_batch, plan_batch, wants_structure, cached_structure
+)
+from sse_compression import StreamCompressor, compress_chunks, negotiate, stream_headers
+from admission import AsyncAdmissionController, Rejected, client_key
+from history_store import HISTORY_PAGE_SIZE
+from resilience import CircuitOpenError
+import metrics
+import startup
+from prefetch import Prefetcher
+from singleflight import AsyncSingleFlight
+from sse_parser import SSEParser, ChunkCoalescer, aiter_content
+from answer_structure import AnswerStructure, encode_event, is_event_frame
+
+# asyncio serving mode: each open SSE stream is a coroutine instead of a pinned
+# worker, so one process can hold thousands of concurrent answers. The Flask app
+# in medinquire_web.py remains the fallback. Run with
+#   gunicorn medinquire_async:app --worker-class aiohttp.GunicornWebWorker
+# or `python medinquire_async.py --port 8086`.
+
+# Concurrent identical questions on this event loop share one upstream stream
+inflight = AsyncSingleFlight()
+
+# Caps concurrent upstream generations on this event loop and sheds the excess with 429s
+admission = AsyncAdmissionController()
+
+# The event loop prefetches run on, set when the app starts
+_loop = None
+
+
+async def run_blocking(func, *args):
+    """Run a blocking call (e.g. the SQLite cache tier) without stalling the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def open_answer_stream(query_text, prefetch_related=True):
+    """Open a DeepSeek stream for `query_text` and return an async generator of SSE frames.
+
+    Once the answer is cached its Related follow-ups are queued for prefetch
+    (unless `prefetch_related` is False). Closing the generator early (every client disconnected) closes the upstream
+    response and keeps the partial text for a later resume.
+    """
+    request_start = time.perf_counter()
+    partial = await run_blocking(take_partial, query_text)
+    try:
+        response = None
+        if partial:
+            response = await deepseek_client.async_post(upstream_headers(), build_payload(query_text, prefix=partial),
+                                                        url=deepseek_client.DEEPSEEK_PREFIX_API_URL)
+            if response.status != 200:
+                # Prefix completion unavailable: answer from scratch
+                response.release()
+                response, partial = None, None
+        if response is None:
+            response = await deepseek_client.async_post(upstream_headers(), build_payload(query_text))
+    except CircuitOpenError as api_error:
+        raise UpstreamError('DeepSeek API is temporarily unavailable, please retry shortly',
+                            retry_after=api_error.retry_after)
+    except asyncio.TimeoutError as api_error:
+        metrics.UPSTREAM_TIMEOUTS.inc()
+        print(f"Timeout making request to DeepSeek API: {api_error}")
+        raise UpstreamError('Error connecting to DeepSeek API: timed out')
+    except Exception as api_error:
+        metrics.UPSTREAM_ERRORS.inc()
+        print(f"Error making request to DeepSeek API: {api_error}")
+        raise UpstreamError(f'Error connecting to DeepSeek API: {str(api_error)}')
+    metrics.UPSTREAM_TTFB.observe(time.perf_counter() - request_start)
+
+    if response.status != 200:
+        metrics.UPSTREAM_ERRORS.inc()
+        error_content = await response.text()
+        response.release()
+        print(f"DeepSeek API error response: {error_content}")
+        raise UpstreamError(f'Failed to get response from DeepSeek API: {error_content}')
+
+    async def generate():
+        parser = SSEParser()
+        structure = AnswerStructure()
+        frames = []
+        streamed = 0
+        metrics.INFLIGHT_STREAMS.inc()
+        try:
+            if partial:
+                # Resumed answer: replay what the earlier stream produced, then continue
+                parser.parts.append(partial)
+                frame = encode_frame(partial)
+                frames.append(frame)
+                streamed += len(frame)
+                yield frame
+                for event in structure.feed(partial):
+                    yield encode_event(event)
+            async for content in aiter_content(response.content.iter_any(), parser, ChunkCoalescer()):
+                frame = encode_frame(content)
+                frames.append(frame)
+                streamed += len(frame)
+                yield frame
+                for event in structure.feed(content):
+                    yield encode_event(event)
+            for event in structure.close():
+                yield encode_event(event)
+        except GeneratorExit:
+            # Every client disconnected: drop the connection so DeepSeek stops generating
+            response.close()
+            metrics.STREAM_ABORTS.inc()
+            asyncio.get_running_loop().run_in_executor(None, save_partial, query_text, parser.answer())
+            raise
+        except asyncio.TimeoutError:
+            # A stall mid-answer also counts against the circuit
+            deepseek_client.breaker.record_failure()
+            metrics.UPSTREAM_TIMEOUTS.inc()
+            raise
+        finally:
+            response.release()
+            metrics.INFLIGHT_STREAMS.dec()
+            metrics.GENERATION_SECONDS.observe(time.perf_counter() - request_start)
+            metrics.ANSWER_CHUNKS.observe(len(parser.parts))
+            metrics.STREAMED_BYTES.observe(streamed)
+
+        # Cache the complete response
+        answer = parser.answer()
+        await run_blocking(response_cache.set, query_text, cache_entry(answer, frames, structure.events))
+        if prefetch_related:
+            prefetcher.submit_from_answer(answer)
+
+    return generate()
+
+
+async def prefetch_answer(query_text):
+    """Generate and cache a follow-up answer on this loop, joining any in-flight stream for it.
+
+    Never queues for admission: returns False if no upstream slot is free right now.
+    """
+    flight = inflight.get(query_text)
+    if flight is None:
+        slot = admission.try_acquire()
+        if slot is None:
+            return False
+        flight = inflight.join(query_text, lambda: open_answer_stream(query_text, prefetch_related=False),
+                               on_finish=slot.release, keep=True)
+    else:
+        flight.keep = True
+    await flight.wait_finished()
+    if flight.error is not None:
+        raise flight.error
+    return True
+
+
+def generate_on_loop(query_text):
+    """Prefetcher.generate for this server: runs prefetch_answer() on the event loop and waits for it."""
+    if _loop is None:
+        return False
+    return asyncio.run_coroutine_threadsafe(prefetch_answer(query_text), _loop).result()
+
+
+# Prefetch workers are threads, but their generations go through this loop's
+# single-flight and admission control, so a follow-up click joins the prefetch
+prefetcher = Prefetcher(generate_on_loop, lambda question: question in response_cache, inflight.in_flight)
+
+
+def request_session(request):
+    """This request's history session; a new one is sent back as a cookie by on_response_prepare()."""
+    session, new = history_session(request.cookies)
+    if new:
+        request['new_session'] = session
+    return session
+
+
+async def read_query(request):
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        data = None
+    return (data or {}).get('query')
+
+
+async def start_sse(request, headers=None):
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                                           **(headers or {})})
+    await response.prepare(request)
+    return response
+
+
+async def index(request):
+    """Root endpoint - returns API information"""
+    return web.json_response(API_INFO)
+
+
+async def query(request):
+    response = None
+    try:
+        query_text = await read_query(request)
+
+        if not query_text:
+            return web.json_response({'error': 'No query provided'}, status=400)
+
+        rate_limiter.check(client_key(request.headers, request.remote))
+
+        # Compact text frames with ?format=text; compression per Accept-Encoding (SSE_COMPRESSION=1)
+        frame_format = request.query.get('format')
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        # ?structure=1 adds named events for sections, table rows, references and related questions
+        structure = wants_structure(request.query.get('structure'))
+
+        session = request_session(request)
+
+        # Check cache first; hits replay the stored SSE frames as-is
+        cached = await run_blocking(lookup_cached, query_text)
+        if cached is not None:
+            history.add(session, query_text, cached['content'], cached=True)
+            if wants_json(request.headers.get('Accept')):
+                if structure:
+                    return web.json_response({'content': cached['content'], 'structure': cached_structure(cached)})
+                return web.json_response({'content': cached['content']})
+            chunks = replay_frames(cached, request.query.get('replay'), frame_format, structure)
+            if encoding:
+                chunks = list(compress_chunks(chunks, encoding))
+            headers = {'Content-Type': 'text/event-stream', **stream_headers(encoding), 'X-Cache': 'HIT'}
+            if len(chunks) == 1:
+                return web.Response(body=chunks[0], headers=headers)
+            response = web.StreamResponse(headers=headers)
+            await response.prepare(request)
+            for chunk in chunks:
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+
+        # Only a new upstream generation needs an admission slot
+        flight = inflight.get(query_text)
+        if flight is None:
+            slot = await admission.acquire()
+            flight = inflight.join(query_text, lambda: open_answer_stream(query_text), on_finish=slot.release)
+        error = await flight.wait_started()
+        if error is not None:
+            status, headers = upstream_error_status(error)
+            return web.json_response({'error': str(error)}, status=status, headers=headers)
+
+        response = await start_sse(request, stream_headers(encoding))
+        compressor = StreamCompressor(encoding) if encoding else None
+        frames = flight.subscribe()
+        try:
+            async for frame in frames:
+                if is_event_frame(frame):
+                    if not structure:
+                        continue
+                elif frame_format == 'text':
+                    frame = encode_text_frame(json.loads(frame[6:])['content'])
+                data = frame.encode('utf-8')
+                await response.write(compressor.compress(data) if compressor else data)
+        finally:
+            # Leave the flight right away when the client disconnects
+            await frames.aclose()
+        if compressor:
+            await response.write(compressor.finish())
+        await response.write_eof()
+        record_flight(session, query_text, flight)
+        return response
+
+    except Rejected as e:
+        # Shed load fast instead of letting the client wait out upstream timeouts
+        return web.json_response(rejection_body(e), status=429, headers={'Retry-After': str(e.retry_after)})
+    except (ConnectionResetError, asyncio.CancelledError):
+        # Client went away mid-stream: the flight was left above and the answer is not
+        # recorded, as on the Flask server. Nothing more can be sent, so end quietly.
+        return response if response is not None else web.Response(status=499)
+    except Exception as e:
+        print(f"Error in query endpoint: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def answer(query_text):
+    """Return the answer to an uncached question once its generation has finished (for /api/batch).
+
+    Like query_service.answer_blocking(), queues no Related prefetches.
+    """
+    flight = inflight.get(query_text)
+    if flight is None:
+        slot = await admission.acquire()
+        flight = inflight.join(query_text, lambda: open_answer_stream(query_text, prefetch_related=False),
+                               on_finish=slot.release, keep=True)
+    else:
+        flight.keep = True
+    await flight.wait_finished()
+    if flight.error is not None:
+        raise flight.error
+    return answer_from_frames(flight.chunks)
+
+
+async def batch(request):
+    """Answer a list of questions; one NDJSON line per question, in completion order"""
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        data = None
+    try:
+        questions, concurrency = parse_batch(data)
+        rate_limiter.check(client_key(request.headers, request.remote))
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    except Rejected as e:
+        return web.json_response(rejection_body(e), status=429, headers={'Retry-After': str(e.retry_after)})
+
+    hits, invalid, pending = await run_blocking(plan_batch, questions)
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    for line in invalid + hits:
+        await response.write(line.encode('utf-8'))
+
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run(question, indices):
+        async with limit:
+            try:
+                return indices, await answer(question), None
+            except Exception as e:
+                return indices, None, e
+
+    errors = len(invalid)
+    tasks = [asyncio.ensure_future(run(question, indices)) for question, indices in pending]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            indices, content, error = await next_done
+            if error is not None:
+                errors += len(indices)
+                lines = batch_error_lines(questions, indices, error)
+            else:
+                lines = [batch_line(index, questions[index], content=content) for index in indices]
+            await response.write(''.join(lines).encode('utf-8'))
+    finally:
+        # Client went away: drop the queued items (running generations finish into the cache)
+        for task in tasks:
+            task.cancel()
+    await response.write(batch_summary(len(questions), errors, len(hits)).encode('utf-8'))
+    await response.write_eof()
+    return response
+
+
+async def query_alternative(request):
+    """Alternative query endpoint using a simplified mock response"""
+    query_text = await read_query(request)
+
+    if not query_text:
+        return web.json_response({'error': 'No query provided'}, status=400)
+
+    response = await start_sse(request)
+    chunks = mock_answer_chunks(query_text)
+    for chunk in chunks:
+        await response.write(encode_frame(chunk).encode('utf-8'))
+        await asyncio.sleep(0.5)  # Simulate streaming delay without blocking other streams
+
+    # Cache the complete response
+    await run_blocking(response_cache.set, query_text, {'content': ''.join(chunks)})
+    await response.write_eof()
+    return response
+
+
+async def health_check(request):
+    """Health check endpoint"""
+    return web.json_response({**HEALTH_INFO, 'upstream': deepseek_client.upstream_stats()})
+
+
+async def readiness_check(request):
+    """Readiness probe: 503 until this worker has finished warming up"""
+    status = startup.status()
+    if status['status'] != 'ready':
+        return web.json_response(status, status=503, headers={'Retry-After': '1'})
+    return web.json_response(status)
+
+
+async def cache_stats(request):
+    """Answer cache counters, used to size ANSWER_CACHE_MAX_BYTES"""
+    return web.json_response(await run_blocking(response_cache.stats))
+
+
+async def prometheus_metrics(request):
+    """Prometheus metrics, aggregated across all gunicorn workers"""
+    body = await run_blocking(metrics.render_prometheus)
+    return web.Response(body=body.encode('utf-8'), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def admission_stats(request):
+    """Upstream admission slots and wait queue for this worker"""
+    return web.json_response(admission.stats())
+
+
+async def get_history(request):
+    """Get this session's question history, newest first; ?cursor= pages, ?q= searches"""
+    try:
+        entries, next_cursor = await run_blocking(
+            lambda: history.page(request_session(request),
+                                 cursor=request.query.get('cursor'),
+                                 limit=request.query.get('limit', HISTORY_PAGE_SIZE),
+                                 search=request.query.get('q')))
+    except ValueError:
+        return web.json_response({'error': 'Invalid cursor or limit'}, status=400)
+    return web.json_response({'history': entries, 'next_cursor': next_cursor})
+
+
+async def clear_history(request):
+    """Clear this session's question history"""
+    history.clear(request_session(request))
+    return web.json_response({'message': 'History cleared'})
+
+
+async def favicon(request):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'medinquire_static', 'images', 'logo.svg')
+    return web.FileResponse(path, headers={'Content-Type': 'image/svg+xml'})
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    """Answer CORS preflight requests on /api/*, mirroring the Flask-CORS setup."""
+    if request.method == 'OPTIONS' and request.path.startswith('/api/'):
+        return web.Response(headers={
+            'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
+            'Access-Control-Allow-Headers': request.headers.get('Access-Control-Request-Headers', 'Content-Type'),
+        })
+    return await handler(request)
+
+
+async def on_response_prepare(request, response):
+    """Allow any origin on /api/*, with credentials only for CORS_ORIGINS, and send a newly issued session cookie.
+
+    Runs for streams prepared in handlers too. Cookies set on the response are
+    serialized before this hook, so the cookie goes in as a header.
+    """
+    if request.path.startswith('/api/'):
+        origin = request.headers.get('Origin')
+        response.headers['Access-Control-Allow-Origin'] = origin or '*'
+        if allows_credentials(origin):
+            response.headers['Access-Control-Allow-Credentials'] = 'true'
+        response.headers['Vary'] = 'Origin'
+    session = request.get('new_session')
+    if session is not None:
+        response.headers.add('Set-Cookie', session_cookie(session))
+
+
+async def on_startup(app):
+    global _loop
+    _loop = asyncio.get_running_loop()
+    # Fill this worker's aiohttp pool (DEEPSEEK_PREWARM_CONNECTIONS) without delaying startup
+    if deepseek_client.PREWARM_CONNECTIONS > 0:
+        startup.start_async_step('upstream', deepseek_client.async_prewarm())
+
+
+async def on_cleanup(app):
+    await deepseek_client.close_async_session()
+
+
+def create_app():
+    app = web.Application(middlewares=[cors_middleware])
+    app.router.add_get('/', index)
+    app.router.add_post('/api/query', query)
+    app.router.add_post('/api/batch', batch)
+    app.router.add_post('/api/query-alt', query_alternative)
+    app.router.add_get('/api/health', health_check)
+    app.router.add_get('/api/ready', readiness_check)
+    app.router.add_get('/api/cache/stats', cache_stats)
+    app.router.add_get('/api/metrics', prometheus_metrics)
+    app.router.add_get('/api/admission/stats', admission_stats)
+    app.router.add_get('/api/history', get_history)
+    app.router.add_delete('/api/history', clear_history)
+    app.router.add_get('/favicon.ico', favicon)
+    app.on_response_prepare.append(on_response_prepare)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+# TLS context and answer cache (ANSWER_CACHE_PRELOAD) before serving, in the gunicorn master when preloaded;
+# each worker's aiohttp pool is warmed from on_startup
+startup.begin(response_cache, started_later=['upstream'] if deepseek_client.PREWARM_CONNECTIONS > 0 else [])
+
+app = create_app()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run AskMedicine asyncio Web Server')
+    parser.add_argument('--port', type=int, default=8086, help='Port to run the server on')
+    args = parser.parse_args()
+
+    print(f"Starting AskMedicine asyncio Web Server on http://0.0.0.0:{args.port}")
+    web.run_app(app, host='0.0.0.0', port=args.port)
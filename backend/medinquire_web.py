@@ -1,11 +1,19 @@
 import os
-import json
 import time
-from functools import lru_cache
-from flask import Flask, request, jsonify, Response, stream_with_context
+from flask import Flask, g, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from medinquire import generate_direct_answer, generate_streaming_answer
-import requests
+import deepseek_client
+import startup
+from query_service import (
+    API_INFO, HEALTH_INFO, history, history_session, record_flight, recorded, encode_frame, lookup_cached, mock_answer_chunks,
+    admission, parse_batch, rate_limiter, rejection_body, replay_frames, response_cache, run_batch,
+    start_or_join, sse_body, upstream_error_status, wants_json, wants_structure, cached_structure,
+    allows_credentials, session_cookie
+)
+from sse_compression import compress_chunks, negotiate, stream_headers
+from admission import Rejected, client_key
+from history_store import HISTORY_PAGE_SIZE
+import metrics
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -14,38 +22,41 @@ load_dotenv()
 app = Flask(__name__, 
             static_folder='medinquire_static',
             static_url_path='/static')
-# Enable CORS for our React frontend with additional configuration options
-CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
+# Enable CORS for our React frontend with additional configuration options.
+# Credentials (the session cookie) only for CORS_ORIGINS, see add_cors_credentials()
+CORS(app, resources={r"/api/*": {"origins": "*"}})
 app.secret_key = os.urandom(24)
 
-# Ensure session history is initialized
-HISTORY = []
-
-# Get API key from environment variable or use the hardcoded one
-DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY') or "sk-ccfc35d1bf204ca88c2ad5f3e576f6c7"
-
-# Cache for storing responses
-response_cache = {}
-
-# Cache for common medical questions
-@lru_cache(maxsize=50)
-def cached_answer(question):
-    """Cache answers to common medical questions"""
-    return generate_direct_answer(question)
+# Warm up before serving: TLS context and answer cache now (in the gunicorn master when
+# preloaded), upstream keep-alive connections (DEEPSEEK_PREWARM_CONNECTIONS) per worker
+startup.begin(response_cache, worker_steps=[('upstream', deepseek_client.prewarm)]
+              if deepseek_client.PREWARM_CONNECTIONS > 0 else ())
+
+def request_session():
+    """This request's history session; a new one is sent back as a cookie by set_session_cookie()."""
+    session, new = history_session(request.cookies)
+    if new:
+        g.new_session = session
+    return session
+
+@app.after_request
+def set_session_cookie(response):
+    session = g.pop('new_session', None)
+    if session is not None:
+        response.headers.add('Set-Cookie', session_cookie(session))
+    return response
+
+@app.after_request
+def add_cors_credentials(response):
+    """Let allowlisted origins send credentials; Flask-CORS mirrors the origin for everyone else without them."""
+    if request.path.startswith('/api/') and allows_credentials(request.headers.get('Origin')):
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+    return response
 
 @app.route('/')
 def index():
     """Root endpoint - returns API information"""
-    return jsonify({
-        'name': 'AskMedicine API',
-        'version': '1.0',
-        'status': 'running',
-        'endpoints': {
-            '/api/query': 'POST - Submit a medical query',
-            '/api/health': 'GET - Check API health',
-            '/api/history': 'GET - Get query history, DELETE - Clear history'
-        }
-    })
+    return jsonify(API_INFO)
 
 @app.route('/api/query', methods=['POST'])
 def query():
@@ -56,83 +67,62 @@ def query():
         if not query_text:
             return jsonify({'error': 'No query provided'}), 400
 
-        # Check cache first
-        if query_text in response_cache:
-            return jsonify(response_cache[query_text])
-
-        # Prepare the request to DeepSeek API
-        headers = {
-            'Authorization': f'Bearer {DEEPSEEK_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-
-        # Print API key for debugging (first 5 chars only for security)
-        api_key_prefix = DEEPSEEK_API_KEY[:5] if DEEPSEEK_API_KEY else "None"
-        print(f"Using DeepSeek API key prefix: {api_key_prefix}...")
-
-        payload = {
-            'messages': [
-                {
-                    'role': 'system',
-                    'content': 'You are a helpful medical research assistant. Provide evidence-based answers with citations from medical literature.'
-                },
-                {
-                    'role': 'user',
-                    'content': query_text
-                }
-            ],
-            'stream': True
-        }
-
-        # Make request to DeepSeek API
-        try:
-            response = requests.post(
-                'https://api.deepseek.com/v1/chat/completions',
-                headers=headers,
-                json=payload,
-                stream=True
-            )
-            
-            print(f"DeepSeek API response status: {response.status_code}")
-            
-            if response.status_code != 200:
-                error_content = response.text
-                print(f"DeepSeek API error response: {error_content}")
-                return jsonify({'error': f'Failed to get response from DeepSeek API: {error_content}'}), 500
-                
-        except Exception as api_error:
-            print(f"Error making request to DeepSeek API: {api_error}")
-            return jsonify({'error': f'Error connecting to DeepSeek API: {str(api_error)}'}), 500
-
-        def generate():
-            full_response = ""
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        line = line.decode('utf-8')
-                        if line.startswith('data: '):
-                            line = line[6:]
-                            if line.strip() == '[DONE]':
-                                break
-                            data = json.loads(line)
-                            if 'choices' in data and len(data['choices']) > 0:
-                                content = data['choices'][0].get('delta', {}).get('content', '')
-                                if content:
-                                    full_response += content
-                                    yield f"data: {json.dumps({'content': content})}\n\n"
-                    except Exception as e:
-                        print(f"Error processing line: {e}")
-                        continue
-
-            # Cache the complete response
-            response_cache[query_text] = {'content': full_response}
-
-        return Response(stream_with_context(generate()), mimetype='text/event-stream')
-
+        rate_limiter.check(client_key(request.headers, request.remote_addr))
+
+        # Compact text frames with ?format=text; compression per Accept-Encoding (SSE_COMPRESSION=1)
+        frame_format = request.args.get('format')
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        # ?structure=1 adds named events for sections, table rows, references and related questions
+        structure = wants_structure(request.args.get('structure'))
+
+        session = request_session()
+
+        # Check cache first; hits replay the stored SSE frames as-is
+        cached = lookup_cached(query_text)
+        if cached is not None:
+            history.add(session, query_text, cached['content'], cached=True)
+            if wants_json(request.headers.get('Accept')):
+                if structure:
+                    return jsonify({'content': cached['content'], 'structure': cached_structure(cached)})
+                return jsonify({'content': cached['content']})
+            body = replay_frames(cached, request.args.get('replay'), frame_format, structure)
+            if encoding:
+                body = list(compress_chunks(body, encoding))
+            return Response(body, mimetype='text/event-stream', headers={**stream_headers(encoding), 'X-Cache': 'HIT'})
+
+        # Join the in-flight generation for this question, or start one. Late
+        # joiners replay the frames produced so far, then follow the live stream.
+        flight = start_or_join(query_text)
+        error = flight.wait_started()
+        if error is not None:
+            status, headers = upstream_error_status(error)
+            return jsonify({'error': str(error)}), status, headers
+
+        # Recorded in the history once the whole answer has been sent
+        frames = recorded(flight.subscribe(), lambda: record_flight(session, query_text, flight))
+        return Response(stream_with_context(sse_body(frames, frame_format, encoding, structure)),
+                        mimetype='text/event-stream', headers=stream_headers(encoding))
+
+    except Rejected as e:
+        # Shed load fast instead of letting the client wait out upstream timeouts
+        return jsonify(rejection_body(e)), 429, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         print(f"Error in query endpoint: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """Answer a list of questions; one NDJSON line per question, in completion order"""
+    try:
+        questions, concurrency = parse_batch(request.get_json(silent=True))
+        rate_limiter.check(client_key(request.headers, request.remote_addr))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Rejected as e:
+        return jsonify(rejection_body(e)), 429, {'Retry-After': str(e.retry_after)}
+
+    return Response(stream_with_context(run_batch(questions, concurrency)), mimetype='application/x-ndjson')
+
 @app.route('/api/query-alt', methods=['POST'])
 def query_alternative():
     """Alternative query endpoint using a simplified mock response"""
@@ -145,24 +135,14 @@ def query_alternative():
 
         # For testing purposes, return a mock response
         def generate_mock():
-            responses = [
-                "Analyzing your medical query...\n\n",
-                "Based on medical literature, ",
-                "I can provide the following information about your question:\n\n",
-                f"You asked: {query_text}\n\n",
-                "This is a test response from AskMedicine's alternative endpoint. ",
-                "The main endpoint is currently being updated. ",
-                "Please check back shortly for full functionality with DeepSeek API integration."
-            ]
-            
             full_response = ""
-            for chunk in responses:
+            for chunk in mock_answer_chunks(query_text):
                 full_response += chunk
-                yield f"data: {json.dumps({'content': chunk})}\n\n"
+                yield encode_frame(chunk)
                 time.sleep(0.5)  # Simulate streaming delay
                 
             # Cache the complete response
-            response_cache[query_text] = {'content': full_response}
+            response_cache.set(query_text, {'content': full_response})
                 
         return Response(stream_with_context(generate_mock()), mimetype='text/event-stream')
         
@@ -173,28 +153,47 @@ def query_alternative():
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'ok',
-        'message': 'AskMedicine API is running',
-        'features': [
-            'Evidence-based medical answers',
-            'Streaming responses',
-            'Response caching',
-            'Tabular comparison for treatment options',
-            'Follow-up question generation'
-        ]
-    })
+    return jsonify({**HEALTH_INFO, 'upstream': deepseek_client.upstream_stats()})
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 503 until this worker has finished warming up"""
+    status = startup.status()
+    if status['status'] != 'ready':
+        return jsonify(status), 503, {'Retry-After': '1'}
+    return jsonify(status)
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Answer cache counters, used to size ANSWER_CACHE_MAX_BYTES"""
+    return jsonify(response_cache.stats())
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus metrics, aggregated across all gunicorn workers"""
+    return Response(metrics.render_prometheus(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/admission/stats', methods=['GET'])
+def admission_stats():
+    """Upstream admission slots and wait queue for this worker"""
+    return jsonify(admission.stats())
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """Get question history"""
-    return jsonify({'history': HISTORY})
+    """Get this session's question history, newest first; ?cursor= pages, ?q= searches"""
+    try:
+        entries, next_cursor = history.page(request_session(),
+                                            cursor=request.args.get('cursor'),
+                                            limit=request.args.get('limit', HISTORY_PAGE_SIZE),
+                                            search=request.args.get('q'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
+    return jsonify({'history': entries, 'next_cursor': next_cursor})
 
 @app.route('/api/history', methods=['DELETE'])
 def clear_history():
-    """Clear question history"""
-    global HISTORY
-    HISTORY = []
+    """Clear this session's question history"""
+    history.clear(request_session())
     return jsonify({'message': 'History cleared'})
 
 @app.route('/favicon.ico')
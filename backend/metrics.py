@@ -0,0 +1,233 @@
+import mmap
+import os
+import threading
+import zlib
+from bisect import bisect_left
+
+# Prometheus-style metrics that aggregate across gunicorn workers.
+#
+# Every metric owns a fixed range of float64 slots. Each process writes only its
+# own slots: an anonymous buffer by default, or a memory-mapped file
+# METRICS_DIR/metrics_<pid>.db when METRICS_DIR is set (gunicorn.conf.py sets it),
+# so updates on the hot path are a lock plus an in-place add, with no I/O or
+# allocation. /api/metrics sums the files of all workers; gauges of workers that
+# have exited are skipped, counters and histograms are kept.
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+PREFIX = "askmedicine_"
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = []
+_slot_count = 1  # slot 0 holds the layout checksum
+_values = None
+_values_pid = None
+_lock = threading.Lock()
+
+
+def _register(metric, slots):
+    global _slot_count
+    if _values is not None:
+        raise RuntimeError("metrics must be defined before the first update")
+    metric.offset = _slot_count
+    _slot_count += slots
+    _metrics.append(metric)
+
+
+def _layout_checksum():
+    layout = ";".join(f"{m.name}:{m.kind}:{m.offset}" for m in _metrics)
+    return float(zlib.crc32(layout.encode("utf-8")))
+
+
+def _buffer():
+    """Return this process's slot array, creating it on first use (and again after a fork)."""
+    global _values, _values_pid
+    pid = os.getpid()
+    if _values is not None and _values_pid == pid:
+        return _values
+    size = _slot_count * 8
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"metrics_{pid}.db")
+        with open(path, "wb+") as f:
+            f.truncate(size)
+            backing = mmap.mmap(f.fileno(), size)
+    else:
+        backing = bytearray(size)
+    values = memoryview(backing).cast("d")
+    values[0] = _layout_checksum()
+    _values, _values_pid = values, pid
+    return values
+
+
+def _reset_after_fork():
+    global _values, _values_pid, _lock
+    _values = None
+    _values_pid = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by a fixed set of label values."""
+    kind = "counter"
+
+    def __init__(self, name, documentation, label=None, label_values=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.label = label
+        self.label_values = tuple(label_values) or (None,)
+        _register(self, len(self.label_values))
+
+    def inc(self, amount=1.0, label_value=None):
+        index = self.offset if label_value is None else self.offset + self.label_values.index(label_value)
+        with _lock:
+            _buffer()[index] += amount
+
+    def samples(self, values):
+        for i, label_value in enumerate(self.label_values):
+            labels = f'{{{self.label}="{label_value}"}}' if label_value is not None else ""
+            yield f"{self.name}{labels}", values[self.offset + i]
+
+
+class Gauge:
+    """Current value (e.g. streams in flight); summed over live workers only."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        _register(self, 1)
+
+    def inc(self, amount=1.0):
+        with _lock:
+            _buffer()[self.offset] += amount
+
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def set(self, value):
+        with _lock:
+            _buffer()[self.offset] = value
+
+    def samples(self, values):
+        yield self.name, values[self.offset]
+
+
+class Histogram:
+    """Distribution of observations in fixed buckets, plus their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=_DEFAULT_BUCKETS):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # One slot per bucket, one for +Inf, then sum and count
+        _register(self, len(self.buckets) + 3)
+
+    def observe(self, value):
+        base = self.offset
+        bucket = bisect_left(self.buckets, value)
+        with _lock:
+            values = _buffer()
+            values[base + bucket] += 1
+            values[base + len(self.buckets) + 1] += value
+            values[base + len(self.buckets) + 2] += 1
+
+    def samples(self, values):
+        cumulative = 0.0
+        for i, bound in enumerate(self.buckets + (float("inf"),)):
+            cumulative += values[self.offset + i]
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            yield f'{self.name}_bucket{{le="{le}"}}', cumulative
+        yield f"{self.name}_sum", values[self.offset + len(self.buckets) + 1]
+        yield f"{self.name}_count", values[self.offset + len(self.buckets) + 2]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _collect():
+    """Sum slot arrays across worker files. Returns (totals, live_totals) where gauges use live_totals."""
+    size = _slot_count
+    totals = [0.0] * size
+    live = [0.0] * size
+    if not METRICS_DIR:
+        values = _buffer()
+        return list(values), list(values)
+    _buffer()  # make sure this worker's file exists
+    checksum = _layout_checksum()
+    for entry in os.listdir(METRICS_DIR):
+        if not (entry.startswith("metrics_") and entry.endswith(".db")):
+            continue
+        path = os.path.join(METRICS_DIR, entry)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            continue
+        if len(data) != size * 8:
+            continue
+        values = memoryview(data).cast("d")
+        if values[0] != checksum:
+            continue
+        alive = _pid_alive(int(entry[len("metrics_"):-len(".db")]))
+        for i in range(1, size):
+            totals[i] += values[i]
+            if alive:
+                live[i] += values[i]
+    return totals, live
+
+
+def render_prometheus():
+    """Render all metrics, aggregated over workers, in the Prometheus text exposition format."""
+    totals, live = _collect()
+    lines = []
+    for metric in _metrics:
+        values = live if metric.kind == "gauge" else totals
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for sample, value in metric.samples(values):
+            lines.append(f"{sample} {value:.17g}" if value != int(value) else f"{sample} {int(value)}")
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Metric definitions. All metrics live here so every worker gets the same slot layout.
+UPSTREAM_TTFB = Histogram("upstream_ttfb_seconds", "Time from sending the DeepSeek request to its response headers")
+GENERATION_SECONDS = Histogram("generation_seconds", "Total time to stream one upstream answer")
+ANSWER_CHUNKS = Histogram("answer_chunks", "Upstream content chunks per answer",
+                          buckets=(10, 50, 100, 250, 500, 1000, 2000, 4000))
+STREAMED_BYTES = Histogram("streamed_bytes", "SSE bytes produced per answer",
+                           buckets=(1024, 4096, 16384, 65536, 262144, 1048576))
+CACHE_LOOKUP_SECONDS = Histogram("cache_lookup_seconds", "Answer cache lookup time",
+                                 buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+INFLIGHT_STREAMS = Gauge("inflight_streams", "Upstream answer streams currently open")
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Answer cache lookups by result", "result", ("hit", "similar", "miss"))
+UPSTREAM_ERRORS = Counter("upstream_errors_total", "Failed DeepSeek requests (connection errors and non-200 responses)")
+UPSTREAM_TIMEOUTS = Counter("upstream_timeouts_total", "DeepSeek requests that timed out")
+PREFETCHES = Counter("prefetches_total", "Related follow-up prefetches by outcome", "result",
+                     ("generated", "cached", "dropped", "failed"))
+ADMISSION_INFLIGHT = Gauge("admission_inflight", "Upstream generations holding an admission slot")
+ADMISSION_QUEUED = Gauge("admission_queued", "Requests waiting for an admission slot")
+ADMISSION_REJECTIONS = Counter("admission_rejections_total", "Requests answered with 429 by reason", "reason",
+                               ("rate_limited", "queue_full", "queue_timeout"))
+ADMISSION_WAIT_SECONDS = Histogram("admission_wait_seconds", "Time queued requests waited for a slot")
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "DeepSeek requests retried before the first byte")
+UPSTREAM_HEDGES = Counter("upstream_hedges_total", "Hedged DeepSeek requests by which request answered first", "winner",
+                          ("primary", "hedge"))
+CIRCUIT_OPEN = Gauge("circuit_open", "Workers whose DeepSeek circuit breaker is open or half-open")
+CIRCUIT_REJECTIONS = Counter("circuit_rejections_total", "DeepSeek calls failed fast by an open circuit")
+PROMPT_PROFILES = Counter("prompt_profiles_total", "DeepSeek requests by prompt profile", "profile",
+                          ("brief", "standard", "comparison"))
+STREAM_ABORTS = Counter("stream_aborts_total", "Upstream streams closed early because every client disconnected")
@@ -0,0 +1,134 @@
+import itertools
+import os
+import queue
+import threading
+import time
+
+import metrics
+from answer_structure import BULLET_RE, RELATED_HEADING_RE
+
+# Speculative generation of the follow-up questions listed under "Related:" at
+# the end of an answer, so the one-click follow-up is usually a cache hit.
+PREFETCH_ENABLED = os.getenv("PREFETCH_RELATED", "0").lower() in ("1", "true", "yes")
+# Background generations running at once per worker
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+# Prefetch only starts while fewer live (user) streams than this are open in the worker
+PREFETCH_MAX_LIVE_STREAMS = int(os.getenv("PREFETCH_MAX_LIVE_STREAMS", "4"))
+PREFETCH_QUEUE_SIZE = int(os.getenv("PREFETCH_QUEUE_SIZE", "64"))
+# Queued questions older than this are dropped rather than generated late
+PREFETCH_MAX_AGE = float(os.getenv("PREFETCH_MAX_AGE", "120"))
+
+
+def parse_related(answer):
+    """Return the follow-up questions from the trailing "Related:" block of an answer."""
+    lines = answer.splitlines()
+    for i in range(len(lines) - 1, -1, -1):
+        if RELATED_HEADING_RE.match(lines[i].strip()):
+            questions = []
+            for line in lines[i + 1:]:
+                match = BULLET_RE.match(line)
+                if match:
+                    questions.append(match.group(1).strip("*_ "))
+                elif line.strip():
+                    break
+            return questions
+    return []
+
+
+class Prefetcher:
+    """Background workers that generate answers for predicted follow-up questions.
+
+    `generate(question)` must block until the answer is cached, returning False if
+    it declined to run (e.g. no upstream capacity); `is_cached(question)`
+    and `live_streams()` let a worker skip questions that are already answered and
+    hold back while user traffic is busy. Worker threads start on first submit so
+    each forked gunicorn worker gets its own.
+    """
+
+    def __init__(self, generate, is_cached, live_streams, concurrency=PREFETCH_CONCURRENCY,
+                 max_live_streams=PREFETCH_MAX_LIVE_STREAMS, queue_size=PREFETCH_QUEUE_SIZE,
+                 enabled=PREFETCH_ENABLED):
+        self.generate = generate
+        self.is_cached = is_cached
+        self.live_streams = live_streams
+        self.concurrency = concurrency
+        self.max_live_streams = max_live_streams
+        self.enabled = enabled and concurrency > 0
+        self.active = 0
+        self._queue = queue.PriorityQueue(maxsize=queue_size)
+        self._queued = set()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._threads_pid = None
+
+    def _ensure_workers(self):
+        pid = os.getpid()
+        if self._threads_pid == pid:
+            return
+        with self._lock:
+            if self._threads_pid == pid:
+                return
+            for i in range(self.concurrency):
+                threading.Thread(target=self._work, daemon=True, name=f'prefetch-{i}').start()
+            self._threads_pid = pid
+
+    def submit_from_answer(self, answer):
+        """Queue the Related questions of a finished answer, first listed first."""
+        if not self.enabled:
+            return 0
+        queued = 0
+        for rank, question in enumerate(parse_related(answer)):
+            if self.submit(question, priority=rank):
+                queued += 1
+        return queued
+
+    def submit(self, question, priority=0):
+        if not self.enabled:
+            return False
+        with self._lock:
+            if question in self._queued:
+                return False
+            self._queued.add(question)
+        try:
+            self._queue.put_nowait((priority, next(self._sequence), time.monotonic(), question))
+        except queue.Full:
+            with self._lock:
+                self._queued.discard(question)
+            metrics.PREFETCHES.inc(label_value='dropped')
+            return False
+        self._ensure_workers()
+        return True
+
+    def _work(self):
+        while True:
+            _, _, queued_at, question = self._queue.get()
+            try:
+                self._run(question, queued_at)
+            except Exception as e:
+                metrics.PREFETCHES.inc(label_value='failed')
+                print(f"Prefetch of '{question[:50]}' failed: {e}")
+            finally:
+                with self._lock:
+                    self._queued.discard(question)
+
+    def _run(self, question, queued_at):
+        # Live traffic has priority: wait until the worker is quiet enough
+        while self.live_streams() - self.active >= self.max_live_streams:
+            if time.monotonic() - queued_at > PREFETCH_MAX_AGE:
+                metrics.PREFETCHES.inc(label_value='dropped')
+                return
+            time.sleep(0.25)
+        if self.is_cached(question):
+            metrics.PREFETCHES.inc(label_value='cached')
+            return
+        with self._lock:
+            self.active += 1
+        try:
+            generated = self.generate(question)
+            metrics.PREFETCHES.inc(label_value='generated' if generated else 'dropped')
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def stats(self):
+        return {'enabled': self.enabled, 'queued': self._queue.qsize(), 'active': self.active}
@@ -0,0 +1,146 @@
+import json
+import os
+import re
+
+import metrics
+
+# Prompt profiles: every DeepSeek request uses one of these. Each profile's
+# constant part (model, sampling settings, system prompt) is serialized once at
+# import, so building a request body is a few byte concatenations around the
+# JSON-encoded question. All profiles start with the same system prompt text,
+# which keeps the prompt prefix stable for DeepSeek's context caching.
+DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+# Route questions to profiles by shape; 0 sends every question to "standard"
+PROMPT_ROUTING = os.getenv("PROMPT_ROUTING", "1").lower() in ("1", "true", "yes")
+PROMPT_BRIEF_MAX_TOKENS = int(os.getenv("PROMPT_BRIEF_MAX_TOKENS", "700"))
+PROMPT_STANDARD_MAX_TOKENS = int(os.getenv("PROMPT_STANDARD_MAX_TOKENS", "2000"))
+PROMPT_COMPARISON_MAX_TOKENS = int(os.getenv("PROMPT_COMPARISON_MAX_TOKENS", "2500"))
+
+SYSTEM_PROMPT = """You are AskMedicine, a specialized medical research assistant that provides evidence-based answers to medical questions.
+
+Your goal is to:
+1. Provide accurate, up-to-date medical information based on the latest research
+2. Explain medical concepts clearly and comprehensively
+3. Be honest about limitations in medical knowledge where appropriate
+4. Cite specific research when possible
+5. Explain the strength of evidence behind medical claims
+
+Follow these specific formatting guidelines:
+1. Always use proper Markdown formatting:
+   - Make **headings bold** using the syntax "**Heading:**"
+   - Format *subheadings in italics* using "*Subheading:*"
+   - **Bold important medical terms, statistics, and key findings**
+   - ***Bold and italicize clinical trial names and guideline recommendations***
+   - Properly format tables with headers for comparisons
+
+2. When citing research:
+   - Include author names and year: "Smith J, et al. (2023)"
+   - Keep citation style consistent throughout
+   - DO NOT include PubMed IDs or hyperlinks
+
+3. For step-by-step procedures, guidelines, or recommendations:
+   - Present them as numbered or bulleted lists with proper indentation
+   - Maintain clear headings for different sections
+   - Use line breaks between sections for clarity
+   - Ensure proper spacing after bullet point markers (-, *, •)
+
+4. When comparing treatments, drugs, or approaches:
+   - Use properly formatted markdown tables with clear headers for direct comparisons
+   - Include column headers that clearly indicate what is being compared
+   - Use consistent metrics across rows to facilitate comparison
+   - Highlight significant differences with bold text
+   - Always include a brief textual summary of the key differences before or after the table
+
+5. References should be included at the end in this format: "Author Name, et al. (YEAR). Title of paper."
+
+6. End each answer with "Related" followed by 3-4 specific follow-up questions that would be logical next questions. Use bullet points instead of numbers for these questions.
+
+Format example for Related questions:
+Related:
+- Question one?
+- Question two?
+- Question three?"""
+
+BRIEF_INSTRUCTIONS = """
+
+This is a short factual question. Answer it directly in one or two short paragraphs under a single **Answer:** heading, citing at most two sources, with no tables. Keep the References and Related sections."""
+
+COMPARISON_INSTRUCTIONS = """
+
+This question compares several options. Lead with a comparison table covering efficacy, safety and key trial evidence for each option, then discuss the differences in detail."""
+
+
+class PromptProfile:
+    """One system prompt with its sampling settings, serialized ahead of time."""
+
+    def __init__(self, name, system_prompt, max_tokens, temperature=0.3):
+        self.name = name
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        # Everything up to the user's question, for streaming and non-streaming requests
+        self._heads = {stream: self._head(stream) for stream in (True, False)}
+
+    def _head(self, stream):
+        constant = json.dumps({
+            'model': DEEPSEEK_MODEL,
+            'temperature': self.temperature,
+            'max_tokens': self.max_tokens,
+            'stream': stream,
+        })
+        system = json.dumps({'role': 'system', 'content': self.system_prompt})
+        return (constant[:-1] + ', "messages": [' + system + ', {"role": "user", "content": ').encode('utf-8')
+
+    def payload(self, question, stream=True, prefix=None):
+        """Return the JSON request body (bytes) asking this profile to answer `question`.
+
+        With `prefix`, the answer continues from that partial assistant text
+        (chat prefix completion).
+        """
+        body = self._heads[stream] + json.dumps(question).encode('utf-8')
+        if prefix:
+            body += b'}, {"role": "assistant", "content": ' + json.dumps(prefix).encode('utf-8') + b', "prefix": true'
+        return body + b'}]}'
+
+
+PROFILES = {
+    'brief': PromptProfile('brief', SYSTEM_PROMPT + BRIEF_INSTRUCTIONS, PROMPT_BRIEF_MAX_TOKENS),
+    'standard': PromptProfile('standard', SYSTEM_PROMPT, PROMPT_STANDARD_MAX_TOKENS),
+    'comparison': PromptProfile('comparison', SYSTEM_PROMPT + COMPARISON_INSTRUCTIONS, PROMPT_COMPARISON_MAX_TOKENS),
+}
+
+_COMPARISON_RE = re.compile(
+    r"\b(?:vs\.?|versus|compare[ds]?|comparing|comparison|differences?\s+between|better\s+than|"
+    r"pros\s+and\s+cons|which\s+is\s+(?:better|safer|more))\b",
+    re.IGNORECASE)
+_FACTUAL_RE = re.compile(
+    r"^(?:what\s+is|what's|what\s+are|define|definition\s+of|who|when|where|which|"
+    r"how\s+(?:much|many|long|often)|is|are|does|do|normal|usual|typical|dose|dosage)\b",
+    re.IGNORECASE)
+# Wording that asks for an explanation or the evidence even in a short question
+_EXPLANATORY_RE = re.compile(
+    r"\b(?:why|explain|tell\s+me|relationship|mechanisms?|evidence|trials?|studies|research|advances|"
+    r"management|overview|guidelines?)\b",
+    re.IGNORECASE)
+# Word counts separating short factual questions and long multi-part ones
+BRIEF_MAX_WORDS = 12
+LONG_MIN_WORDS = 40
+
+
+def classify(question):
+    """Pick a profile name for `question` from its wording and length (no model call)."""
+    if not PROMPT_ROUTING:
+        return 'standard'
+    words = len(question.split())
+    if _COMPARISON_RE.search(question) or words >= LONG_MIN_WORDS:
+        return 'comparison'
+    if words <= BRIEF_MAX_WORDS and _FACTUAL_RE.match(question.strip()) and not _EXPLANATORY_RE.search(question):
+        return 'brief'
+    return 'standard'
+
+
+def build_payload(question, stream=True, prefix=None):
+    """Return the upstream request body for `question`, using the profile chosen by classify()."""
+    profile = PROFILES[classify(question)]
+    metrics.PROMPT_PROFILES.inc(label_value=profile.name)
+    return profile.payload(question, stream=stream, prefix=prefix)
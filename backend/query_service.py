@@ -0,0 +1,640 @@
+import os
+import json
+import re
+from http.cookies import SimpleCookie
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from dotenv import load_dotenv
+import deepseek_client
+import prompts
+from answer_cache import AnswerCache, normalize_query
+from answer_structure import AnswerStructure, encode_event, is_event_frame, parse_structure
+from disk_cache import DiskCache, ANSWER_CACHE_PATH
+from similarity_index import SIMILAR_CACHE, SimilarityIndex
+from singleflight import SingleFlight
+from prefetch import Prefetcher
+from admission import AdmissionController, RateLimiter, Rejected
+from history_store import HistoryStore
+from resilience import CircuitOpenError
+from sse_parser import SSEParser, ChunkCoalescer, iter_content, iter_raw_chunks
+from sse_compression import compress_chunks
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Query handling shared by the Flask app (medinquire_web) and the asyncio server (medinquire_async)
+
+# Get API key from environment variable or use the hardcoded one
+DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY') or "sk-ccfc35d1bf204ca88c2ad5f3e576f6c7"
+
+# Per-session question history (in-memory rings plus a shared SQLite store with search)
+history = HistoryStore()
+
+# Sessions are random ids the server issues in an HttpOnly cookie; nothing the
+# client sends in a header can select another session's history. Behind HTTPS
+# only (HISTORY_COOKIE_SECURE).
+HISTORY_COOKIE = "medinquire_session"
+HISTORY_COOKIE_SECURE = os.getenv("HISTORY_COOKIE_SECURE", "1").lower() in ("1", "true", "yes")
+HISTORY_COOKIE_SAMESITE = os.getenv("HISTORY_COOKIE_SAMESITE", "Lax")
+HISTORY_COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Any origin may call /api/*, but only the CORS_ORIGINS (comma-separated, e.g.
+# "https://app.example.com") may do so with credentials, i.e. with the session
+# cookie. Only those frontends can read or clear a visitor's history.
+# SameSite=None, which lets a frontend on another site send the cookie, is
+# honoured only when such an allowlist is configured.
+CORS_ORIGINS = frozenset(origin.strip().rstrip('/') for origin in os.getenv("CORS_ORIGINS", "").split(',')
+                         if origin.strip())
+if HISTORY_COOKIE_SAMESITE.lower() == 'none' and not CORS_ORIGINS:
+    print("HISTORY_COOKIE_SAMESITE=None needs a CORS_ORIGINS allowlist; using Lax")
+    HISTORY_COOKIE_SAMESITE = "Lax"
+_SESSION_ID_RE = re.compile(r"[A-Za-z0-9_-]{32}")
+
+# Cache for storing responses, keyed by normalized question and bounded by
+# ANSWER_CACHE_MAX_BYTES / ANSWER_CACHE_TTL. Backed by a SQLite file shared by
+# all workers on the host unless ANSWER_CACHE_PATH is set to an empty string.
+# Paraphrase lookup over the questions in this worker's memory tier (SIMILAR_CACHE=1)
+similar_questions = SimilarityIndex() if SIMILAR_CACHE else None
+
+response_cache = AnswerCache(backend=DiskCache(ANSWER_CACHE_PATH) if ANSWER_CACHE_PATH else None,
+                             index=similar_questions)
+
+# How cache hits are replayed on the SSE path: "flush" writes the stored stream in
+# one go, "chunks" writes it frame by frame. Clients may pick with ?replay=.
+CACHE_REPLAY = os.getenv("CACHE_REPLAY", "flush")
+
+# Concurrent identical questions share one upstream stream
+inflight = SingleFlight()
+
+# Text of answers whose clients all disconnected mid-stream. With PARTIAL_RESUME=1
+# asking the same question again replays it at once and has DeepSeek continue from
+# there (chat prefix completion) instead of starting over. Shared by the workers
+# through a small SQLite file next to the answer cache.
+PARTIAL_RESUME = os.getenv("PARTIAL_RESUME", "0").lower() in ("1", "true", "yes")
+PARTIAL_ANSWER_TTL = float(os.getenv("PARTIAL_ANSWER_TTL", "600"))
+PARTIAL_ANSWER_MAX_BYTES = 8 * 1024 * 1024
+partial_answers = AnswerCache(
+    max_bytes=PARTIAL_ANSWER_MAX_BYTES, default_ttl=PARTIAL_ANSWER_TTL,
+    backend=DiskCache(os.path.splitext(ANSWER_CACHE_PATH)[0] + '_partial.sqlite3', PARTIAL_ANSWER_MAX_BYTES)
+    if PARTIAL_RESUME and ANSWER_CACHE_PATH else None
+)
+
+# Caps concurrent upstream generations and queues/sheds the excess with 429s
+admission = AdmissionController()
+# Per-client (API token or IP) token buckets on /api/query
+rate_limiter = RateLimiter()
+
+# /api/batch: questions per request, and answers generated at once per batch
+# (generations still go through admission control like /api/query)
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+API_INFO = {
+    'name': 'AskMedicine API',
+    'version': '1.0',
+    'status': 'running',
+    'endpoints': {
+        '/api/query': 'POST - Submit a medical query',
+        '/api/batch': 'POST - Answer a list of questions, streamed back as NDJSON',
+        '/api/health': 'GET - Check API health',
+        '/api/ready': 'GET - 200 once this worker has warmed up, 503 while it is starting',
+        '/api/history': 'GET - Get query history (?cursor=, ?limit=, ?q= to search), DELETE - Clear history',
+        '/api/cache/stats': 'GET - Answer cache hit/miss/eviction counters',
+        '/api/metrics': 'GET - Prometheus metrics',
+        '/api/admission/stats': 'GET - Upstream admission slots and wait queue'
+    }
+}
+
+HEALTH_INFO = {
+    'status': 'ok',
+    'message': 'AskMedicine API is running',
+    'features': [
+        'Evidence-based medical answers',
+        'Streaming responses',
+        'Response caching',
+        'Tabular comparison for treatment options',
+        'Follow-up question generation'
+    ]
+}
+
+
+class UpstreamError(Exception):
+    """Raised when the DeepSeek stream for a query cannot be opened.
+
+    `retry_after` is set when the upstream circuit is open and the call failed fast.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def upstream_headers():
+    return {
+        'Authorization': f'Bearer {DEEPSEEK_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+
+
+def build_payload(query_text, prefix=None):
+    """Build the streaming chat completion request body (bytes) for a web query.
+
+    The prompt profile follows the question (prompts.classify). With `prefix`, the
+    answer continues from that partial assistant text (send it to
+    DEEPSEEK_PREFIX_API_URL).
+    """
+    return prompts.build_payload(query_text, stream=True, prefix=prefix)
+
+
+def encode_frame(content):
+    """Encode one content delta as an SSE event (ASCII: json.dumps escapes the rest)."""
+    return f"data: {json.dumps({'content': content})}\n\n"
+
+
+def encode_text_frame(content):
+    """Encode a content delta as a compact SSE event (?format=text).
+
+    The text goes out as-is in `data:` lines with no JSON wrapper; per the SSE spec
+    the client joins the lines of one event with "\\n".
+    """
+    return 'data: ' + content.replace('\r\n', '\n').replace('\r', '\n').replace('\n', '\ndata: ') + '\n\n'
+
+
+def text_frames(frames):
+    """Re-encode a stream of JSON SSE frames (str or bytes) as compact text frames."""
+    try:
+        for frame in frames:
+            if is_event_frame(frame):
+                yield frame
+            else:
+                yield encode_text_frame(json.loads(frame[6:])['content'])
+    finally:
+        close = getattr(frames, 'close', None)
+        if close is not None:
+            close()
+
+
+def content_frames(frames):
+    """Drop the structural events from a flight's frames, for clients that did not ask for them."""
+    try:
+        for frame in frames:
+            if not is_event_frame(frame):
+                yield frame
+    finally:
+        close = getattr(frames, 'close', None)
+        if close is not None:
+            close()
+
+
+def cache_entry(answer, frames, structure=None):
+    """Build the cached value for an answer: its text plus the SSE frames it was streamed as.
+
+    The frames are stored pre-encoded as one bytes buffer with the end offset of each
+    frame, so a cache hit is replayed without any per-chunk json.dumps. The parsed
+    structure (answer_structure events) is stored alongside; pass the events of
+    the live parse to avoid parsing the answer again.
+    """
+    offsets = []
+    end = 0
+    for frame in frames:
+        end += len(frame)
+        offsets.append(end)
+    if structure is None:
+        structure = parse_structure(answer)
+    return {'content': answer, 'sse': ''.join(frames).encode('ascii'), 'offsets': offsets,
+            'structure': structure}
+
+
+def cached_structure(cached):
+    """The structural events of a cached answer (parsed now for entries stored without them)."""
+    structure = cached.get('structure')
+    return structure if structure is not None else parse_structure(cached.get('content', ''))
+
+
+def replay_frames(cached, mode=None, frame_format=None, structure=False):
+    """Return the SSE body of a cached answer as a list of bytes chunks.
+
+    "flush" returns the stored buffer itself as a single chunk (no copy); "chunks"
+    returns one chunk per original frame, keeping the live stream's boundaries.
+    With frame_format="text" the answer is sent as compact text frames. With
+    `structure`, the answer's structural events follow the content in one more chunk.
+    """
+    chunks = _replay_content(cached, mode, frame_format)
+    if structure:
+        chunks.append(''.join(encode_event(event) for event in cached_structure(cached)).encode('ascii'))
+    return chunks
+
+
+def _replay_content(cached, mode, frame_format):
+    sse = cached.get('sse')
+    flush = (mode or CACHE_REPLAY) != 'chunks'
+    if frame_format == 'text' and (flush or sse is None):
+        return [encode_text_frame(cached.get('content', '')).encode('utf-8')]
+    if sse is None:
+        # Entry cached before frames were stored
+        return [encode_frame(cached.get('content', '')).encode('ascii')]
+    if flush:
+        return [sse]
+    chunks = []
+    start = 0
+    for end in cached['offsets']:
+        chunks.append(sse[start:end])
+        start = end
+    if frame_format == 'text':
+        return [frame.encode('utf-8') for frame in text_frames(chunks)]
+    return chunks
+
+
+def sse_body(frames, frame_format=None, encoding=None, structure=False):
+    """Apply the requested frame format, structural events and content encoding to SSE frames."""
+    if not structure:
+        frames = content_frames(frames)
+    if frame_format == 'text':
+        frames = text_frames(frames)
+    if encoding:
+        frames = compress_chunks(frames, encoding)
+    return frames
+
+
+def wants_structure(value):
+    """True if the client asked for structural events (?structure=1)."""
+    return (value or '').lower() in ('1', 'true', 'yes')
+
+
+def wants_json(accept):
+    """True if the client asked for a JSON body rather than an event stream."""
+    accept = accept or ''
+    return 'application/json' in accept and 'text/event-stream' not in accept
+
+
+def mock_answer_chunks(query_text):
+    """Canned answer served by the alternative (offline) query endpoint."""
+    return [
+        "Analyzing your medical query...\n\n",
+        "Based on medical literature, ",
+        "I can provide the following information about your question:\n\n",
+        f"You asked: {query_text}\n\n",
+        "This is a test response from AskMedicine's alternative endpoint. ",
+        "The main endpoint is currently being updated. ",
+        "Please check back shortly for full functionality with DeepSeek API integration."
+    ]
+
+
+def lookup_cached(query_text):
+    """Look up a cached answer, recording lookup latency and the hit/miss result.
+
+    An exact miss falls back to the most similar cached question when
+    SIMILAR_CACHE is on.
+    """
+    start = time.perf_counter()
+    cached = response_cache.get(query_text)
+    result = 'hit'
+    if cached is None and similar_questions is not None:
+        key = similar_questions.find(query_text)
+        if key is not None:
+            cached = response_cache.get(key)
+            result = 'similar'
+    metrics.CACHE_LOOKUP_SECONDS.observe(time.perf_counter() - start)
+    metrics.CACHE_LOOKUPS.inc(label_value='miss' if cached is None else result)
+    return cached
+
+
+def take_partial(query_text):
+    """Return (and forget) the saved partial answer for `query_text`, if resuming is on."""
+    if not PARTIAL_RESUME:
+        return None
+    saved = partial_answers.get(query_text)
+    if saved is None:
+        return None
+    partial_answers.delete(query_text)
+    return saved['content']
+
+
+def save_partial(query_text, text):
+    if PARTIAL_RESUME and text:
+        partial_answers.set(query_text, {'content': text})
+
+
+def record_upstream_failure(error):
+    if isinstance(error, requests.exceptions.Timeout):
+        metrics.UPSTREAM_TIMEOUTS.inc()
+    else:
+        metrics.UPSTREAM_ERRORS.inc()
+
+
+def open_answer_stream(query_text, prefetch_related=True):
+    """Open a DeepSeek stream for `query_text` and return a generator of SSE frames.
+
+    The complete answer is written to the cache once the stream has finished, and
+    its Related follow-up questions are queued for prefetch (if enabled). Closing
+    the generator early (every client disconnected) closes the upstream response
+    and keeps the partial text for a later resume.
+    """
+    # Make request to DeepSeek API
+    request_start = time.perf_counter()
+    partial = take_partial(query_text)
+    try:
+        response = None
+        if partial:
+            response = deepseek_client.post(upstream_headers(), build_payload(query_text, prefix=partial),
+                                            stream=True, url=deepseek_client.DEEPSEEK_PREFIX_API_URL)
+            if response.status_code != 200:
+                # Prefix completion unavailable: answer from scratch
+                response.close()
+                response, partial = None, None
+        if response is None:
+            response = deepseek_client.post(upstream_headers(), build_payload(query_text), stream=True)
+    except CircuitOpenError as api_error:
+        raise UpstreamError('DeepSeek API is temporarily unavailable, please retry shortly',
+                            retry_after=api_error.retry_after)
+    except Exception as api_error:
+        record_upstream_failure(api_error)
+        print(f"Error making request to DeepSeek API: {api_error}")
+        raise UpstreamError(f'Error connecting to DeepSeek API: {str(api_error)}')
+    metrics.UPSTREAM_TTFB.observe(time.perf_counter() - request_start)
+
+    if response.status_code != 200:
+        metrics.UPSTREAM_ERRORS.inc()
+        error_content = response.text
+        print(f"DeepSeek API error response: {error_content}")
+        raise UpstreamError(f'Failed to get response from DeepSeek API: {error_content}')
+
+    def generate():
+        parser = SSEParser()
+        structure = AnswerStructure()
+        frames = []
+        streamed = 0
+        metrics.INFLIGHT_STREAMS.inc()
+        try:
+            if partial:
+                # Resumed answer: replay what the earlier stream produced, then continue
+                parser.parts.append(partial)
+                frame = encode_frame(partial)
+                frames.append(frame)
+                streamed += len(frame)
+                yield frame
+                yield from map(encode_event, structure.feed(partial))
+            # Batch tiny token deltas into fewer, larger SSE events (SSE_COALESCE_MS / SSE_COALESCE_BYTES)
+            for content in iter_content(iter_raw_chunks(response), parser, ChunkCoalescer()):
+                frame = encode_frame(content)
+                frames.append(frame)
+                streamed += len(frame)
+                yield frame
+                # Structural events (section, table rows, references, related) as their lines complete
+                yield from map(encode_event, structure.feed(content))
+            yield from map(encode_event, structure.close())
+        except GeneratorExit:
+            # Every client disconnected: stop paying for tokens nobody will read
+            metrics.STREAM_ABORTS.inc()
+            save_partial(query_text, parser.answer())
+            raise
+        except requests.exceptions.RequestException as e:
+            # A stall or reset mid-answer also counts against the circuit
+            deepseek_client.breaker.record_failure()
+            record_upstream_failure(e)
+            raise
+        finally:
+            # Returns the connection to the pool, or drops it if the body was not read to the end
+            response.close()
+            metrics.INFLIGHT_STREAMS.dec()
+            metrics.GENERATION_SECONDS.observe(time.perf_counter() - request_start)
+            metrics.ANSWER_CHUNKS.observe(len(parser.parts))
+            metrics.STREAMED_BYTES.observe(streamed)
+
+        # Cache the complete response
+        answer = parser.answer()
+        response_cache.set(query_text, cache_entry(answer, frames, structure.events))
+        if prefetch_related:
+            prefetcher.submit_from_answer(answer)
+
+    return generate()
+
+
+def start_or_join(query_text):
+    """Join the running flight for `query_text`, or start one once admitted.
+
+    Only new upstream generations take an admission slot; raises admission.Rejected
+    when the wait queue is full or the wait times out.
+    """
+    flight = inflight.get(query_text)
+    if flight is not None:
+        return flight
+    slot = admission.acquire()
+    return inflight.join(query_text, lambda: open_answer_stream(query_text), on_finish=slot.release)
+
+
+def generate_and_cache(query_text):
+    """Generate and cache an answer in the background, joining any in-flight stream for it.
+
+    Never queues for admission: returns False if no upstream slot is free right now.
+    """
+    flight = inflight.get(query_text)
+    if flight is None:
+        slot = admission.try_acquire()
+        if slot is None:
+            return False
+        flight = inflight.join(query_text, lambda: open_answer_stream(query_text, prefetch_related=False),
+                               on_finish=slot.release, keep=True)
+    else:
+        flight.keep = True
+    flight.wait_finished()
+    if flight.error is not None:
+        raise flight.error
+    return True
+
+
+def history_session(cookies):
+    """Return (session id, is_new) for a request's cookies.
+
+    The id comes from the HISTORY_COOKIE the server issued; without a well-formed
+    one a fresh random id is returned, which the caller must set as that cookie.
+    """
+    session = cookies.get(HISTORY_COOKIE)
+    if session and _SESSION_ID_RE.fullmatch(session):
+        return session, False
+    return secrets.token_urlsafe(24), True
+
+
+def allows_credentials(origin):
+    """Whether a cross-origin request from `origin` may carry the session cookie."""
+    return origin is not None and origin in CORS_ORIGINS
+
+
+def session_cookie(session):
+    """Set-Cookie header value that issues `session` as the HISTORY_COOKIE."""
+    cookie = SimpleCookie()
+    cookie[HISTORY_COOKIE] = session
+    morsel = cookie[HISTORY_COOKIE]
+    morsel.update({'max-age': HISTORY_COOKIE_MAX_AGE, 'path': '/', 'httponly': True,
+                   'secure': HISTORY_COOKIE_SECURE, 'samesite': HISTORY_COOKIE_SAMESITE})
+    return morsel.OutputString()
+
+
+def record_flight(session, query_text, flight):
+    """Add a fully streamed answer to the session's history (resolved on the writer thread)."""
+    if flight.error is None and not flight.cancelled:
+        history.add(session, query_text, lambda: answer_from_frames(flight.chunks))
+
+
+def recorded(frames, record):
+    """Pass frames through and call record() once all of them have been sent."""
+    yield from frames
+    record()
+
+
+def warm_cache(path):
+    """Load the answers of a bulk output file (medinquire.py --output) into the answer cache.
+
+    Goes through to the disk tier, so every worker sharing ANSWER_CACHE_PATH sees
+    them. Returns the number of answers stored.
+    """
+    # The bulk CLI module is only needed here, so servers do not import it at startup
+    from medinquire import read_checkpoint
+    count = 0
+    for record in read_checkpoint(path).values():
+        answer = record['answer']
+        response_cache.set(record['question'], cache_entry(answer, [encode_frame(answer)]))
+        count += 1
+    return count
+
+
+def answer_from_frames(frames):
+    """Join the content of a flight's JSON SSE frames back into the answer text."""
+    return ''.join(json.loads(frame[6:])['content'] for frame in frames if not is_event_frame(frame))
+
+
+def answer_blocking(query_text):
+    """Return the answer to `query_text`, generating it first if it is not cached.
+
+    For batch jobs: joins or starts a flight that runs to the end without
+    subscribers, waiting for an admission slot like /api/query (may raise Rejected).
+    A batch asks its own questions, so its answers queue no Related prefetches.
+    """
+    flight = inflight.get(query_text)
+    if flight is None:
+        slot = admission.acquire()
+        flight = inflight.join(query_text, lambda: open_answer_stream(query_text, prefetch_related=False),
+                               on_finish=slot.release, keep=True)
+    else:
+        flight.keep = True
+    flight.wait_finished()
+    if flight.error is not None:
+        raise flight.error
+    return answer_from_frames(flight.chunks)
+
+
+def parse_batch(data):
+    """Validate a /api/batch body; return (questions, concurrency) or raise ValueError."""
+    questions = (data or {}).get('questions')
+    if not isinstance(questions, list) or not questions:
+        raise ValueError('Provide a non-empty "questions" list')
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise ValueError(f'At most {BATCH_MAX_QUESTIONS} questions per batch')
+    try:
+        concurrency = int(data.get('concurrency') or BATCH_CONCURRENCY)
+    except (TypeError, ValueError):
+        raise ValueError('"concurrency" must be an integer')
+    return questions, max(1, min(concurrency, BATCH_CONCURRENCY))
+
+
+def plan_batch(questions):
+    """Split a batch into answered and pending work.
+
+    Returns (hits, invalid, pending): NDJSON lines for cache hits and for invalid
+    items, and [(question, indices)] for the misses, where questions that
+    normalize to the same cache key are generated once.
+    """
+    hits = []
+    invalid = []
+    pending = {}
+    for index, question in enumerate(questions):
+        if not isinstance(question, str) or not question.strip():
+            invalid.append(batch_line(index, question, error='Question must be a non-empty string', status=400))
+            continue
+        key = normalize_query(question)
+        if key in pending:
+            pending[key][1].append(index)
+            continue
+        cached = lookup_cached(question)
+        if cached is not None:
+            hits.append(batch_line(index, question, content=cached['content'], cached=True))
+        else:
+            pending[key] = (question, [index])
+    return hits, invalid, list(pending.values())
+
+
+def batch_line(index, question, content=None, cached=False, error=None, status=None, retry_after=None):
+    """One NDJSON result line of /api/batch."""
+    item = {'index': index, 'question': question}
+    if error is None:
+        item['content'] = content
+        item['cached'] = cached
+    else:
+        item['error'] = error
+        item['status'] = status or 500
+        if retry_after:
+            item['retry_after'] = retry_after
+    return json.dumps(item) + '\n'
+
+
+def batch_error_lines(questions, indices, error):
+    """Result lines for every index of a question whose generation failed."""
+    status = 429 if isinstance(error, Rejected) else upstream_error_status(error)[0]
+    retry_after = getattr(error, 'retry_after', None)
+    return [batch_line(i, questions[i], error=str(error), status=status, retry_after=retry_after)
+            for i in indices]
+
+
+def batch_summary(total, errors, cached):
+    return json.dumps({'done': True, 'total': total, 'errors': errors, 'cached': cached}) + '\n'
+
+
+def run_batch(questions, concurrency):
+    """Yield the NDJSON lines of a /api/batch response.
+
+    Cache hits and invalid items come first, then each generated answer as soon as
+    it finishes (completion order, tagged with its index). A failed item becomes an
+    error line; the batch always ends with a summary line.
+    """
+    hits, invalid, pending = plan_batch(questions)
+    errors = len(invalid)
+    yield from invalid
+    yield from hits
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch')
+    try:
+        futures = {executor.submit(answer_blocking, question): indices for question, indices in pending}
+        for future in as_completed(futures):
+            indices = futures[future]
+            try:
+                content = future.result()
+            except Exception as e:
+                errors += len(indices)
+                yield from batch_error_lines(questions, indices, e)
+                continue
+            for index in indices:
+                yield batch_line(index, questions[index], content=content)
+    finally:
+        # Client went away: drop the queued items (running generations finish into the cache)
+        executor.shutdown(wait=False, cancel_futures=True)
+    yield batch_summary(len(questions), errors, len(hits))
+
+
+def upstream_error_status(error):
+    """HTTP status and extra headers for a failed upstream call: 503 + Retry-After when failing fast."""
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after:
+        return 503, {'Retry-After': str(retry_after)}
+    return 500, {}
+
+
+def rejection_body(rejected):
+    return {'error': 'Too many requests, please retry shortly', 'reason': rejected.reason,
+            'retry_after': rejected.retry_after}
+
+
+# Speculatively answers each answer's Related follow-ups (PREFETCH_RELATED=1),
+# below live traffic in priority
+prefetcher = Prefetcher(generate_and_cache, lambda question: question in response_cache, inflight.in_flight)
@@ -0,0 +1,197 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import metrics
+
+# Circuit breaker: once CIRCUIT_FAILURE_THRESHOLD of the last CIRCUIT_WINDOW upstream
+# calls have failed, calls fail fast for CIRCUIT_COOLDOWN seconds, then a single
+# probe is let through; its outcome closes the circuit or opens it again.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_WINDOW = int(os.getenv("CIRCUIT_WINDOW", "20"))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "15"))
+
+# Adaptive timeouts: the first-byte (response headers) timeout follows the recent
+# TTFB distribution, p99 * UPSTREAM_TIMEOUT_MULTIPLIER, clamped to [MIN, MAX].
+# Until enough samples are in, MAX applies. Retries share a budget of MAX seconds.
+# Once a stream has started, each later read waits up to UPSTREAM_STREAM_READ_TIMEOUT,
+# since the model can pause between chunks for longer than it took to first answer.
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_TIMEOUT_MIN = float(os.getenv("UPSTREAM_TIMEOUT_MIN", "5"))
+UPSTREAM_TIMEOUT_MAX = float(os.getenv("UPSTREAM_TIMEOUT_MAX", "60"))
+UPSTREAM_TIMEOUT_MULTIPLIER = float(os.getenv("UPSTREAM_TIMEOUT_MULTIPLIER", "3"))
+UPSTREAM_STREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_STREAM_READ_TIMEOUT", "120"))
+TTFB_SAMPLES = 200
+TTFB_MIN_SAMPLES = 20
+
+# Retries happen only before the first byte, with full-jitter exponential backoff
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.25"))
+UPSTREAM_RETRY_BACKOFF_MAX = float(os.getenv("UPSTREAM_RETRY_BACKOFF_MAX", "2"))
+RETRYABLE_STATUS = frozenset((429, 500, 502, 503, 504))
+
+# Hedging: when a streaming request has no response headers by the p95 TTFB, send
+# a second identical request and keep whichever answers first. Doubles upstream
+# cost for the slowest ~5% of requests, so it is off by default.
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "0").lower() in ("1", "true", "yes")
+UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.5"))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"DeepSeek API circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = max(1, int(round(retry_after)))
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a sliding window of call outcomes.
+
+    Every allowed call must be followed by record_success() or record_failure().
+    Thread-safe; the asyncio client shares the same instance.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, window=CIRCUIT_WINDOW,
+                 cooldown=CIRCUIT_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._outcomes = deque(maxlen=max(1, window))  # True for a failure
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        return self.failure_threshold > 0
+
+    def allow(self):
+        """Return True if a call may go ahead now."""
+        if not self.enabled():
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if now - self.opened_at < self.cooldown:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            # Half-open: one probe at a time (a probe that never reported is replaced)
+            if self._probe_started is not None and now - self._probe_started < self.cooldown:
+                return False
+            self._probe_started = now
+            return True
+
+    def check(self):
+        """Like allow(), but raise CircuitOpenError when the call may not go ahead."""
+        if not self.allow():
+            metrics.CIRCUIT_REJECTIONS.inc()
+            raise CircuitOpenError(self.retry_after())
+
+    def retry_after(self):
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def record_success(self):
+        if not self.enabled():
+            return
+        with self._lock:
+            if self.state != self.CLOSED:
+                self._outcomes.clear()
+                self._set_state(self.CLOSED)
+            self._outcomes.append(False)
+
+    def record_failure(self):
+        if not self.enabled():
+            return
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._open()
+                return
+            if self.state == self.OPEN:
+                return
+            self._outcomes.append(True)
+            if sum(self._outcomes) >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._set_state(self.OPEN)
+        print(f"DeepSeek API circuit opened for {self.cooldown:.0f}s")
+
+    def _set_state(self, state):
+        self.state = state
+        self._probe_started = None
+        metrics.CIRCUIT_OPEN.set(0 if state == self.CLOSED else 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'recent_failures': sum(self._outcomes),
+                'recent_calls': len(self._outcomes),
+                'retry_after': round(self.retry_after(), 1) if self.state != self.CLOSED else 0,
+            }
+
+
+class LatencyTracker:
+    """Recent upstream TTFB samples, for adaptive first-byte timeouts and hedge delays."""
+
+    def __init__(self, samples=TTFB_SAMPLES, min_samples=TTFB_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=samples)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q):
+        """Return the q-quantile of the recent samples, or None until min_samples are in."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def first_byte_timeout(self):
+        p99 = self.quantile(0.99)
+        if p99 is None:
+            return UPSTREAM_TIMEOUT_MAX
+        return min(UPSTREAM_TIMEOUT_MAX, max(UPSTREAM_TIMEOUT_MIN, p99 * UPSTREAM_TIMEOUT_MULTIPLIER))
+
+    def hedge_delay(self):
+        """Seconds to wait for headers before hedging, or None to not hedge (yet)."""
+        if not UPSTREAM_HEDGE:
+            return None
+        p95 = self.quantile(0.95)
+        if p95 is None:
+            return None
+        return max(UPSTREAM_HEDGE_MIN_DELAY, p95)
+
+    def stats(self):
+        p50 = self.quantile(0.5)
+        return {
+            'ttfb_samples': len(self._samples),
+            'ttfb_p50': None if p50 is None else round(p50, 3),
+            'first_byte_timeout': round(self.first_byte_timeout(), 2),
+            'hedge_delay': self.hedge_delay(),
+        }
+
+
+def retry_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff for retry number `attempt` (0-based).
+
+    A Retry-After from the upstream (429/503) is honoured up to the backoff cap.
+    """
+    delay = random.uniform(0, min(UPSTREAM_RETRY_BACKOFF_MAX, UPSTREAM_RETRY_BACKOFF * 2 ** attempt))
+    if retry_after:
+        try:
+            delay = max(delay, min(UPSTREAM_RETRY_BACKOFF_MAX, float(retry_after)))
+        except ValueError:
+            pass
+    return delay
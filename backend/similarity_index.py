@@ -0,0 +1,188 @@
+import os
+import random
+import threading
+import zlib
+
+from answer_cache import normalize_query
+
+# Near-duplicate lookup over cached questions, so a paraphrase ("Protected TAVR
+# trial findings" / "What were the findings of the Protected TAVR trial?") is
+# answered from the cache. Questions are reduced to their content words; MinHash
+# signatures bucketed by LSH bands find candidates in O(bands), and the exact
+# Jaccard similarity of the word sets decides. Word sets ignore order, so a hit
+# also needs the same signs, comparisons and negations next to the same words
+# (see polarity()). Off by default: a paraphrase hit serves an answer written
+# for the other wording.
+SIMILAR_CACHE = os.getenv("SIMILAR_CACHE", "0").lower() in ("1", "true", "yes")
+SIMILAR_CACHE_THRESHOLD = float(os.getenv("SIMILAR_CACHE_THRESHOLD", "0.8"))
+
+# 8 bands of 4 hashes: a pair at Jaccard 0.8 becomes a candidate ~98% of the time, at 0.3 ~6%
+_BANDS = 8
+_ROWS = 4
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+# Candidates checked per lookup, so a crowded bucket cannot make a lookup slow
+_MAX_CANDIDATES = 64
+
+# Words that do not change what is being asked. Negations, comparisons and
+# populations ("without", "vs", "children") are kept on purpose.
+STOPWORDS = frozenset("""
+a about an and any are as at be been being can could did do does done explain for from give had has
+have how i in into is it its latest me my new of on or please recent show summarize summary tell than
+that the their there these this those to was were what whats when where which who why will with would
+you your
+""".split())
+
+# Tokens that flip or bound what is asked; normalize_query() splits signs and
+# comparisons into tokens of their own
+POLAR_TOKENS = frozenset("""
++ - ± < > = ≤ ≥ % no not non without never none nor neither negative positive above below over under
+higher lower greater less more fewer before after
+""".split())
+
+
+def _stem(word):
+    """Crude plural folding, enough for "trials"/"trial" and "therapies"/"therapy"."""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def content_words(question):
+    """The content words of a question in order, normalized and stemmed."""
+    return [_stem(word) for word in normalize_query(question).split() if word not in STOPWORDS]
+
+
+def shingles(question):
+    """The set of content words of a question."""
+    return frozenset(content_words(question))
+
+
+def polarity(question):
+    """The polar tokens of a question, each with the content words on either side.
+
+    "Rh+ mother with Rh- baby" and "Rh- mother with Rh+ baby" have the same
+    shingles but not the same polarity.
+    """
+    words = content_words(question)
+    return frozenset((words[i - 1] if i > 0 else '', word, words[i + 1] if i + 1 < len(words) else '')
+                     for i, word in enumerate(words) if word in POLAR_TOKENS)
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class SimilarityIndex:
+    """MinHash/LSH index from normalized cache keys to their content-word sets.
+
+    add() and discard() keep it in step with the answer cache (see
+    AnswerCache(index=...)); find() returns the key of the most similar indexed
+    question at or above the threshold, or None. Thread-safe.
+    """
+
+    def __init__(self, threshold=SIMILAR_CACHE_THRESHOLD, bands=_BANDS, rows=_ROWS, seed=1):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(bands * rows)]
+        self._buckets = [{} for _ in range(bands)]  # band -> {band signature: set of keys}
+        self._entries = {}  # key -> (word set, polarity, band signatures)
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    def _signature(self, words):
+        hashes = [zlib.crc32(word.encode('utf-8')) for word in words]
+        signature = [min(((a * h + b) % _PRIME) & _MASK for h in hashes) for a, b in self._perms]
+        rows = self.rows
+        return tuple(tuple(signature[i * rows:(i + 1) * rows]) for i in range(self.bands))
+
+    def prepare(self, key):
+        """Return the (word set, polarity, band signatures) entry add() stores for `key`.
+
+        None if it has no content words. Lets a caller hash outside its own lock
+        and only hold it for add().
+        """
+        words = shingles(key)
+        if not words:
+            return None
+        return words, polarity(key), self._signature(words)
+
+    def add(self, key, entry=None):
+        """Index a normalized cache key (no-op if it has no content words); `entry` is from prepare()."""
+        if entry is None:
+            entry = self.prepare(key)
+            if entry is None:
+                return
+        bands = entry[2]
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            for buckets, band in zip(self._buckets, bands):
+                buckets.setdefault(band, set()).add(key)
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            for buckets, band in zip(self._buckets, entry[2]):
+                bucket = buckets.get(band)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del buckets[band]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for buckets in self._buckets:
+                buckets.clear()
+
+    def find(self, question):
+        """Return the indexed key most similar to `question`, if any reaches the threshold.
+
+        Only keys with the same polarity() qualify.
+        """
+        words = shingles(question)
+        if not words:
+            return None
+        polar = polarity(question)
+        bands = self._signature(words)
+        best, best_score = None, self.threshold
+        with self._lock:
+            self.lookups += 1
+            checked = 0
+            seen = set()
+            for buckets, band in zip(self._buckets, bands):
+                for key in buckets.get(band, ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    candidate_words, candidate_polar, _ = self._entries[key]
+                    score = jaccard(words, candidate_words)
+                    if score >= best_score and candidate_polar == polar:
+                        best, best_score = key, score
+                    checked += 1
+                    if checked >= _MAX_CANDIDATES:
+                        break
+                if checked >= _MAX_CANDIDATES:
+                    break
+            if best is not None:
+                self.hits += 1
+        return best
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'threshold': self.threshold,
+                    'lookups': self.lookups, 'hits': self.hits}
@@ -0,0 +1,316 @@
+import os
+import threading
+import time
+
+from answer_cache import normalize_query
+
+# Seconds a subscriber waits for the next chunk before giving up on a stalled flight
+SUBSCRIBER_IDLE_TIMEOUT = 120
+# Seconds a flight keeps streaming after its last subscriber disconnected (so a
+# reload can rejoin it) before the upstream stream is closed
+FLIGHT_ABANDON_GRACE = float(os.getenv("FLIGHT_ABANDON_GRACE", "1"))
+
+
+def _close(chunks):
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+        close()
+
+
+class _Abandonment:
+    """Tracks whether every subscriber of a flight has gone away."""
+
+    def abandoned(self):
+        """True once the last subscriber left more than FLIGHT_ABANDON_GRACE ago.
+
+        Flights joined with keep=True (background generations) are never abandoned.
+        """
+        left_at = self.abandoned_at
+        return (not self.keep and self.subscribers == 0 and left_at is not None
+                and time.monotonic() - left_at >= FLIGHT_ABANDON_GRACE)
+
+
+class Flight(_Abandonment):
+    """One upstream generation shared by every request for the same normalized question.
+
+    A pump thread appends chunks as they arrive; each subscriber replays the chunks
+    already produced and then follows the live tail. When every subscriber has
+    disconnected the pump closes the chunk iterator, which closes the upstream stream.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.started = False
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.abandoned_at = None
+        self.keep = False
+        self.cancelled = False
+        self._cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def mark_started(self):
+        with self._cond:
+            self.started = True
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def wait_started(self, timeout=None):
+        """Block until the upstream stream is open; return the error if opening it failed."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.started or self.done, timeout)
+            if not self.started and self.done:
+                return self.error
+            return None
+
+    def wait_finished(self, timeout=None):
+        """Block until the flight has finished; return False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.done, timeout)
+
+    def subscribe(self):
+        """Yield every chunk of the flight, starting from the first one."""
+        with self._cond:
+            self.subscribers += 1
+            self.abandoned_at = None
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    if not self._cond.wait_for(lambda: index < len(self.chunks) or self.done,
+                                               SUBSCRIBER_IDLE_TIMEOUT):
+                        print(f"Flight for '{self.key[:50]}' stalled, dropping subscriber")
+                        return
+                    # Take everything produced so far under one lock acquisition
+                    pending = self.chunks[index:]
+                    done = self.done
+                index += len(pending)
+                yield from pending
+                if done and index >= len(self.chunks):
+                    return
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+                if self.subscribers == 0:
+                    self.abandoned_at = time.monotonic()
+
+
+class SingleFlight:
+    """Coalesces concurrent identical requests onto a single upstream generation."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.started_flights = 0
+        self.joined_flights = 0
+
+    def get(self, question):
+        """Return the running Flight for `question`, or None."""
+        with self._lock:
+            return self._flights.get(normalize_query(question))
+
+    def join(self, question, open_stream, on_finish=None, keep=False):
+        """Return the in-flight Flight for `question`, starting one if none is running.
+
+        `open_stream()` is called on a background thread for the first requester and
+        must return an iterable of chunks, raising if the upstream cannot be opened.
+        `on_finish()` runs when a flight started by this call ends, or right away if
+        the call joined an existing flight (e.g. to release an admission slot).
+        `keep=True` lets the flight run to the end even with no subscribers.
+        """
+        key = normalize_query(question)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = Flight(key)
+                self._flights[key] = flight
+                self.started_flights += 1
+                started = True
+            else:
+                self.joined_flights += 1
+                started = False
+            if keep:
+                flight.keep = True
+        if not started:
+            if on_finish is not None:
+                on_finish()
+            return flight
+        thread = threading.Thread(target=self._pump, args=(flight, open_stream, on_finish),
+                                  daemon=True, name=f'flight-{key[:20]}')
+        thread.start()
+        return flight
+
+    def _pump(self, flight, open_stream, on_finish=None):
+        error = None
+        try:
+            chunks = open_stream()
+            flight.mark_started()
+            for chunk in chunks:
+                flight.publish(chunk)
+                if flight.abandoned():
+                    # Every client went away: stop generating and free the upstream connection
+                    flight.cancelled = True
+                    _close(chunks)
+                    break
+        except Exception as e:
+            print(f"Upstream flight for '{flight.key[:50]}' failed: {e}")
+            error = e
+        finally:
+            # Unregister before waking subscribers so later requests see the cache instead
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            flight.finish(error)
+            if on_finish is not None:
+                on_finish()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+class AsyncFlight(_Abandonment):
+    """asyncio counterpart of Flight, shared by coroutines on one event loop."""
+
+    def __init__(self, key):
+        # asyncio is imported where used, so the threaded server never loads it
+        import asyncio
+        self.key = key
+        self.chunks = []
+        self.started = False
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.abandoned_at = None
+        self.keep = False
+        self.cancelled = False
+        self._cond = asyncio.Condition()
+
+    async def _notify(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    async def publish(self, chunk):
+        self.chunks.append(chunk)
+        await self._notify()
+
+    async def mark_started(self):
+        self.started = True
+        await self._notify()
+
+    async def finish(self, error=None):
+        self.done = True
+        self.error = error
+        await self._notify()
+
+    async def wait_started(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.started or self.done)
+        if not self.started and self.done:
+            return self.error
+        return None
+
+    async def wait_finished(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.done)
+
+    async def subscribe(self):
+        import asyncio
+        self.subscribers += 1
+        self.abandoned_at = None
+        index = 0
+        try:
+            while True:
+                if index >= len(self.chunks) and not self.done:
+                    async with self._cond:
+                        try:
+                            await asyncio.wait_for(
+                                self._cond.wait_for(lambda: index < len(self.chunks) or self.done),
+                                SUBSCRIBER_IDLE_TIMEOUT
+                            )
+                        except asyncio.TimeoutError:
+                            print(f"Flight for '{self.key[:50]}' stalled, dropping subscriber")
+                            return
+                pending = self.chunks[index:]
+                index += len(pending)
+                for chunk in pending:
+                    yield chunk
+                if self.done and index >= len(self.chunks):
+                    return
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                self.abandoned_at = time.monotonic()
+
+
+class AsyncSingleFlight:
+    """Coalesces concurrent identical requests onto one upstream stream on an event loop."""
+
+    def __init__(self):
+        self._flights = {}
+        self._tasks = set()
+        self.started_flights = 0
+        self.joined_flights = 0
+
+    def get(self, question):
+        return self._flights.get(normalize_query(question))
+
+    def join(self, question, open_stream, on_finish=None, keep=False):
+        """Return the in-flight AsyncFlight for `question`, starting one if none is running.
+
+        `open_stream()` is a coroutine function returning an async iterable of chunks.
+        `on_finish()` and `keep` behave as in SingleFlight.join().
+        """
+        import asyncio
+        key = normalize_query(question)
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.keep = flight.keep or keep
+            self.joined_flights += 1
+            if on_finish is not None:
+                on_finish()
+            return flight
+        flight = AsyncFlight(key)
+        flight.keep = keep
+        self._flights[key] = flight
+        self.started_flights += 1
+        # Keep a reference so the pump task is not garbage collected mid-stream
+        task = asyncio.ensure_future(self._pump(flight, open_stream, on_finish))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return flight
+
+    async def _pump(self, flight, open_stream, on_finish=None):
+        error = None
+        try:
+            chunks = await open_stream()
+            await flight.mark_started()
+            async for chunk in chunks:
+                await flight.publish(chunk)
+                if flight.abandoned():
+                    flight.cancelled = True
+                    await chunks.aclose()
+                    break
+        except Exception as e:
+            print(f"Upstream flight for '{flight.key[:50]}' failed: {e}")
+            error = e
+        finally:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            await flight.finish(error)
+            if on_finish is not None:
+                on_finish()
+
+    def in_flight(self):
+        return len(self._flights)
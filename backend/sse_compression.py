@@ -0,0 +1,97 @@
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+# Opt-in compression of the /api/query event streams, negotiated from the request's
+# Accept-Encoding. The compressor is flushed after every chunk (each coalesced SSE
+# event) so the stream stays incremental; a flush costs ~5 bytes.
+SSE_COMPRESSION = os.getenv("SSE_COMPRESSION", "0").lower() in ("1", "true", "yes")
+SSE_COMPRESSION_LEVEL = int(os.getenv("SSE_COMPRESSION_LEVEL", "6"))
+SSE_BROTLI_QUALITY = int(os.getenv("SSE_BROTLI_QUALITY", "5"))
+
+# Preferred first when the client accepts several with the same q-value
+_PREFERENCE = ('br', 'gzip', 'deflate')
+
+
+def available_encodings():
+    return tuple(e for e in _PREFERENCE if e != 'br' or brotli is not None)
+
+
+def negotiate(accept_encoding, enabled=None):
+    """Return the content encoding to use for a response, or None for identity."""
+    if not (SSE_COMPRESSION if enabled is None else enabled) or not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in available_encodings():
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class StreamCompressor:
+    """Incremental gzip / deflate / brotli compressor with a flush per chunk."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(mode=brotli.MODE_TEXT, quality=SSE_BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            # wbits 31 writes a gzip header, 15 a zlib one (HTTP "deflate")
+            self._zlib = zlib.compressobj(SSE_COMPRESSION_LEVEL, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+            self._brotli = None
+
+    def compress(self, data):
+        """Compress `data` and flush, so everything written so far can be decoded."""
+        if self._zlib is not None:
+            return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+        return self._brotli.process(data) + self._brotli.flush()
+
+    def finish(self):
+        if self._zlib is not None:
+            return self._zlib.flush(zlib.Z_FINISH)
+        return self._brotli.finish()
+
+
+def compress_chunks(chunks, encoding):
+    """Compress an iterable of str/bytes chunks, yielding one flushed block per chunk."""
+    compressor = StreamCompressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            block = compressor.compress(chunk)
+            if block:
+                yield block
+        yield compressor.finish()
+    finally:
+        # Pass a client disconnect on to the source (e.g. a single-flight subscription)
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def stream_headers(encoding):
+    """Extra response headers for an event stream sent with `encoding`."""
+    headers = {'Cache-Control': 'no-cache'}
+    if SSE_COMPRESSION:
+        headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return headers
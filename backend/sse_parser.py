@@ -0,0 +1,272 @@
+import json
+import os
+import time
+from json.decoder import scanstring
+
+# Downstream coalescing policy: buffer upstream tokens and emit one SSE event per
+# SSE_COALESCE_MS milliseconds or SSE_COALESCE_BYTES characters, whichever comes first.
+# Set both to 0 to forward every token as its own event. On the asyncio server
+# buffered text is sent once it is SSE_COALESCE_MS old even if upstream stalls;
+# the threaded reader can only check when the next upstream chunk (a token or a
+# keep-alive) arrives.
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "20"))
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "512"))
+
+_DATA = b"data:"
+_DONE = b"[DONE]"
+_DELTA = b'"delta"'
+_CONTENT = b'"content"'
+
+
+def extract_delta_content(payload):
+    """Return choices[0].delta.content from a chat completion chunk (bytes), or ''.
+
+    Avoids a full json.loads() for the common case by locating the "content" key
+    inside "delta" and decoding just that string with the C string scanner.
+    Falls back to json.loads() for anything unusual.
+    """
+    delta = payload.find(_DELTA)
+    if delta != -1:
+        key = payload.find(_CONTENT, delta)
+        if key != -1:
+            pos = key + len(_CONTENT)
+            end = len(payload)
+            while pos < end and payload[pos] in b" \t:":
+                pos += 1
+            if payload.startswith(b'"', pos):
+                # Only the tail of the payload needs decoding for the string scanner
+                tail = payload[pos:].decode("utf-8")
+                try:
+                    return scanstring(tail, 1)[0]
+                except ValueError:
+                    pass
+            elif payload.startswith(b"null", pos):
+                return ""
+    try:
+        data = json.loads(payload)
+        choices = data.get("choices") or [{}]
+        return (choices[0].get("delta") or {}).get("content") or ""
+    except (ValueError, AttributeError, IndexError, TypeError):
+        return ""
+
+
+class SSEParser:
+    """Incremental parser for an upstream chat completion SSE stream.
+
+    Feed raw byte chunks as they arrive, in any split; feed() returns the content
+    deltas of every event completed by that chunk. Events may span several
+    "data:" lines and several network chunks. The full answer is collected in a
+    list and joined once by answer().
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._data_lines = []
+        self.parts = []
+        self.events = 0
+        self.done = False
+
+    def feed(self, chunk):
+        if self.done:
+            return []
+        buffer = self._buffer + chunk if self._buffer else chunk
+        contents = []
+        start = 0
+        while True:
+            newline = buffer.find(b"\n", start)
+            if newline == -1:
+                break
+            line = buffer[start:newline]
+            start = newline + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            if not line:
+                # Blank line terminates the event
+                if self._data_lines:
+                    self._dispatch(contents)
+                    if self.done:
+                        self._buffer = b""
+                        return contents
+                continue
+            if line.startswith(_DATA):
+                value = line[5:]
+                if value.startswith(b" "):
+                    value = value[1:]
+                self._data_lines.append(value)
+            # Comments (":") and other fields (event:, id:, retry:) are ignored
+        self._buffer = buffer[start:]
+        return contents
+
+    def close(self):
+        """Dispatch a trailing event that was not followed by a blank line."""
+        contents = []
+        if self._buffer.startswith(_DATA):
+            self.feed(b"\n")
+        if self._data_lines and not self.done:
+            self._dispatch(contents)
+        return contents
+
+    def _dispatch(self, contents):
+        lines = self._data_lines
+        payload = lines[0] if len(lines) == 1 else b"\n".join(lines)
+        self._data_lines = []
+        self.events += 1
+        if payload.strip() == _DONE:
+            self.done = True
+            return
+        content = extract_delta_content(payload)
+        if content:
+            self.parts.append(content)
+            contents.append(content)
+
+    def answer(self):
+        return "".join(self.parts)
+
+
+class ChunkCoalescer:
+    """Buffers small text deltas and releases them in larger batches.
+
+    push() returns the buffered text once it is `max_delay_ms` old or at least
+    `max_bytes` characters long, otherwise None. poll() returns it once it is old
+    enough without adding text, due_in() says when that will be, and flush()
+    returns whatever is left.
+    """
+
+    def __init__(self, max_delay_ms=SSE_COALESCE_MS, max_bytes=SSE_COALESCE_BYTES):
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_bytes = max_bytes
+        self._pending = []
+        self._pending_size = 0
+        self._first_at = 0.0
+
+    def push(self, text):
+        if self.max_delay <= 0 and self.max_bytes <= 0:
+            return text
+        if not self._pending:
+            self._first_at = time.monotonic()
+        self._pending.append(text)
+        self._pending_size += len(text)
+        if (self.max_bytes > 0 and self._pending_size >= self.max_bytes) or \
+                (self.max_delay > 0 and time.monotonic() - self._first_at >= self.max_delay):
+            return self.flush()
+        return None
+
+    def due_in(self):
+        """Seconds until the buffered text is due (0 if it is), or None if nothing waits on a time limit."""
+        if not self._pending or self.max_delay <= 0:
+            return None
+        return max(0.0, self._first_at + self.max_delay - time.monotonic())
+
+    def poll(self):
+        due = self.due_in()
+        return self.flush() if due == 0 else None
+
+    def flush(self):
+        if not self._pending:
+            return None
+        text = self._pending[0] if len(self._pending) == 1 else "".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        return text
+
+
+def iter_raw_chunks(response):
+    """Yield raw body chunks from a streaming requests response as soon as they arrive."""
+    # With chunked transfer encoding urllib3 hands over each chunk as it is read;
+    # otherwise fall back to small fixed reads like iter_lines() does.
+    chunk_size = None if getattr(response.raw, "chunked", False) else 512
+    return response.iter_content(chunk_size=chunk_size)
+
+
+def _coalesced(contents, coalescer):
+    """Pass the deltas of one upstream chunk through `coalescer`, also releasing buffered text that is due."""
+    if coalescer is None:
+        yield from contents
+        return
+    for content in contents:
+        batch = coalescer.push(content)
+        if batch:
+            yield batch
+    if not contents:
+        # A chunk without content (keep-alive, role delta) still lets due text out
+        batch = coalescer.poll()
+        if batch:
+            yield batch
+
+
+def iter_content(chunks, parser=None, coalescer=None):
+    """Yield text deltas parsed from an iterable of raw SSE byte chunks.
+
+    Stops at [DONE]. If a coalescer is given, deltas are batched by its policy;
+    its time limit is checked whenever a chunk arrives.
+    """
+    parser = parser if parser is not None else SSEParser()
+    for chunk in chunks:
+        yield from _coalesced(parser.feed(chunk), coalescer)
+        if parser.done:
+            break
+    if not parser.done:
+        yield from _coalesced(parser.close(), coalescer)
+    if coalescer is not None:
+        rest = coalescer.flush()
+        if rest:
+            yield rest
+
+
+async def _next_chunk(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+def _consume_result(task):
+    # The stream was abandoned with a read pending: its outcome is of no interest
+    if not task.cancelled():
+        task.exception()
+
+
+async def aiter_content(chunks, parser=None, coalescer=None):
+    """Async counterpart of iter_content() for an async iterable of raw SSE byte chunks.
+
+    While the coalescer holds text, the next chunk is awaited only until that text
+    is due, so a stall upstream does not hold it back.
+    """
+    import asyncio
+    parser = parser if parser is not None else SSEParser()
+    iterator = chunks.__aiter__()
+    pending = None
+    try:
+        while True:
+            due = coalescer.due_in() if coalescer is not None else None
+            if pending is None and due is None:
+                chunk = await _next_chunk(iterator)
+            else:
+                if pending is None:
+                    pending = asyncio.ensure_future(_next_chunk(iterator))
+                    pending.add_done_callback(_consume_result)
+                if due is not None:
+                    done, _ = await asyncio.wait([pending], timeout=due)
+                    if not done:
+                        batch = coalescer.flush()
+                        if batch:
+                            yield batch
+                        continue
+                task, pending = pending, None
+                chunk = await task
+            if chunk is None:
+                break
+            for content in _coalesced(parser.feed(chunk), coalescer):
+                yield content
+            if parser.done:
+                break
+    finally:
+        if pending is not None:
+            pending.cancel()
+    if not parser.done:
+        for content in _coalesced(parser.close(), coalescer):
+            yield content
+    if coalescer is not None:
+        rest = coalescer.flush()
+        if rest:
+            yield rest
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+
+import deepseek_client
+
+# Warm-up before serving, and the readiness state behind /api/ready. /api/health
+# answers as soon as a worker runs; /api/ready only once its warm-up is done.
+# Process-wide steps (the verifying TLS context, filling the answer cache's
+# memory tier from disk) run when the app is imported, so with gunicorn's
+# preload_app they happen once in the master and every worker inherits them.
+# Per-worker steps (opening upstream connections) run on a thread in each worker.
+ANSWER_CACHE_PRELOAD = os.getenv("ANSWER_CACHE_PRELOAD", "0").lower() in ("1", "true", "yes")
+# Set by gunicorn.conf.py when it preloads the app: worker steps then start from its post_fork hook
+WARMUP_AFTER_FORK = os.getenv("WARMUP_AFTER_FORK", "0") == "1"
+
+_lock = threading.Lock()
+_steps = {}  # step name -> None while running, else {'seconds': ..., 'error': ...}
+_worker_steps = []  # (name, function) run in every serving process
+_tasks = set()
+_started = time.monotonic()
+_ready_after = None
+
+
+def _reset_after_fork():
+    """A forked worker keeps the finished process-wide steps and times its own warm-up."""
+    global _lock, _started, _ready_after
+    _lock = threading.Lock()
+    _started = time.monotonic()
+    _ready_after = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _pending(name):
+    global _ready_after
+    with _lock:
+        _steps[name] = None
+        _ready_after = None
+
+
+def _check_ready():
+    """Mark the worker ready once no step is running (caller must hold _lock)."""
+    global _ready_after
+    if _ready_after is None and all(step is not None for step in _steps.values()):
+        _ready_after = time.monotonic() - _started
+        print(f"Warm-up of process {os.getpid()} done after {_ready_after:.2f}s")
+
+
+def run_step(name, function, *args):
+    """Run one warm-up step, recording how long it took. A failed step is logged and does not block readiness."""
+    _pending(name)
+    start = time.monotonic()
+    result, error = None, None
+    try:
+        result = function(*args)
+    except Exception as e:
+        print(f"Warm-up step '{name}' failed: {e}")
+        error = str(e)
+    _finish(name, time.monotonic() - start, error)
+    return result
+
+
+def _finish(name, seconds, error=None):
+    with _lock:
+        _steps[name] = {'seconds': round(seconds, 4), 'error': error}
+        _check_ready()
+
+
+def begin(cache=None, worker_steps=(), started_later=()):
+    """Run the process-wide warm-up now and start the per-worker steps (unless deferred to post_fork).
+
+    `cache` is the answer cache whose memory tier ANSWER_CACHE_PRELOAD fills;
+    `worker_steps` are (name, function) pairs to run in every serving process;
+    `started_later` names steps the server starts itself (see start_async_step()).
+    """
+    _worker_steps.extend(worker_steps)
+    preload = ANSWER_CACHE_PRELOAD and cache is not None
+    # Every known step counts as running from the start, so readiness is reported once
+    for name in ['tls_context'] + (['answer_cache'] if preload else []) + list(started_later):
+        _pending(name)
+    if not WARMUP_AFTER_FORK:
+        for name, _ in _worker_steps:
+            _pending(name)
+    run_step('tls_context', deepseek_client.shared_tls_context)
+    if preload:
+        count = run_step('answer_cache', cache.load_from_backend)
+        print(f"Loaded {count or 0} answers from the disk cache into memory")
+    if not WARMUP_AFTER_FORK:
+        start_worker()
+
+
+def start_worker():
+    """Start this worker's warm-up steps on a background thread; the worker reports ready once they finish."""
+    if not _worker_steps:
+        with _lock:
+            _check_ready()
+        return None
+    for name, _ in _worker_steps:
+        _pending(name)
+
+    def warm_up():
+        for name, function in _worker_steps:
+            run_step(name, function)
+
+    thread = threading.Thread(target=warm_up, daemon=True, name='warm-up')
+    thread.start()
+    return thread
+
+
+def start_async_step(name, coroutine):
+    """Run a warm-up coroutine as a task on the running loop (e.g. from an aiohttp on_startup hook).
+
+    The step counts as running from this call, not from when the task is first scheduled.
+    """
+    import asyncio
+    _pending(name)
+
+    async def run():
+        start = time.monotonic()
+        error = None
+        try:
+            await coroutine
+        except Exception as e:
+            print(f"Warm-up step '{name}' failed: {e}")
+            error = str(e)
+        _finish(name, time.monotonic() - start, error)
+
+    # Referenced until done so the task is not garbage collected mid-warm-up
+    task = asyncio.ensure_future(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def status():
+    """Readiness of this worker: its warm-up steps and how long it took to become ready."""
+    with _lock:
+        steps = dict(_steps)
+        ready_after = _ready_after
+    return {
+        'status': 'ready' if ready_after is not None else 'starting',
+        'pid': os.getpid(),
+        'uptime': round(time.monotonic() - _started, 3),
+        'ready_after': round(ready_after, 3) if ready_after is not None else None,
+        'steps': {name: step or {'running': True} for name, step in steps.items()},
+    }
@@ -0,0 +1,34 @@
+import unittest
+
+from answer_cache import AnswerCache, normalize_query
+
+
+class NormalizeQueryTest(unittest.TestCase):
+    def test_sentence_punctuation_and_case_are_ignored(self):
+        self.assertEqual(normalize_query("What is TAVR?"), normalize_query("what is  tavr ?"))
+        self.assertEqual(normalize_query('"Statins", please!'), normalize_query("statins please"))
+
+    def test_signs_comparisons_and_percents_keep_questions_apart(self):
+        pairs = [
+            ("Treatment for HER2+ breast cancer", "Treatment for HER2- breast cancer"),
+            ("Management of HbA1c >9%", "Management of HbA1c <9%"),
+            ("Rh+ mother with Rh- baby", "Rh- mother with Rh+ baby"),
+            ("Ejection fraction ≤40%", "Ejection fraction ≥40%"),
+            ("LDL reduction of 50%", "LDL reduction of 50"),
+        ]
+        for first, second in pairs:
+            with self.subTest(first=first, second=second):
+                self.assertNotEqual(normalize_query(first), normalize_query(second))
+
+    def test_hyphenated_words_match_spaced_words(self):
+        self.assertEqual(normalize_query("non-small cell lung cancer"), normalize_query("non small cell lung cancer"))
+
+    def test_opposite_questions_do_not_share_a_cache_entry(self):
+        cache = AnswerCache(max_bytes=1 << 20, default_ttl=0)
+        cache.set("Treatment for HER2+ breast cancer", {'content': 'positive'})
+        self.assertIsNone(cache.get("Treatment for HER2- breast cancer"))
+        self.assertEqual(cache.get("treatment for her2+ breast cancer?"), {'content': 'positive'})
+
+
+if __name__ == '__main__':
+    unittest.main()
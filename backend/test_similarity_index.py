@@ -0,0 +1,44 @@
+import unittest
+
+from answer_cache import normalize_query
+from similarity_index import SimilarityIndex
+
+
+class SimilarityIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SimilarityIndex(threshold=0.8)
+
+    def add(self, question):
+        key = normalize_query(question)
+        self.index.add(key)
+        return key
+
+    def test_paraphrase_matches(self):
+        key = self.add("What were the findings of the Protected TAVR trial?")
+        self.assertEqual(self.index.find("Protected TAVR trial findings"), key)
+
+    def test_swapped_signs_do_not_match(self):
+        self.add("Rh+ mother with Rh- baby")
+        self.assertIsNone(self.index.find("Rh- mother with Rh+ baby"))
+        self.assertIsNotNone(self.index.find("Rh+ mother with an Rh- baby"))
+
+    def test_swapped_comparisons_and_negations_do_not_match(self):
+        pairs = [
+            ("ER positive PR negative breast cancer treatment", "ER negative PR positive breast cancer treatment"),
+            ("Metformin for HbA1c >9% and eGFR <30", "Metformin for HbA1c <9% and eGFR >30"),
+            ("Anticoagulation without stroke but with bleeding history",
+             "Anticoagulation with stroke but without bleeding history"),
+        ]
+        for cached, asked in pairs:
+            with self.subTest(cached=cached, asked=asked):
+                self.add(cached)
+                self.assertIsNone(self.index.find(asked))
+
+    def test_discarded_key_is_not_found(self):
+        key = self.add("Protected TAVR trial findings")
+        self.index.discard(key)
+        self.assertIsNone(self.index.find("Protected TAVR trial findings"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import asyncio
+import json
+import time
+import unittest
+
+from sse_parser import ChunkCoalescer, SSEParser, aiter_content, iter_content
+
+
+def event(content):
+    return b'data: ' + json.dumps({'choices': [{'delta': {'content': content}}]}).encode() + b'\n\n'
+
+
+class IterContentTest(unittest.TestCase):
+    def test_deltas_split_across_chunks(self):
+        body = event('Hello') + event(', world') + b'data: [DONE]\n\n'
+        chunks = [body[i:i + 7] for i in range(0, len(body), 7)]
+        parser = SSEParser()
+        self.assertEqual(''.join(iter_content(chunks, parser)), 'Hello, world')
+        self.assertTrue(parser.done)
+
+    def test_keep_alive_chunk_releases_due_text(self):
+        def chunks():
+            yield event('Hel')
+            time.sleep(0.05)
+            yield b': keep-alive\n\n'
+            yield event('lo') + b'data: [DONE]\n\n'
+        batches = list(iter_content(chunks(), coalescer=ChunkCoalescer(max_delay_ms=20, max_bytes=512)))
+        self.assertEqual(batches, ['Hel', 'lo'])
+
+
+class AsyncIterContentTest(unittest.IsolatedAsyncioTestCase):
+    async def test_buffered_text_is_sent_during_a_stall(self):
+        received = []
+
+        async def chunks():
+            yield event('Hel')
+            await asyncio.sleep(0.3)
+            yield event('lo') + b'data: [DONE]\n\n'
+
+        start = time.monotonic()
+        async for batch in aiter_content(chunks(), coalescer=ChunkCoalescer(max_delay_ms=20, max_bytes=512)):
+            received.append((batch, time.monotonic() - start))
+        self.assertEqual([batch for batch, _ in received], ['Hel', 'lo'])
+        # Sent after the coalescing interval, not when the stall ended
+        self.assertLess(received[0][1], 0.2)
+
+    async def test_without_coalescer_every_delta_passes_through(self):
+        async def chunks():
+            yield event('a') + event('b')
+            yield b'data: [DONE]\n\n'
+
+        self.assertEqual([delta async for delta in aiter_content(chunks())], ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()